@@ -0,0 +1,102 @@
+"""
+Sample row parse benchmark against a synthetic catalogue CSV.
+
+Compares the legacy rows (Python literals read with ast.literal_eval) with
+the current JSON rows, for parsing alone and for a full load through the
+sample store. Legacy rows with a quote in a value, which literal_eval cannot
+read and which decode as raw strings, are timed separately. Run from the
+project directory (the one with manage.py):
+    python -m benchmarks.sampleCodec --rows 50000 --keys 4
+"""
+import os
+import csv
+import time
+import random
+import argparse
+import tempfile
+
+from jukbox import CsvHandler
+from jukbox.CsvHandler import dictToString, decodeRow, rowToSample, ROW_VERSION
+from jukbox.SampleStore import SampleStore
+
+
+def syntheticRows(rows: int, keys: int, seed: int = 1, quoted: bool = False):
+    """
+    Yields (idNum, name, data, img, misc) with keys entries in each of data and img.
+    With quoted, misc holds a value the legacy format cannot round trip.
+    """
+    rng = random.Random(seed)
+    for i in range(rows):
+        name = f"sample{i:06d}"
+        data = {f"wave{k}_{rng.randrange(1000)}": f"Samples/{name}/data/w{k}.mseed" for k in range(keys)}
+        img = {f"spectro{k}_{rng.randrange(1000)}": f"Samples/{name}/img/s{k}.png" for k in range(keys)}
+        misc = {"station": f"N{rng.randrange(100):02d}.S{rng.randrange(500):03d}", "note": "picked, reviewed"}
+        if quoted:
+            misc["note"] = "it's \"quoted\""
+        yield i, name, data, img, misc
+
+
+def writeLegacy(path: str, rows: int, keys: int, quoted: bool = False) -> None:
+    # What the old toCsvLine wrote, one row per line.
+    with open(path, 'w') as f:
+        for idNum, name, data, img, misc in syntheticRows(rows, keys, quoted=quoted):
+            f.write(f"{idNum},{name},{dictToString(data)},{dictToString(img)},{dictToString(misc)}\n")
+
+
+def writeCurrent(path: str, rows: int, keys: int) -> None:
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for idNum, name, data, img, misc in syntheticRows(rows, keys):
+            writer.writerow([idNum, name, CsvHandler.encodeField(data), CsvHandler.encodeField(img), CsvHandler.encodeField(misc), ROW_VERSION])
+
+
+def readRows(path: str) -> list:
+    with open(path, 'r', newline='') as f:
+        return list(csv.reader(f))
+
+
+def timed(label, fn, repeat, rows):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<36} {best * 1000:10.1f} ms {rows / best:14,.0f} rows/s")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--keys", type=int, default=4)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        legacyPath = os.path.join(directory, "legacy.csv")
+        currentPath = os.path.join(directory, "current.csv")
+        malformedPath = os.path.join(directory, "malformed.csv")
+        writeLegacy(legacyPath, args.rows, args.keys)
+        writeLegacy(malformedPath, args.rows, args.keys, quoted=True)
+        writeCurrent(currentPath, args.rows, args.keys)
+        print(f"{args.rows} rows, {args.keys} keys per dict; "
+              f"legacy {os.path.getsize(legacyPath) / 1e6:.1f} MB, current {os.path.getsize(currentPath) / 1e6:.1f} MB")
+
+        legacyRows = readRows(legacyPath)
+        currentRows = readRows(currentPath)
+        malformedRows = readRows(malformedPath)
+        timed("csv.reader only", lambda: readRows(currentPath), args.repeat, args.rows)
+        timed("decode legacy (literal_eval)", lambda: [decodeRow(r) for r in legacyRows], args.repeat, args.rows)
+        timed("decode legacy, malformed misc", lambda: [decodeRow(r) for r in malformedRows], args.repeat, args.rows)
+        timed("decode current (json)", lambda: [decodeRow(r) for r in currentRows], args.repeat, args.rows)
+        timed("rowToSample current", lambda: [rowToSample(r) for r in currentRows], args.repeat, args.rows)
+        timed("store load + records, legacy", lambda: [rowToSample(r) for r in SampleStore(legacyPath).allRows()], args.repeat, args.rows)
+        timed("store load + records, current", lambda: [rowToSample(r) for r in SampleStore(currentPath).allRows()], args.repeat, args.rows)
+
+        # Migration in place, then the same load as the current format.
+        timed("csvMigrate legacy -> current", lambda: CsvHandler.csvMigrate(legacyPath), 1, args.rows)
+        timed("store load + records, migrated", lambda: [rowToSample(r) for r in SampleStore(legacyPath).allRows()], args.repeat, args.rows)
+
+
+if __name__ == "__main__":
+    main()
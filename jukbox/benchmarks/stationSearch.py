@@ -0,0 +1,130 @@
+"""
+Station selection benchmark against a synthetic inventory.
+
+Run from the project directory (the one with manage.py):
+    python -m benchmarks.stationSearch --networks 200 --stations 50 --events 10
+"""
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from obspy import UTCDateTime
+from obspy.core.inventory import Inventory, Network, Station, Channel
+
+from jukbox.StationIndex import StationIndex, channelArrays, selectClosest, kClosest
+
+
+APPROVED = ["BHZ", "MXZ"]
+CODES = ["BHZ", "BHN", "BHE", "MXZ", "LHZ"]
+
+
+def syntheticInventory(networks: int, stations: int, channels: int, epochs: int, seed: int = 1) -> Inventory:
+    rng = random.Random(seed)
+    nets = []
+    for n in range(networks):
+        stas = []
+        for s in range(stations):
+            lat = rng.uniform(-60, 60)
+            lon = rng.uniform(-180, 180)
+            chans = []
+            for c in range(channels):
+                code = CODES[c % len(CODES)]
+                for e in range(epochs):
+                    start = UTCDateTime(1990 + 5 * e, 1, 1)
+                    end = UTCDateTime(1995 + 5 * e, 1, 1) if e < epochs - 1 else None
+                    chans.append(Channel(code, f"{c // len(CODES):02d}", lat, lon, 0.0, 0.0, start_date=start, end_date=end))
+            stas.append(Station(f"S{s:03d}", lat, lon, 0.0, channels=chans))
+        nets.append(Network(f"N{n:03d}", stations=stas))
+    return Inventory(networks=nets, source="benchmark")
+
+
+def syntheticWindows(events: int, seed: int = 2) -> dict:
+    rng = random.Random(seed)
+    windows = {}
+    for i in range(events):
+        origin = UTCDateTime(1990, 1, 1) + rng.uniform(0, 30 * 365 * 86400)
+        windows[i] = (origin - 5 * 60, origin + 1800)
+    return windows
+
+
+def legacy(inventory, windows, lat, lon, k):
+    """The original one-thread-per-network loop with a shared lock and get_coordinates per hit."""
+    from jukbox.StationIndex import getStationDistances
+    results = {eventId: kClosest(eventId, k) for eventId in windows}
+    lock = threading.Lock()
+
+    def processNetwork(network):
+        for station in network:
+            for eventId, (starttime, endtime) in windows.items():
+                for channel in station.channels:
+                    if channel.code not in APPROVED:
+                        continue
+                    if channel.start_date and channel.start_date > endtime:
+                        continue
+                    if channel.end_date and channel.end_date < starttime:
+                        continue
+                    seedId = f"{network.code}.{station.code}.{channel.location_code}.{channel.code}"
+                    try:
+                        coords = inventory.get_coordinates(seedId, starttime)
+                    except Exception:
+                        continue
+                    distance = float(getStationDistances([coords["latitude"]], [coords["longitude"]], lat, lon)[0])
+                    with lock:
+                        results[eventId].append({'seedId': seedId, 'distance': distance})
+                    break
+
+    threads = [threading.Thread(target=processNetwork, args=(network,)) for network in inventory]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def timed(label, fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    print(f"{label:<40} {best * 1000:10.1f} ms")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--networks", type=int, default=100)
+    parser.add_argument("--stations", type=int, default=40)
+    parser.add_argument("--channels", type=int, default=5)
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--events", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    inventory = syntheticInventory(args.networks, args.stations, args.channels, args.epochs)
+    windows = syntheticWindows(args.events)
+    lat, lon, k = 10.0, 20.0, 5
+    total = args.networks * args.stations * args.channels * args.epochs
+    print(f"{args.networks} networks, {total} channel epochs, {args.events} events")
+
+    if not args.skip_legacy:
+        timed("legacy threads + lock", lambda: legacy(inventory, windows, lat, lon, k), args.repeat)
+
+    channels = channelArrays(inventory, APPROVED)
+    timed("channelArrays (flatten inventory)", lambda: channelArrays(inventory, APPROVED), args.repeat)
+    timed("selectClosest inline", lambda: selectClosest(channels, windows, lat, lon, k), args.repeat)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        timed(f"selectClosest {args.workers} workers", lambda: selectClosest(channels, windows, lat, lon, k, executor, minParallelRows=0), args.repeat)
+
+    index = StationIndex(APPROVED)
+    timed("StationIndex.add (cold)", lambda: (index.reset(), index.add(inventory)), 1)
+    timed("StationIndex.query + selectClosest", lambda: selectClosest(index.query(lat, lon, 60), windows, lat, lon, k), args.repeat)
+    timed("StationIndex.select (cached epochs)", lambda: index.select(lat, lon, 60, windows, k), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import io
+import time
+import asyncio
+import weakref
+import threading
+
+import httpx
+from obspy import UTCDateTime, read_events, read_inventory
+from obspy.core.event import Catalog
+from obspy.clients.fdsn.header import URL_MAPPINGS
+
+from jukbox.EventCache import eventCache
+from jukbox.ClientPool import clientPool, providerName
+
+
+EVENT_PATH = "/fdsnws/event/1/query"
+STATION_PATH = "/fdsnws/station/1/query"
+
+
+def providerUrl(provider: str) -> str:
+    """
+    Base URL for a provider name.
+    Raises:
+        ValueError: If the name is not a known FDSN provider. URLs are not accepted.
+    """
+    return URL_MAPPINGS[providerName(provider)].replace("http://", "https://", 1)
+
+
+def fdsnTime(t) -> str:
+    return UTCDateTime(t).format_iris_web_service()
+
+
+class AsyncFdsnClient:
+    """
+    Minimal asyncio FDSN client for the event and station services.
+
+    Requests go straight over a shared httpx.AsyncClient, so a search waiting
+    on a provider holds no thread. At most `perProvider` requests run against
+    a provider at once; the health counters are shared with clientPool so
+    /fdsn_health/ reports both the sync and async paths.
+
+    Parsing QuakeML and StationXML is CPU bound and runs in a worker thread.
+
+    Sync code calls in through runSync, which runs every coroutine on one
+    long lived loop in a background thread. A fresh loop per call, as
+    async_to_sync makes under WSGI, would get a fresh HTTP client each time
+    whose connections are never closed.
+    """
+
+    def __init__(self, timeout: float = 60, maxConnections: int = 100, perProvider: int = 16):
+        """
+        Args:
+            timeout (float): Network timeout per request in seconds.
+            maxConnections (int): Connection limit of the shared HTTP client.
+            perProvider (int): Maximum concurrent requests per provider.
+        """
+        self.timeout = timeout
+        self.maxConnections = maxConnections
+        self.perProvider = perProvider
+        # httpx clients and asyncio semaphores belong to one event loop.
+        self.loops = weakref.WeakKeyDictionary()
+        self.bridge = None
+        self.bridgeLock = threading.Lock()
+
+    def runSync(self, coroutine):
+        """
+        Runs a coroutine from sync code on the shared background loop and waits for its result.
+        Must not be called from a coroutine.
+        """
+        with self.bridgeLock:
+            if self.bridge is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="fdsn-bridge", daemon=True).start()
+                self.bridge = loop
+        return asyncio.run_coroutine_threadsafe(coroutine, self.bridge).result()
+
+    def state(self):
+        loop = asyncio.get_running_loop()
+        state = self.loops.get(loop)
+        if state is None:
+            http = httpx.AsyncClient(
+                timeout=self.timeout,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=self.maxConnections, max_keepalive_connections=self.maxConnections // 4)
+            )
+            state = (http, {})
+            self.loops[loop] = state
+        return state
+
+    async def fetch(self, provider: str, path: str, params: dict = None, data: str = None) -> bytes:
+        """
+        Runs one FDSN request. A body in `data` is POSTed, otherwise params go in the query string.
+        Returns:
+            bytes: The response body.
+            None: If the provider has no data for the request (204 or 404).
+        Raises:
+            ConnectionError: If the provider is marked unhealthy.
+            httpx.HTTPError: On network errors or any other error status.
+        """
+        pool = clientPool.pool(provider)
+        if not pool.isHealthy():
+            raise ConnectionError(f"FDSN provider {provider} is marked unhealthy: {pool.lastError}")
+
+        http, slots = self.state()
+        slot = slots.setdefault(provider, asyncio.Semaphore(self.perProvider))
+        url = providerUrl(provider) + path
+        async with slot:
+            start = time.monotonic()
+            try:
+                if data is None:
+                    response = await http.get(url, params=params)
+                else:
+                    response = await http.post(url, content=data)
+                if response.status_code in (204, 404):
+                    pool.recordSuccess(time.monotonic() - start)
+                    return None
+                response.raise_for_status()
+            except asyncio.CancelledError:
+                # The caller went away; that says nothing about the provider.
+                raise
+            except Exception as e:
+                pool.recordFailure(time.monotonic() - start, e, clientPool.maxFailures, clientPool.cooldown)
+                raise
+            pool.recordSuccess(time.monotonic() - start)
+            return response.content
+
+    async def getEvents(self, provider, lat, lon, maxRad, starttime, endtime, minMag=None, limit=10) -> Catalog:
+        """Async counterpart of Map.getEvents, sharing its event cache."""
+        cached = await asyncio.to_thread(eventCache.get, provider, lat, lon, maxRad, starttime, endtime, minMag, limit)
+        if cached is not None:
+            return cached
+
+        params = {
+            'latitude': lat,
+            'longitude': lon,
+            'maxradius': maxRad,
+            'starttime': fdsnTime(starttime),
+            'endtime': fdsnTime(endtime),
+            'includeallorigins': 'true',
+            'orderby': 'magnitude',
+            'limit': limit,
+            'format': 'xml',
+        }
+        if minMag not in (None, ""):
+            params['minmagnitude'] = minMag
+        body = await self.fetch(provider, EVENT_PATH, params=params)
+        catalog = Catalog() if body is None else await asyncio.to_thread(read_events, io.BytesIO(body))
+        await asyncio.to_thread(eventCache.put, provider, lat, lon, maxRad, starttime, endtime, minMag, limit, catalog)
+        return catalog
+
+    async def getStations(self, provider, channels, lat, lon, maxRad, windows):
+        """
+        Async counterpart of the get_stations_bulk call in Map.warmStationIndex:
+        channel level inventory around a point, one bulk line per time window,
+        keeping only channels with data in a window.
+        Args:
+            windows (list): (starttime, endtime) pairs, typically one per event.
+        Returns:
+            Inventory: The parsed StationXML.
+            None: If the provider has no matching channels.
+        """
+        params = {
+            'level': 'channel',
+            'latitude': lat,
+            'longitude': lon,
+            'maxradius': maxRad,
+            'includeavailability': 'true',
+            'matchtimeseries': 'true',
+            'includerestricted': 'false',
+            'nodata': 204,
+        }
+        lines = [f"{key}={value}" for key, value in params.items()]
+        cStr = ",".join(channels)
+        lines += [f"* * * {cStr} {fdsnTime(start)} {fdsnTime(end)}" for start, end in windows]
+        body = await self.fetch(provider, STATION_PATH, data="\n".join(lines))
+        if body is None:
+            return None
+        return await asyncio.to_thread(read_inventory, io.BytesIO(body), format="STATIONXML")
+
+    async def close(self) -> None:
+        state = self.loops.pop(asyncio.get_running_loop(), None)
+        if state is not None:
+            await state[0].aclose()
+
+
+asyncFdsn = AsyncFdsnClient()
@@ -0,0 +1,179 @@
+import os
+import atexit
+import hashlib
+import threading
+import multiprocessing
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from jukbox.DiskCache import DiskLru, CACHE_DIR
+
+
+BEACHBALL_DIR = os.path.join(CACHE_DIR, "beachballs")
+BEACHBALL_URL = "/beachball/"
+
+# Upper magnitude bound of each colour tier; anything above the last bound is black.
+MAG_COLOR_TIERS = [
+    (1.0, 'white'),
+    (2.0, 'aqua'),
+    (3.0, 'teal'),
+    (4.0, 'lime'),
+    (5.0, 'yellow'),
+    (6.0, 'orange'),
+    (7.0, 'red'),
+    (8.0, 'maroon'),
+]
+_tierBounds = [bound for bound, _ in MAG_COLOR_TIERS]
+_tierColors = [color for _, color in MAG_COLOR_TIERS] + ['black']
+
+
+def magToColor(mag) -> str:
+    """Maps a magnitude onto its colour tier. Events without a magnitude use the lowest tier."""
+    if mag is None:
+        return _tierColors[0]
+    return _tierColors[bisect_left(_tierBounds, mag)]
+
+
+def beachballKey(components: list, color: str, size: int) -> str:
+    """
+    Content hash of everything that affects the rendered image.
+    Components are formatted to 6 significant digits, well below what is visible at icon size.
+    """
+    text = ",".join(f"{float(c):.6e}" for c in components) + f"|{color}|{int(size)}"
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def warmWorker():
+    """Pool initializer: pay the matplotlib and obspy.imaging import once per worker."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot
+    import obspy.imaging.beachball
+
+
+def renderBeachball(components: list, color: str, size: int, path: str) -> str:
+    """Runs in a pool worker. Writes next to the target and renames so readers never see a partial PNG."""
+    import matplotlib.pyplot as plt
+    from obspy.imaging.beachball import beachball
+
+    tmpPath = f"{path[:-4]}.{os.getpid()}.tmp.png"
+    fig = beachball(components, size=size, facecolor=color, outfile=tmpPath)
+    plt.close(fig)
+    os.replace(tmpPath, path)
+    return path
+
+
+class BeachballCache:
+    """
+    Renders each distinct beachball once, in a pool of worker processes, and
+    serves it from a size bounded cache directory. submit() returns the cache
+    key straight away; the beachball_icon view waits for the render to land
+    before answering, so url(key) is valid as soon as it is handed out.
+    """
+
+    def __init__(self, directory: str = BEACHBALL_DIR, urlPrefix: str = BEACHBALL_URL, maxBytes: int = 32 * 1024 * 1024, workers: int = None):
+        self.store = DiskLru(directory, maxBytes)
+        self.urlPrefix = urlPrefix
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.executor = None
+
+    def pool(self) -> ProcessPoolExecutor:
+        # Created lazily so importing this module (including from a spawned worker) starts no processes.
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=warmWorker
+                )
+                atexit.register(self.shutdown)
+            return self.executor
+
+    def submit(self, components: list, color: str, size: int = 50) -> str:
+        """
+        Queues the beachball for the given tensor if it is not cached yet.
+        Args:
+            components (list): Moment tensor as [m_rr, m_tt, m_pp, m_rt, m_rp, m_tp].
+            color (str): Face colour, normally from magToColor.
+            size (int): Icon size in points.
+        Returns:
+            str: Cache key; url(key) gives the URL the browser can load the PNG from.
+        """
+        key = beachballKey(components, color, size)
+        path = self.path(key)
+        if self.store.touch(path):
+            return key
+
+        executor = self.pool()
+        with self.lock:
+            if key in self.inflight:
+                return key
+            future = executor.submit(renderBeachball, list(components), color, size, path)
+            self.inflight[key] = future
+        future.add_done_callback(lambda f: self.finished(key, f))
+        return key
+
+    def url(self, key: str) -> str:
+        return f"{self.urlPrefix}{key}.png"
+
+    def isReady(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def completed(self, keys: list, timeout: float = 30):
+        """Yields keys as their renders finish successfully, in completion order."""
+        futures = {}
+        for key in keys:
+            with self.lock:
+                future = self.inflight.get(key)
+            if future is None:
+                if self.isReady(key):
+                    yield key
+                continue
+            futures[future] = key
+        try:
+            for future in as_completed(futures, timeout=timeout):
+                if self.isReady(futures[future]):
+                    yield futures[future]
+        except TimeoutError:
+            print(f"Timed out waiting for {len(futures)} beachball renders.")
+
+    def finished(self, key: str, future) -> None:
+        with self.lock:
+            self.inflight.pop(key, None)
+        try:
+            self.store.added(future.result())
+        except Exception as e:
+            print(f"Error rendering beachball {key}: {e}")
+
+    def path(self, key: str) -> str:
+        return self.store.path(f"{key}.png")
+
+    def wait(self, key: str, timeout: float = 30) -> str:
+        """
+        Returns the file path for a key once it has been rendered.
+        Returns:
+            str: Path to the PNG.
+            None: If the key is unknown, failed to render, or timed out.
+        """
+        path = self.path(key)
+        if self.store.touch(path):
+            return path
+        with self.lock:
+            future = self.inflight.get(key)
+        if future is None:
+            return None
+        try:
+            future.result(timeout=timeout)
+        except Exception as e:
+            print(f"Beachball {key} not ready: {e}")
+            return None
+        return path if os.path.exists(path) else None
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+beachballCache = BeachballCache()
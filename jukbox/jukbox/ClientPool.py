@@ -0,0 +1,207 @@
+import time
+import queue
+import threading
+from contextlib import contextmanager
+
+from obspy.clients.fdsn import Client
+from obspy.clients.fdsn.header import FDSNNoDataException, URL_MAPPINGS
+
+
+def providerName(provider: str, allowed: list = None) -> str:
+    """
+    Canonical name of a provider taken from a request.
+    Only known names are accepted, never URLs, so a request cannot point
+    the server at a host of its choosing or add pools without bound.
+    Args:
+        provider (str): Provider name, any case.
+        allowed (list): Names accepted. Defaults to every provider obspy knows.
+    Raises:
+        ValueError: For any other name.
+    """
+    name = str(provider).strip().upper()
+    if name not in (URL_MAPPINGS if allowed is None else allowed):
+        raise ValueError(f"Unknown FDSN provider: {provider}")
+    return name
+
+
+class ProviderPool:
+    """
+    Initialized FDSN clients for a single provider plus its health counters.
+    At most `size` requests run against the provider at once.
+    """
+
+    def __init__(self, provider: str, size: int, timeout: int):
+        self.provider = provider
+        self.size = size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.created = 0
+        self.inUse = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutiveFailures = 0
+        self.totalLatency = 0.0
+        self.recentLatency = None
+        self.lastError = None
+        self.unhealthyUntil = 0.0
+
+    def checkout(self) -> Client:
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        # Service discovery happens here, once per pooled client instead of once per call.
+        client = Client(self.provider, timeout=self.timeout)
+        with self.lock:
+            self.created += 1
+        return client
+
+    def checkin(self, client: Client) -> None:
+        self.idle.put(client)
+
+    def trackLatency(self, latency: float, weight: float = 0.2) -> None:
+        # Exponentially weighted, so routing follows how the provider behaves now rather than since startup.
+        if self.recentLatency is None:
+            self.recentLatency = latency
+        else:
+            self.recentLatency += weight * (latency - self.recentLatency)
+
+    def recordSuccess(self, latency: float) -> None:
+        with self.lock:
+            self.requests += 1
+            self.totalLatency += latency
+            self.trackLatency(latency)
+            self.consecutiveFailures = 0
+            self.unhealthyUntil = 0.0
+
+    def recordFailure(self, latency: float, error: Exception, maxFailures: int, cooldown: int) -> None:
+        with self.lock:
+            self.requests += 1
+            self.failures += 1
+            self.totalLatency += latency
+            self.trackLatency(latency)
+            self.consecutiveFailures += 1
+            self.lastError = str(error)
+            if self.consecutiveFailures >= maxFailures:
+                self.unhealthyUntil = time.monotonic() + cooldown
+
+    def isHealthy(self) -> bool:
+        return time.monotonic() >= self.unhealthyUntil
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'provider': self.provider,
+                'healthy': self.isHealthy(),
+                'created': self.created,
+                'idle': self.idle.qsize(),
+                'inUse': self.inUse,
+                'requests': self.requests,
+                'failures': self.failures,
+                'consecutiveFailures': self.consecutiveFailures,
+                'avgLatency': self.totalLatency / self.requests if self.requests else None,
+                'recentLatency': self.recentLatency,
+                'lastError': self.lastError,
+            }
+
+
+class ClientPool:
+    """
+    Process wide pool of obspy FDSN clients, one ProviderPool per provider name.
+
+    Usage:
+        with clientPool.client("IRIS") as client:
+            client.get_events(...)
+    """
+
+    def __init__(self, size: int = 4, timeout: int = 60, waitTimeout: int = 30, maxFailures: int = 3, cooldown: int = 30):
+        """
+        Args:
+            size (int): Maximum clients, and so concurrent requests, per provider.
+            timeout (int): Network timeout handed to each obspy Client.
+            waitTimeout (int): Seconds to wait for a free client before giving up.
+            maxFailures (int): Consecutive failures before a provider is marked unhealthy.
+            cooldown (int): Seconds an unhealthy provider is skipped before being retried.
+        """
+        self.size = size
+        self.timeout = timeout
+        self.waitTimeout = waitTimeout
+        self.maxFailures = maxFailures
+        self.cooldown = cooldown
+        self.pools = {}
+        self.lock = threading.Lock()
+
+    def pool(self, provider: str) -> ProviderPool:
+        """
+        Raises:
+            ValueError: If the provider is not a known FDSN provider name.
+        """
+        provider = providerName(provider)
+        with self.lock:
+            pool = self.pools.get(provider)
+            if pool is None:
+                pool = ProviderPool(provider, self.size, self.timeout)
+                self.pools[provider] = pool
+            return pool
+
+    @contextmanager
+    def client(self, provider: str):
+        """
+        Checks out an initialized client for the provider.
+        Raises:
+            ConnectionError: If the provider is marked unhealthy.
+            TimeoutError: If no client frees up within waitTimeout.
+        """
+        pool = self.pool(provider)
+        if not pool.isHealthy():
+            raise ConnectionError(f"FDSN provider {provider} is marked unhealthy: {pool.lastError}")
+        if not pool.slots.acquire(timeout=self.waitTimeout):
+            raise TimeoutError(f"No free FDSN client for {provider} after {self.waitTimeout}s")
+        start = time.monotonic()
+        client = None
+        with pool.lock:
+            pool.inUse += 1
+        try:
+            client = pool.checkout()
+            yield client
+            pool.recordSuccess(time.monotonic() - start)
+        except FDSNNoDataException:
+            # An empty answer still means the provider is up.
+            pool.recordSuccess(time.monotonic() - start)
+            raise
+        except Exception as e:
+            pool.recordFailure(time.monotonic() - start, e, self.maxFailures, self.cooldown)
+            raise
+        finally:
+            if client is not None:
+                pool.checkin(client)
+            with pool.lock:
+                pool.inUse -= 1
+            pool.slots.release()
+
+    def isHealthy(self, provider: str) -> bool:
+        return self.pool(provider).isHealthy()
+
+    def warm(self, providers: list) -> None:
+        """Creates one client per provider so the first search skips service discovery."""
+        for provider in providers:
+            try:
+                with self.client(provider):
+                    pass
+            except Exception as e:
+                print(f"Could not warm FDSN client for {provider}: {e}")
+
+    def warmAsync(self, providers: list) -> threading.Thread:
+        t = threading.Thread(target=self.warm, args=(providers,), daemon=True)
+        t.start()
+        return t
+
+    def health(self) -> dict:
+        with self.lock:
+            pools = list(self.pools.values())
+        return {pool.provider: pool.stats() for pool in pools}
+
+
+clientPool = ClientPool()
@@ -1,10 +1,19 @@
 from io import StringIO
 import os
-from jukbox.Sample import Sample
+from jukbox.Sample import Sample, SampleRecord
+from jukbox.SampleStore import storeFor
 import ast
 import csv
+import json
+from collections.abc import Mapping
 
 
+# Rows are written as: idNum, name, data, img, misc, ROW_VERSION, with the
+# three dict columns as JSON. Legacy rows have no version column and hold
+# Python literals from dictToString; they are still read, through
+# fieldHandler, and are rewritten in this format when the store compacts.
+ROW_VERSION = "2"
+
 
 def dictToString(d: dict) -> str:
     if not d:
@@ -23,7 +32,73 @@ def toCsvLine(sample: Sample) -> str:
         Returns:
         str: A string representing the Sample object in CSV format.
     """
-    return str(sample.idNum) + "," + sample.name + "," + dictToString(sample.data) + "," + dictToString(sample.img) + "," + dictToString(sample.misc)
+    line = StringIO()
+    csv.writer(line).writerow(sampleToRow(sample))
+    return line.getvalue().rstrip("\r\n")
+
+
+def encodeField(value) -> str:
+    # SampleRecord fields are read only mappings, which json does not take as they are.
+    if isinstance(value, Mapping) and not isinstance(value, dict):
+        value = dict(value)
+    return json.dumps(value, separators=(',', ':'), default=str)
+
+
+def sampleToRow(sample: Sample) -> list:
+    """The CSV fields of a Sample in the current row format."""
+    return [str(sample.idNum), sample.name, encodeField(sample.data), encodeField(sample.img), encodeField(sample.misc), ROW_VERSION]
+
+
+def decodeRow(row: list) -> tuple:
+    """
+    Parses a CSV row of either format.
+    Returns:
+        tuple: (idNum, name, data, img, misc)
+    """
+    if len(row) > 5 and row[5] == ROW_VERSION:
+        return int(row[0]), row[1], json.loads(row[2]), json.loads(row[3]), json.loads(row[4])
+    fields = [fieldHandler(field) for field in row]
+    return int(fields[0]), fields[1], fields[2], fields[3], fields[4]
+
+
+def sampleStore(fileName: str):
+    return storeFor(fileName, migrateRow, rowKeys)
+
+
+def rowKeys(row: list) -> dict:
+    """The img and data dicts of a stored row, for the store's key index."""
+    try:
+        _, _, data, img, _ = decodeRow(row)
+    except (ValueError, IndexError, SyntaxError):
+        return {}
+    return {"img": img, "data": data}
+
+
+def csvMigrate(fileName: str) -> None:
+    """Rewrites a sample CSV now with every row in the current format."""
+    requireFile(fileName)
+    sampleStore(fileName).compactNow()
+
+
+def migrateRow(row: list) -> list:
+    """
+    A row in the current format; legacy rows are decoded and re-encoded.
+    Legacy rows that do not decode, or whose dict columns are not dict
+    literals (e.g. a quote inside a value), are reported and kept as they
+    are rather than stored as JSON strings.
+    """
+    if len(row) > 5 and row[5] == ROW_VERSION:
+        return row
+    try:
+        idNum, name, data, img, misc = decodeRow(row)
+    except (ValueError, IndexError) as e:
+        print(f"Keeping legacy sample row {row[:2]} as is, it does not parse: {e}")
+        return row
+    broken = [column for column, value in (("data", data), ("img", img), ("misc", misc)) if not isinstance(value, dict)]
+    if broken:
+        print(f"Keeping legacy sample row {idNum} as is, its {', '.join(broken)} column is not a dict literal.")
+        return row
+    return [str(idNum), str(name), encodeField(data), encodeField(img), encodeField(misc), ROW_VERSION]
 
 
 def fieldHandler(field):
@@ -53,51 +128,42 @@ def fieldHandler(field):
 
 
 
-def rowToSample (row: list) -> Sample:
+def rowToSample (row: list) -> SampleRecord:
     """
-    Converts a row list from a CSV file to a Sample object.
+    Converts a row list from a CSV file to a read only SampleRecord.
+    Pure parsing; use record.toSample() for a Sample to modify.
     Args:
         row (list): The row to convert.
     Returns:
-        Sample: A Sample object created from the row.
+        SampleRecord: A record created from the row.
     """
-    fields = [fieldHandler(field) for field in row]
-    idNum = int(fields[0])
-    name = fields[1]
-    try:
-        sample = Sample(name)
-    except FileExistsError:
-        pass
-    sample.idNum = idNum
-    sample.data = fields[2]
-    sample.img = fields[3]
-    sample.misc = fields[4]
-    return sample
+    return SampleRecord(*decodeRow(row))
 
 
 def csvToSamples(fileName: str) -> list:
     samples = []
     try: 
-        with open(fileName, 'r') as csvFile:
-            reader = csv.reader(csvFile)
-            for row in reader:
-                samples.append(rowToSample(row))
-            if (len(samples) == 0):
-                return []
-            print(samples)
-            return samples
+        if not os.path.exists(fileName):
+            raise FileNotFoundError(f"File {fileName} not found.")
+        for row in sampleStore(fileName).allRows():
+            samples.append(rowToSample(row))
+        if (len(samples) == 0):
+            return []
+        print(samples)
+        return samples
     except Exception as e:
         print(e)
         print(samples)
         return samples
 
-def strToSample(csvString: str) -> Sample:
+
+def strToSample(csvString: str) -> SampleRecord:
     """
-    Converts a CSV string to a Sample object.
+    Converts a CSV string to a SampleRecord.
     Args:
         csvString (str): The CSV string to convert.
         Returns:
-        Sample: A Sample object created from the CSV string.
+        SampleRecord: A record created from the CSV string.
         """
     reader = csv.reader(StringIO(csvString.strip()))
     row = next(reader)
@@ -114,12 +180,7 @@ def csvCreate(sample: Sample, fileName: str) -> None:
     Raises:
         ValueError: If a sample with the same ID or name already exists in the CSV file.
     """
-    with open(fileName, 'a', newline='') as csvFile:
-        if csvReadById(fileName, sample.idNum):
-            raise ValueError(f"Sample with id {sample.idNum} already exists.")
-        if csvReadByName(fileName, sample.name):
-            raise ValueError(f"Sample with name {sample.name} already exists.")
-        csvFile.write(toCsvLine(sample))
+    sampleStore(fileName).insert(sampleToRow(sample))
 
 def csvUpdate(sample: Sample, fileName: str) -> bool:
     """
@@ -142,27 +203,7 @@ def csvUpdate(sample: Sample, fileName: str) -> bool:
     Raises:
         FileNotFoundError: If the specified CSV file does not exist.
     """ 
-    found = False
-    if not os.path.exists(fileName):
-        csvCreate(sample, fileName)
-        #raise FileNotFoundError(f"File {fileName} not found.")
-    with open(fileName, 'r') as csvFile:
-        reader = csv.reader(csvFile)
-        rows = list(reader)
-
-    with open(fileName, 'w', newline='') as csvFile:
-        writer = csv.writer(csvFile)
-        for row in rows:
-            if int(row[0]) == sample.idNum:
-                csvFile.write(toCsvLine(sample))  # Your original write
-                found = True
-            else:
-                writer.writerow(row)
-
-        if not found:
-            csvFile.write(toCsvLine(sample))  # Moved inside the `with` block
-            return False        
-    return True
+    return sampleStore(fileName).upsert(sampleToRow(sample))
         
 
 def csvReadFile(fileName: str) -> list:
@@ -175,51 +216,41 @@ def csvReadFile(fileName: str) -> list:
     Raises:
         FileNotFoundError: If the specified CSV file does not exist.
         """
-    with open(fileName, 'r') as csvFile:
-        reader = csv.reader(csvFile)
-        data = []
-        for row in reader:
-            data.append(row)
-    return data
+    requireFile(fileName)
+    return [list(row) for row in sampleStore(fileName).allRows()]
 
 
-def csvReadById(fileName: str, idNum: int) -> Sample:
+def csvReadById(fileName: str, idNum: int) -> SampleRecord:
     """
-    Reads a CSV file and returns the Sample object corresponding to the given ID.
+    Reads a CSV file and returns the SampleRecord corresponding to the given ID.
     Args:
         fileName (str): Path to the CSV file.
         idNum (int): The ID of the Sample to read.
     Returns:
-        Sample: The Sample object corresponding to the given ID.
+        SampleRecord: The record corresponding to the given ID.
         None: If no Sample with the given ID is found.
     Raises:
         FileNotFoundError: If the specified CSV file does not exist.
         """
-    with open(fileName, 'r') as csvFile:
-        reader = csv.reader(csvFile)
-        for row in reader:
-            if int(row[0]) == idNum:
-                return rowToSample(row)
-    return None
-
-def csvReadByName(fileName: str, name: str) -> Sample:    
+    requireFile(fileName)
+    row = sampleStore(fileName).byId(idNum)
+    return None if row is None else rowToSample(row)
+
+def csvReadByName(fileName: str, name: str) -> SampleRecord:    
     """
-    Reads a CSV file and returns the Sample object corresponding to the given name.
+    Reads a CSV file and returns the SampleRecord corresponding to the given name.
     Args:
         fileName (str): Path to the CSV file.
         name (str): The name of the Sample to read.
     Returns:
-        Sample: The Sample object corresponding to the given name.
+        SampleRecord: The record corresponding to the given name.
         None: If no Sample with the given name is found.
     Raises:
         FileNotFoundError: If the specified CSV file does not exist.
         """
-    with open(fileName, 'r') as csvFile:
-        reader = csv.reader(csvFile)
-        for row in reader:
-            if row[1] == name:
-                return rowToSample(row)
-    return None
+    requireFile(fileName)
+    row = sampleStore(fileName).byName(name)
+    return None if row is None else rowToSample(row)
 
 
 def csvDeleteById(fileName: str, idNum: int) -> None:
@@ -231,14 +262,8 @@ def csvDeleteById(fileName: str, idNum: int) -> None:
     Raises:
         FileNotFoundError: If the specified CSV file does not exist.
     """
-    with open(fileName, 'r') as csvFile:
-        reader = csv.reader(csvFile)
-        rows = list(reader)
-    with open(fileName, 'w', newline='') as csvFile:
-        writer = csv.writer(csvFile)
-        for row in rows:
-            if int(row[0]) != idNum:
-                writer.writerow(row) 
+    requireFile(fileName)
+    sampleStore(fileName).deleteById(idNum)
 
 def csvDeleteByName(fileName: str, name: str) -> None:
     """
@@ -249,42 +274,51 @@ def csvDeleteByName(fileName: str, name: str) -> None:
     Raises:
         FileNotFoundError: If the specified CSV file does not exist.
     """
-    with open(fileName, 'r') as csvFile:
-        reader = csv.reader(csvFile)
-        rows = list(reader)
-    with open(fileName, 'w', newline='') as csvFile:
-        writer = csv.writer(csvFile)
-        for row in rows:
-            if row[1] != name:
-                writer.writerow(row)
+    requireFile(fileName)
+    sampleStore(fileName).deleteByName(name)
+
+
+def csvSearchImgByKey(fileName: str, fragment: str, prefix: bool = False) -> list:
+    """
+    Samples in a CSV with an img key containing (or starting with) fragment,
+    found through the store's key index rather than by reading every sample.
+    Args:
+        fileName (str): Path to the CSV file.
+        fragment (str): Case sensitive, like Sample.SearchImgByKey.
+        prefix (bool): Match only keys starting with fragment.
+    Returns:
+        list: Matching SampleRecords in id order.
+    Raises:
+        FileNotFoundError: If the specified CSV file does not exist.
+    """
+    return csvSearchByKey(fileName, "img", fragment, prefix)
+
+
+def csvSearchDataByKey(fileName: str, fragment: str, prefix: bool = False) -> list:
+    """As csvSearchImgByKey, for data keys."""
+    return csvSearchByKey(fileName, "data", fragment, prefix)
+
+
+def csvSearchByKey(fileName: str, kind: str, fragment: str, prefix: bool = False) -> list:
+    requireFile(fileName)
+    store = sampleStore(fileName)
+    with store.lock:
+        rows = [store.rows[idNum] for idNum in sorted(store.searchKeys(kind, fragment, prefix))]
+    return [rowToSample(row) for row in rows]
 
 
 #Find the next free spot for an ID          
 def getNextID(fileName: str) -> int:
-        usedIDs = set()
-
         #Check CSV Exists
         if not os.path.exists(fileName):
             return 0 #Starting ID for new file
-        existingIDs = set()
-
         try:
-        #Get all IDs from CSV
-            with open(fileName, 'r') as csvFile:
-                reader = csv.reader(csvFile)
-                for row in reader:
-                    if not row:
-                        continue
-                    try:
-                        existingIDs.add(int(row[0]))
-                    except (ValueError, IndexError):
-                        continue #Skip invalid rows
-        #Find next avaialble ID from 0
-            nextID = 0
-            while nextID in existingIDs:
-                nextID += 1
-            return nextID
+            return sampleStore(fileName).nextId()
         except Exception as e:
             raise IOError(f"Failed to find next ID: {str(e)}")
 
-    
\ No newline at end of file
+
+def requireFile(fileName: str) -> None:
+    # The store keeps rows in memory; reads and deletes still fail on a missing file as they always have.
+    if not os.path.exists(fileName):
+        raise FileNotFoundError(f"File {fileName} not found.")
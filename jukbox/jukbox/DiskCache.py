@@ -0,0 +1,74 @@
+import os
+import threading
+
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache")
+
+
+class DiskLru:
+    """
+    Size bounded directory of cache files. Recency is tracked through file
+    mtimes, so the least recently used files go first when the directory
+    grows past maxBytes.
+    """
+
+    def __init__(self, directory: str, maxBytes: int):
+        self.directory = directory
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self.totalBytes = sum(size for _, size, _ in self.entries())
+
+    def path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def entries(self) -> list:
+        """Returns (path, size, mtime) for every file in the directory."""
+        out = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                out.append((entry.path, st.st_size, st.st_mtime))
+        return out
+
+    def touch(self, path: str) -> bool:
+        """Marks a file as recently used. Returns False if it has been evicted."""
+        try:
+            os.utime(path, None)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def added(self, path: str) -> None:
+        """Accounts for a newly written file and evicts if over budget."""
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+        with self.lock:
+            self.totalBytes += size
+            if self.totalBytes > self.maxBytes:
+                self.evict()
+
+    def removed(self, size: int) -> None:
+        with self.lock:
+            self.totalBytes -= size
+
+    def evict(self) -> None:
+        # Rescan so files removed behind our back do not skew the total.
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.maxBytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError as e:
+                print(f"Error evicting cache file {path}: {e}")
+        self.totalBytes = total
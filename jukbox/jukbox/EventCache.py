@@ -0,0 +1,215 @@
+import os
+import time
+import pickle
+import sqlite3
+import threading
+
+from obspy import UTCDateTime
+from obspy.core.event import Catalog
+from obspy.geodetics import locations2degrees
+
+from jukbox.DiskCache import CACHE_DIR
+
+
+class EventCache:
+    """
+    Disk backed cache for FDSN event queries.
+
+    Entries are keyed on the normalized query parameters and stored in a small
+    SQLite file so they survive restarts. The cache is bounded by entry count,
+    total payload size and age, and evicts the least recently used entries first.
+
+    A query that misses the exact key can still be answered from a wider cached
+    query (larger circle, longer date range, lower magnitude) as long as that
+    wider result was not truncated by its limit.
+    """
+
+    def __init__(self, path: str = None, maxEntries: int = 512, maxBytes: int = 64 * 1024 * 1024, ttl: int = 3600):
+        """
+        Args:
+            path (str): Path to the SQLite file. Defaults to cache/events.sqlite3.
+            maxEntries (int): Maximum number of cached queries.
+            maxBytes (int): Maximum total size of the cached payloads in bytes.
+            ttl (int): Maximum age of an entry in seconds.
+        """
+        if path is None:
+            path = os.path.join(CACHE_DIR, "events.sqlite3")
+        self.path = path
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.partialHits = 0
+        self.misses = 0
+        # The directory and file are made on first use, not at import.
+        self.created = False
+        self.createLock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        if not self.created:
+            self.create()
+        return sqlite3.connect(self.path, timeout=10)
+
+    def create(self) -> None:
+        with self.createLock:
+            if self.created:
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            try:
+                with conn:
+                    conn.execute(
+                        """CREATE TABLE IF NOT EXISTS events (
+                            key TEXT PRIMARY KEY,
+                            provider TEXT NOT NULL,
+                            lat REAL NOT NULL,
+                            lon REAL NOT NULL,
+                            radius REAL NOT NULL,
+                            starttime REAL NOT NULL,
+                            endtime REAL NOT NULL,
+                            minMag REAL,
+                            lim INTEGER NOT NULL,
+                            complete INTEGER NOT NULL,
+                            payload BLOB NOT NULL,
+                            size INTEGER NOT NULL,
+                            created REAL NOT NULL,
+                            accessed REAL NOT NULL
+                        )"""
+                    )
+                    conn.execute("CREATE INDEX IF NOT EXISTS events_cover ON events (provider, complete, starttime, endtime)")
+                    conn.execute("CREATE INDEX IF NOT EXISTS events_accessed ON events (accessed)")
+            finally:
+                conn.close()
+            self.created = True
+
+    @staticmethod
+    def normalize(provider, lat, lon, radius, starttime, endtime, minMag, limit) -> tuple:
+        """
+        Normalizes query parameters so equivalent queries share a key.
+        Coordinates are rounded to about 10 m, times to whole seconds.
+        """
+        lat = round(float(lat), 4)
+        lon = round(((float(lon) + 180) % 360) - 180, 4)
+        radius = round(float(radius), 4)
+        starttime = float(int(UTCDateTime(starttime).timestamp))
+        endtime = float(int(UTCDateTime(endtime).timestamp))
+        minMag = round(float(minMag), 2) if minMag not in (None, "") else None
+        return str(provider).upper(), lat, lon, radius, starttime, endtime, minMag, int(limit)
+
+    @staticmethod
+    def makeKey(params: tuple) -> str:
+        return "|".join(str(p) for p in params)
+
+    def get(self, provider, lat, lon, radius, starttime, endtime, minMag, limit) -> Catalog:
+        """
+        Looks up a query in the cache.
+        Returns:
+            Catalog: The cached or filtered result.
+            None: If no live entry can answer the query.
+        """
+        params = self.normalize(provider, lat, lon, radius, starttime, endtime, minMag, limit)
+        key = self.makeKey(params)
+        now = time.time()
+        try:
+            with self.lock, self.connect() as conn:
+                row = conn.execute(
+                    "SELECT payload FROM events WHERE key = ? AND created >= ?",
+                    (key, now - self.ttl)
+                ).fetchone()
+                if row:
+                    conn.execute("UPDATE events SET accessed = ? WHERE key = ?", (now, key))
+                    self.hits += 1
+                    return pickle.loads(row[0])
+
+                provider, lat, lon, radius, starttime, endtime, minMag, limit = params
+                candidates = conn.execute(
+                    """SELECT key, lat, lon, radius, minMag, payload FROM events
+                       WHERE provider = ? AND complete = 1 AND created >= ?
+                       AND starttime <= ? AND endtime >= ? AND radius >= ?
+                       ORDER BY radius ASC""",
+                    (provider, now - self.ttl, starttime, endtime, radius)
+                ).fetchall()
+                for cKey, cLat, cLon, cRadius, cMinMag, payload in candidates:
+                    if cMinMag is not None and (minMag is None or cMinMag > minMag):
+                        continue
+                    if locations2degrees(lat, lon, cLat, cLon) + radius > cRadius:
+                        continue
+                    conn.execute("UPDATE events SET accessed = ? WHERE key = ?", (now, cKey))
+                    self.partialHits += 1
+                    return filterCatalog(pickle.loads(payload), lat, lon, radius, starttime, endtime, minMag, limit)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Event cache read failed: {e}")
+            return None
+
+        self.misses += 1
+        return None
+
+    def put(self, provider, lat, lon, radius, starttime, endtime, minMag, limit, catalog: Catalog) -> None:
+        """
+        Stores a query result. A result shorter than its limit is marked complete,
+        which allows narrower queries to be answered from it.
+        """
+        params = self.normalize(provider, lat, lon, radius, starttime, endtime, minMag, limit)
+        key = self.makeKey(params)
+        payload = pickle.dumps(catalog, protocol=pickle.HIGHEST_PROTOCOL)
+        if len(payload) > self.maxBytes:
+            return
+        complete = 1 if len(catalog) < params[-1] else 0
+        now = time.time()
+        try:
+            with self.lock, self.connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (key, *params, complete, payload, len(payload), now, now)
+                )
+                self.evict(conn, now)
+        except (sqlite3.Error, OSError) as e:
+            print(f"Event cache write failed: {e}")
+
+    def evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """Drops expired entries, then least recently used ones until within bounds."""
+        conn.execute("DELETE FROM events WHERE created < ?", (now - self.ttl,))
+        count, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM events").fetchone()
+        if count <= self.maxEntries and total <= self.maxBytes:
+            return
+        for key, size in conn.execute("SELECT key, size FROM events ORDER BY accessed ASC").fetchall():
+            if count <= self.maxEntries and total <= self.maxBytes:
+                break
+            conn.execute("DELETE FROM events WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+
+    def clear(self) -> None:
+        with self.lock, self.connect() as conn:
+            conn.execute("DELETE FROM events")
+
+
+def eventMagnitude(event):
+    magnitude = event.preferred_magnitude() or (event.magnitudes[0] if event.magnitudes else None)
+    return magnitude.mag if magnitude else None
+
+
+def filterCatalog(catalog: Catalog, lat, lon, radius, starttime, endtime, minMag, limit) -> Catalog:
+    """
+    Narrows a cached catalog down to a query, keeping the same ordering and
+    limit the FDSN service would have applied (orderby=magnitude).
+    """
+    matches = []
+    for event in catalog:
+        origin = event.preferred_origin() or (event.origins[0] if event.origins else None)
+        if origin is None or origin.latitude is None or origin.longitude is None:
+            continue
+        if not starttime <= origin.time.timestamp <= endtime:
+            continue
+        mag = eventMagnitude(event)
+        if minMag is not None and (mag is None or mag < minMag):
+            continue
+        if locations2degrees(lat, lon, origin.latitude, origin.longitude) > radius:
+            continue
+        matches.append(event)
+    matches.sort(key=lambda e: eventMagnitude(e) or float('-inf'), reverse=True)
+    return Catalog(events=matches[:limit])
+
+
+eventCache = EventCache()
@@ -0,0 +1,191 @@
+import time
+import asyncio
+
+from obspy.core.event import Catalog
+from obspy.geodetics import locations2degrees
+
+from jukbox.AsyncFdsn import asyncFdsn
+from jukbox.ClientPool import clientPool, providerName
+from jukbox.EventCache import eventMagnitude
+
+
+FEDERATED_PROVIDERS = ["USGS", "EMSC", "GEOFON", "ISC"]
+FASTEST = "fastest"
+MERGE = "merge"
+
+
+def requestedProviders(providers) -> list:
+    """
+    The providers a client asked for, checked against FEDERATED_PROVIDERS.
+    Returns:
+        list: Canonical names in the order given, or None when none were asked for.
+    Raises:
+        ValueError: If providers is not a list or names anything outside FEDERATED_PROVIDERS.
+    """
+    if providers in (None, "", []):
+        return None
+    if not isinstance(providers, list):
+        raise ValueError("providers must be a list of provider names")
+    return list(dict.fromkeys(providerName(p, FEDERATED_PROVIDERS) for p in providers))
+
+
+def eventOrigin(event):
+    return event.preferred_origin() or (event.origins[0] if event.origins else None)
+
+
+def hasMomentTensor(event) -> bool:
+    return any(fm.moment_tensor and fm.moment_tensor.tensor for fm in event.focal_mechanisms)
+
+
+class FederatedSearch:
+    """
+    Runs one event query against several FDSN event services at once.
+
+    Two modes:
+        fastest: the first provider to answer within the latency budget wins
+                 and the others are cancelled.
+        merge:   every answer that lands within the budget is combined, with
+                 the same earthquake reported by several agencies kept once.
+
+    Routing uses the recent latency clientPool tracks per provider: unhealthy
+    providers are skipped, and providers whose recent latency is already past
+    the budget are only tried when nothing faster is available. A provider
+    that misses the merge budget is recorded as a failure, so one that keeps
+    stalling gets marked unhealthy and drops out of routing for the cooldown.
+    """
+
+    def __init__(self, fdsn=asyncFdsn, providers: list = None, budget: float = 8.0,
+                 timeTolerance: float = 16.0, distanceTolerance: float = 1.0, magTolerance: float = 0.5):
+        """
+        Args:
+            fdsn (AsyncFdsnClient): Client the queries go through.
+            providers (list): Default provider names, in order of preference.
+            budget (float): Seconds to wait for answers.
+            timeTolerance (float): Max origin time difference in seconds for two reports to be one event.
+            distanceTolerance (float): Max epicentre separation in degrees for two reports to be one event.
+            magTolerance (float): Max magnitude difference for two reports to be one event.
+        """
+        self.fdsn = fdsn
+        self.providers = providers or FEDERATED_PROVIDERS
+        self.budget = budget
+        self.timeTolerance = timeTolerance
+        self.distanceTolerance = distanceTolerance
+        self.magTolerance = magTolerance
+
+    def route(self, providers: list = None, budget: float = None) -> list:
+        """
+        Orders providers for a query: healthy ones that answer within the budget
+        first, fastest first, then untried ones, then known slow ones.
+        """
+        budget = self.budget if budget is None else budget
+        ranked = []
+        for order, provider in enumerate(providers or self.providers):
+            pool = clientPool.pool(provider)
+            if not pool.isHealthy():
+                continue
+            latency = pool.recentLatency
+            if latency is None:
+                ranked.append((1, order, provider))
+            elif latency < budget:
+                ranked.append((0, latency, provider))
+            else:
+                ranked.append((2, latency, provider))
+        ranked.sort()
+        if any(tier < 2 for tier, _, _ in ranked):
+            ranked = [r for r in ranked if r[0] < 2]
+        return [provider for _, _, provider in ranked]
+
+    async def search(self, mode, lat, lon, maxRad, starttime, endtime, minMag=None, limit=10,
+                     providers: list = None, budget: float = None) -> Catalog:
+        """
+        Raises:
+            ValueError: For an unknown mode.
+            ConnectionError: If no provider is healthy.
+            TimeoutError: If no provider answers within the budget.
+        """
+        budget = self.budget if budget is None else budget
+        routed = self.route(providers, budget)
+        if not routed:
+            raise ConnectionError(f"No healthy FDSN event provider among {providers or self.providers}")
+        args = (lat, lon, maxRad, starttime, endtime, minMag, limit)
+        if mode == FASTEST:
+            return await self.fastest(routed, args, budget)
+        if mode == MERGE:
+            return await self.merge(routed, args, budget, limit)
+        raise ValueError(f"Unknown federated search mode: {mode}")
+
+    async def fastest(self, providers: list, args: tuple, budget: float) -> Catalog:
+        tasks = {asyncio.create_task(self.fdsn.getEvents(p, *args)): p for p in providers}
+        deadline = time.monotonic() + budget
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, timeout=deadline - time.monotonic(), return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break
+                for task in done:
+                    if task.exception() is None:
+                        print(f"Federated search answered by {tasks[task]}")
+                        return task.result()
+                    print(f"Federated search: {tasks[task]} failed: {task.exception()}")
+        finally:
+            for task in pending:
+                task.cancel()
+        self.recordMissed([tasks[t] for t in pending], budget)
+        raise TimeoutError(f"No FDSN event provider answered within {budget}s")
+
+    async def merge(self, providers: list, args: tuple, budget: float, limit: int) -> Catalog:
+        tasks = {asyncio.create_task(self.fdsn.getEvents(p, *args)): p for p in providers}
+        done, pending = await asyncio.wait(tasks, timeout=budget)
+        for task in pending:
+            task.cancel()
+        self.recordMissed([tasks[t] for t in pending], budget)
+
+        catalogs = []
+        for task in done:
+            if task.exception() is not None:
+                print(f"Federated search: {tasks[task]} failed: {task.exception()}")
+                continue
+            catalogs.append((providers.index(tasks[task]), task.result()))
+        if not catalogs:
+            raise TimeoutError(f"No FDSN event provider answered within {budget}s")
+        catalogs.sort(key=lambda c: c[0])
+        return self.deduplicate([catalog for _, catalog in catalogs], limit)
+
+    def recordMissed(self, providers: list, budget: float) -> None:
+        for provider in providers:
+            clientPool.pool(provider).recordFailure(
+                budget, TimeoutError(f"exceeded {budget}s latency budget"), clientPool.maxFailures, clientPool.cooldown
+            )
+
+    def sameEvent(self, a, b) -> bool:
+        originA, originB = eventOrigin(a), eventOrigin(b)
+        if abs(originA.time - originB.time) > self.timeTolerance:
+            return False
+        if locations2degrees(originA.latitude, originA.longitude, originB.latitude, originB.longitude) > self.distanceTolerance:
+            return False
+        magA, magB = eventMagnitude(a), eventMagnitude(b)
+        return magA is None or magB is None or abs(magA - magB) <= self.magTolerance
+
+    def deduplicate(self, catalogs: list, limit: int) -> Catalog:
+        """
+        Combines catalogs in provider preference order. When several providers
+        report the same earthquake the preferred provider's report is kept,
+        unless a later one carries a moment tensor and it does not.
+        """
+        merged = []
+        for catalog in catalogs:
+            for event in catalog:
+                origin = eventOrigin(event)
+                if origin is None or origin.time is None or origin.latitude is None or origin.longitude is None:
+                    continue
+                match = next((i for i, kept in enumerate(merged) if self.sameEvent(kept, event)), None)
+                if match is None:
+                    merged.append(event)
+                elif hasMomentTensor(event) and not hasMomentTensor(merged[match]):
+                    merged[match] = event
+        merged.sort(key=lambda e: eventMagnitude(e) or float('-inf'), reverse=True)
+        return Catalog(events=merged[:limit])
+
+
+federatedSearch = FederatedSearch()
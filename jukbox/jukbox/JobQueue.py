@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import threading
+
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def fileFingerprint(path: str, chunk: int = 1024 * 1024) -> str:
+    """
+    Content hash of a whole file, read sequentially `chunk` bytes at a time.
+    Any change to a recording, wherever it is in the file, gives a new hash.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(chunk)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+
+def groupName(jobId: str) -> str:
+    return f"job_{jobId}"
+
+
+class Job:
+    """State of one queued piece of work, as reported to pollers and subscribers."""
+
+    def __init__(self, key: str, kind: str, fileName: str, params: dict):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.kind = kind
+        self.fileName = fileName
+        self.params = params
+        self.status = QUEUED
+        self.progress = 0.0
+        self.error = None
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def toDict(self) -> dict:
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'fileName': self.fileName,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'error': self.error,
+            'result': self.result,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished,
+        }
+
+
+class JobQueue:
+    """
+    Local background queue for slow per-file work such as spectrogram processing.
+
+    Jobs run on an APScheduler thread pool, so at most `workers` run at once
+    and the rest wait their turn. Submitting the same kind of work for the
+    same file contents and parameters returns the existing job instead of
+    queueing it again. Progress is kept on the job for polling and pushed to
+    the job's Channels group for websocket subscribers.
+
+    Job state changes happen under the queue's lock; read a job through
+    snapshot() to get its fields as one consistent dict.
+    """
+
+    def __init__(self, workers: int = 2, keep: int = 256, publishInterval: float = 0.5):
+        """
+        Args:
+            workers (int): Jobs that may run at the same time.
+            keep (int): Finished jobs remembered for polling and deduplication.
+            publishInterval (float): Minimum seconds between progress messages per job.
+        """
+        self.workers = workers
+        self.keep = keep
+        self.publishInterval = publishInterval
+        self.jobs = {}
+        self.byKey = {}
+        self.lock = threading.Lock()
+        self.scheduler = None
+        self.loop = None
+        self.lastPublished = {}
+
+    def start(self) -> BackgroundScheduler:
+        with self.lock:
+            if self.scheduler is None:
+                self.scheduler = BackgroundScheduler(
+                    executors={'default': ThreadPoolExecutor(self.workers)},
+                    job_defaults={'coalesce': False, 'max_instances': self.workers, 'misfire_grace_time': None}
+                )
+                self.scheduler.start()
+            return self.scheduler
+
+    def submit(self, kind: str, filePath: str, func, params: dict = None, outputExists=None) -> Job:
+        """
+        Queues func(filePath, progress=callback, **params) unless the same work is
+        already queued, running or done.
+        Args:
+            outputExists (callable): Given a done job, whether its outputs are still on disk.
+                A done job whose outputs are gone is run again.
+        Returns:
+            Job: The new or existing job.
+        """
+        params = params or {}
+        key = hashlib.sha1(json.dumps([kind, fileFingerprint(filePath), params], sort_keys=True).encode()).hexdigest()
+        scheduler = self.start()
+        with self.lock:
+            existing = self.byKey.get(key)
+            if existing is not None and existing.status != FAILED:
+                if existing.status != DONE or outputExists is None or outputExists(existing):
+                    return existing
+            job = Job(key, kind, os.path.basename(filePath), params)
+            self.jobs[job.id] = job
+            self.byKey[key] = job
+            self.prune()
+        scheduler.add_job(self.run, args=[job, func, filePath], id=job.id)
+        return job
+
+    def run(self, job: Job, func, filePath: str) -> None:
+        with self.lock:
+            job.status = RUNNING
+            job.started = time.time()
+        self.publish(job, force=True)
+        try:
+            result = func(filePath, progress=lambda fraction: self.setProgress(job, fraction), **job.params)
+            with self.lock:
+                job.result = result
+                job.progress = 1.0
+                job.status = DONE
+                job.finished = time.time()
+        except Exception as e:
+            print(f"Job {job.id} ({job.kind} {job.fileName}) failed: {e}")
+            with self.lock:
+                job.error = str(e)
+                job.status = FAILED
+                job.finished = time.time()
+        self.publish(job, force=True)
+
+    def setProgress(self, job: Job, fraction: float) -> None:
+        with self.lock:
+            job.progress = max(job.progress, min(1.0, fraction))
+        self.publish(job)
+
+    def get(self, jobId: str) -> Job:
+        with self.lock:
+            return self.jobs.get(jobId)
+
+    def snapshot(self, job: Job) -> dict:
+        """job.toDict(), taken under the lock so a worker cannot change the job halfway through."""
+        with self.lock:
+            return job.toDict()
+
+    def forget(self, fileName: str) -> None:
+        """
+        Drops finished jobs for a file, e.g. once it or its output is deleted, so it can be
+        processed again. fileName may be the source file or the file name a job returned.
+        """
+        with self.lock:
+            for key, job in list(self.byKey.items()):
+                if fileName in (job.fileName, job.result) and job.status in (DONE, FAILED):
+                    del self.byKey[key]
+
+    def prune(self) -> None:
+        # Called with the lock held; drops the oldest finished jobs beyond `keep`.
+        finished = sorted((j for j in self.jobs.values() if j.status in (DONE, FAILED)), key=lambda j: j.finished or 0)
+        for job in finished[:max(0, len(finished) - self.keep)]:
+            del self.jobs[job.id]
+            if self.byKey.get(job.key) is job:
+                del self.byKey[job.key]
+            self.lastPublished.pop(job.id, None)
+
+    def attachLoop(self, loop) -> None:
+        """Remembers the ASGI event loop so worker threads can reach the channel layer from it."""
+        self.loop = loop
+
+    def publish(self, job: Job, force: bool = False) -> None:
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.lastPublished.get(job.id, 0.0) < self.publishInterval:
+                return
+            self.lastPublished[job.id] = now
+            message = {'type': 'job.update', 'job': job.toDict()}
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            # Nobody has subscribed over a websocket yet; pollers read the job directly.
+            return
+        from channels.layers import get_channel_layer
+        layer = get_channel_layer()
+        if layer is None:
+            return
+        asyncio.run_coroutine_threadsafe(layer.group_send(groupName(job.id), message), loop)
+
+
+jobQueue = JobQueue()
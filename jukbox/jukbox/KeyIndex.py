@@ -0,0 +1,149 @@
+import bisect
+from contextlib import contextmanager
+from collections.abc import Mapping
+
+
+KINDS = ("img", "data")
+
+
+class KeyIndex:
+    """
+    Index over the img and data keys of every sample in one store, for
+    substring and prefix key searches without looping over samples.
+
+    Each distinct key is broken into its trigrams. A substring query
+    intersects the posting sets of the query's trigrams, starting from the
+    rarest, and only the keys that survive are checked with `in`, so the
+    cost follows the number of candidate keys rather than the catalogue
+    size. Fragments shorter than a trigram match too much for an index to
+    help and scan the distinct keys instead. Prefix queries bisect a sorted
+    list of the keys, kept sorted as keys come and go.
+
+    SampleStore owns one per CSV and keeps it current as rows are replayed
+    and written; it also serializes access, so this class takes no lock.
+    """
+
+    def __init__(self, n: int = 3):
+        """
+        Args:
+            n (int): Length of the indexed n-grams. Shorter fragments scan the keys.
+        """
+        self.n = n
+        self.entries = {kind: {} for kind in KINDS}
+        self.grams = {kind: {} for kind in KINDS}
+        self.sortedKeys = {kind: [] for kind in KINDS}
+        self.bySample = {}
+        self.sorting = True
+
+    def gramsOf(self, key: str) -> set:
+        return {key[i:i + self.n] for i in range(len(key) - self.n + 1)}
+
+    @contextmanager
+    def bulk(self):
+        """Defers sorting while many keys are added, e.g. on load, and sorts once at the end."""
+        self.sorting = False
+        try:
+            yield
+        finally:
+            self.sorting = True
+            for kind in KINDS:
+                self.sortedKeys[kind] = sorted(self.entries[kind])
+
+    def add(self, idNum: int, kind: str, key: str, path: str) -> None:
+        """Indexes one key of a sample, or updates its path if it is already indexed."""
+        key = str(key)
+        owners = self.entries[kind].get(key)
+        if owners is None:
+            owners = self.entries[kind][key] = {}
+            grams = self.grams[kind]
+            for gram in self.gramsOf(key):
+                posting = grams.get(gram)
+                if posting is None:
+                    grams[gram] = {key}
+                else:
+                    posting.add(key)
+            if self.sorting:
+                bisect.insort(self.sortedKeys[kind], key)
+        owners[idNum] = path
+        self.bySample.setdefault(idNum, set()).add((kind, key))
+
+    def remove(self, idNum: int, kind: str, key: str) -> None:
+        key = str(key)
+        owners = self.entries[kind].get(key)
+        if owners is None or idNum not in owners:
+            return
+        del owners[idNum]
+        keys = self.bySample.get(idNum)
+        if keys is not None:
+            keys.discard((kind, key))
+        if owners:
+            return
+        # Last sample with this key: drop it from the postings and the sorted list.
+        del self.entries[kind][key]
+        for gram in self.gramsOf(key):
+            posting = self.grams[kind].get(gram)
+            if posting is not None:
+                posting.discard(key)
+                if not posting:
+                    del self.grams[kind][gram]
+        if self.sorting:
+            sortedKeys = self.sortedKeys[kind]
+            del sortedKeys[bisect.bisect_left(sortedKeys, key)]
+
+    def setSample(self, idNum: int, keys: dict) -> None:
+        """
+        Replaces whatever was indexed for idNum.
+        Args:
+            keys (dict): {"img": {key: path}, "data": {key: path}}; kinds that are not mappings are skipped.
+        """
+        self.removeSample(idNum)
+        for kind in KINDS:
+            kindKeys = keys.get(kind)
+            if isinstance(kindKeys, Mapping):
+                for key, path in kindKeys.items():
+                    self.add(idNum, kind, key, path)
+
+    def removeSample(self, idNum: int) -> None:
+        for kind, key in list(self.bySample.get(idNum, ())):
+            self.remove(idNum, kind, key)
+        self.bySample.pop(idNum, None)
+
+    def matchingKeys(self, kind: str, fragment: str, prefix: bool) -> list:
+        if prefix:
+            sortedKeys = self.sortedKeys[kind]
+            out = []
+            for i in range(bisect.bisect_left(sortedKeys, fragment), len(sortedKeys)):
+                if not sortedKeys[i].startswith(fragment):
+                    break
+                out.append(sortedKeys[i])
+            return out
+        if len(fragment) < self.n:
+            return [key for key in self.entries[kind] if fragment in key]
+        postings = []
+        for gram in {fragment[i:i + self.n] for i in range(len(fragment) - self.n + 1)}:
+            posting = self.grams[kind].get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates &= posting
+            if not candidates:
+                return []
+        return [key for key in candidates if fragment in key]
+
+    def search(self, kind: str, fragment: str, prefix: bool = False) -> dict:
+        """
+        Samples with a key of `kind` containing (or starting with) fragment.
+        Case sensitive, like Sample.SearchImgByKey.
+        Returns:
+            dict: {idNum: [paths of the matching keys]}; empty when nothing matches.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown key kind: {kind}")
+        out = {}
+        for key in sorted(self.matchingKeys(kind, fragment, prefix)):
+            for idNum, path in self.entries[kind][key].items():
+                out.setdefault(idNum, []).append(path)
+        return out
@@ -3,13 +3,16 @@ from typing import IO, List, Optional
 import random
 import os
 import shutil
+from types import MappingProxyType
+from collections.abc import Mapping
 
 class Sample:
     def __init__(self, name: str,**kwargs):
         """
         Initializes a Sample object.
-        Creates a directory structure for the sample, including subdirectories for images and data.
-        The sample name is used to create the directory structure.
+        The sample's files live under Samples/<name>/img and Samples/<name>/data.
+        Those directories are created when a file is first written into the
+        sample, not here, so building a Sample has no filesystem cost.
         Args:
             name (str): The name of the sample.
             **kwargs: Additional keyword arguments to set as attributes.
@@ -19,9 +22,6 @@ class Sample:
             data (dict): A dictionary to store data file paths.
             misc (dict): A dictionary for miscellaneous attributes.
             idNum (int): A unique ID number for the sample.
-        Raises:
-            FileExistsError: If a sample with the same name already exists.
-            OSError: If there is an error creating the directory structure.
         """
         self.img = {}
         self.data = {}
@@ -33,18 +33,19 @@ class Sample:
             self.name = idNum
         else:
             self.name = name
-        try:
-            os.makedirs("Samples/" + name + "/img")
-            os.mkdir("Samples/" + name + "/data")
-        except(FileExistsError, OSError):
-            print("Sample with that name already exists.")
+
+    def ensureDirs(self) -> None:
+        """Creates the sample's img and data directories if they do not exist yet."""
+        os.makedirs("Samples/" + self.name + "/img", exist_ok=True)
+        os.makedirs("Samples/" + self.name + "/data", exist_ok=True)
 
     
     def delete(self):
         """
         Deletes the sample directory and all its contents.
         """
-        shutil.rmtree("Samples/" + self.name)
+        if os.path.exists("Samples/" + self.name):
+            shutil.rmtree("Samples/" + self.name)
         del self
 
     ##optional data stream
@@ -71,6 +72,7 @@ class Sample:
         if self.img.get(imgKey) is not None:
             raise KeyError("Image with that key already exists in the img dictionary.")
         if imgFile:
+            self.ensureDirs()
             try:
                 with open(imgName, 'wb') as f:
                     f.write(imgFile.read())
@@ -101,6 +103,7 @@ class Sample:
         if self.data.get(dataKey) is not None:
             raise KeyError("Data with that key already exists in the img dictionary.")
         if dataFile:
+            self.ensureDirs()
             try:
                 with open(dataName, 'wb') as f:
                     f.write(dataFile.read())
@@ -183,6 +186,7 @@ class Sample:
         return (self.name + "," + str(self.idNum))
 
 
+    # Searches this sample only; CsvHandler.csvSearchImgByKey / csvSearchDataByKey search a whole CSV.
     def SearchImgByKey(self, key: str) -> List:
         images = []
         for k in self.img.keys():
@@ -215,7 +219,53 @@ class Sample:
             print("Sample with that name already exists.")
             return False
         else:
-            os.rename("Samples/" + self.name, "Samples/" + sampleName)
+            if os.path.exists("Samples/" + self.name):
+                os.rename("Samples/" + self.name, "Samples/" + sampleName)
             self.name = sampleName
             return True
     
+
+
+class SampleRecord:
+    """
+    Read only view of one stored sample, as the CsvHandler read functions
+    return it. Building one is a plain parse: no directories are touched,
+    and __slots__ keeps a catalogue of them small. toSample() gives a
+    Sample to modify and save back.
+
+    data, img and misc are MappingProxyType views, so item assignment fails
+    as attribute assignment does. The views are one level deep: a list or
+    dict stored as a value in misc can still be changed in place.
+    """
+
+    __slots__ = ('idNum', 'name', 'data', 'img', 'misc')
+
+    def __init__(self, idNum: int, name: str, data: dict, img: dict, misc: dict):
+        object.__setattr__(self, 'idNum', idNum)
+        object.__setattr__(self, 'name', name)
+        # Legacy cells that did not parse to a dict stay as they are; strings cannot be changed anyway.
+        object.__setattr__(self, 'data', MappingProxyType(data) if isinstance(data, dict) else data)
+        object.__setattr__(self, 'img', MappingProxyType(img) if isinstance(img, dict) else img)
+        object.__setattr__(self, 'misc', MappingProxyType(misc) if isinstance(misc, dict) else misc)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"SampleRecord is read only; use toSample() to change {key}.")
+
+    def toSample(self) -> Sample:
+        """A writable Sample with copies of this record's fields."""
+        return Sample(
+            self.name,
+            idNum=self.idNum,
+            data=dict(self.data) if isinstance(self.data, Mapping) else self.data,
+            img=dict(self.img) if isinstance(self.img, Mapping) else self.img,
+            misc=dict(self.misc) if isinstance(self.misc, Mapping) else self.misc
+        )
+
+    def __str__(self) -> str:
+        return (self.name + "," + str(self.idNum))
+
+    def __repr__(self) -> str:
+        return (self.name + "," + str(self.idNum))
+
+    SearchImgByKey = Sample.SearchImgByKey
+    SearchDataByKey = Sample.SearchDataByKey
@@ -0,0 +1,306 @@
+import os
+import sys
+import json
+import sqlite3
+import threading
+from collections.abc import Mapping
+
+from jukbox.Sample import SampleRecord
+from jukbox.SampleStore import iterEntries, UPSERT, DELETE
+
+
+# The project's database, next to manage.py, as settings.DATABASES points at.
+SAMPLE_DB = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "db.sqlite3")
+KINDS = ("img", "data")
+
+
+class SampleRepository:
+    """
+    Sample metadata in SQLite, in the same database as the rest of the project.
+
+    Each sample is a row of `samples` with its img, data and misc dicts as JSON
+    columns. Rows carry a write sequence number, so that of several samples
+    sharing a name the first written is returned, as SampleStore does.
+    Every img and data key is also a row of `sample_keys`, indexed by
+    (kind, key), so lookups by key or key prefix are index searches. Substring
+    searches go through an FTS5 trigram index over the same keys where SQLite
+    supports it (3.34 and later).
+
+    Usage:
+        repo = SampleRepository()
+        repo.importCsv("samples.csv")
+        repo.searchImgByKey("spectro")
+    """
+
+    def __init__(self, path: str = SAMPLE_DB, batchSize: int = 1000):
+        """
+        Args:
+            path (str): SQLite file. Defaults to the project's db.sqlite3.
+            batchSize (int): Rows written per transaction by saveMany and importCsv.
+        """
+        self.path = path
+        self.batchSize = batchSize
+        self.lock = threading.Lock()
+        with self.connect() as conn:
+            conn.executescript(
+                """CREATE TABLE IF NOT EXISTS samples (
+                    idNum INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    img TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    misc TEXT NOT NULL,
+                    seq INTEGER NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS sample_keys (
+                    idNum INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    path TEXT,
+                    UNIQUE (idNum, kind, key)
+                );
+                CREATE INDEX IF NOT EXISTS sample_keys_key ON sample_keys (kind, key);"""
+            )
+            if "seq" not in [c[1] for c in conn.execute("PRAGMA table_info(samples)")]:
+                # Tables from before seq existed: their rowid order is the best order known.
+                conn.execute("ALTER TABLE samples ADD COLUMN seq INTEGER NOT NULL DEFAULT 0")
+                conn.execute("UPDATE samples SET seq = rowid")
+            conn.execute("DROP INDEX IF EXISTS samples_name")
+            conn.execute("CREATE INDEX IF NOT EXISTS samples_name_seq ON samples (name, seq)")
+            # writeRows reads MAX(seq) on every batch; with this index that is one b-tree lookup.
+            conn.execute("CREATE INDEX IF NOT EXISTS samples_seq ON samples (seq)")
+            try:
+                conn.executescript(
+                    """CREATE VIRTUAL TABLE IF NOT EXISTS sample_keys_fts USING fts5(
+                        key, kind UNINDEXED, idNum UNINDEXED, tokenize = 'trigram case_sensitive 1'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS sample_keys_fts_insert AFTER INSERT ON sample_keys BEGIN
+                        INSERT INTO sample_keys_fts (rowid, key, kind, idNum) VALUES (new.rowid, new.key, new.kind, new.idNum);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS sample_keys_fts_delete AFTER DELETE ON sample_keys BEGIN
+                        DELETE FROM sample_keys_fts WHERE rowid = old.rowid;
+                    END;"""
+                )
+                self.trigram = True
+            except sqlite3.OperationalError as e:
+                print(f"No trigram index for sample keys, substring searches will scan: {e}")
+                self.trigram = False
+
+    def connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=10)
+
+    @staticmethod
+    def toRow(idNum, name, img, data, misc) -> tuple:
+        # Non dict fields (a legacy CSV cell that failed to parse) are stored as empty dicts.
+        return (int(idNum), str(name)) + tuple(json.dumps(dict(f) if isinstance(f, Mapping) else {}) for f in (img, data, misc))
+
+    @staticmethod
+    def keyRows(row: tuple) -> list:
+        idNum, _, img, data, _ = row
+        out = []
+        for kind, column in zip(KINDS, (img, data)):
+            for key, path in json.loads(column).items():
+                out.append((idNum, kind, str(key), None if path is None else str(path)))
+        return out
+
+    @staticmethod
+    def hydrate(row: tuple) -> SampleRecord:
+        idNum, name, img, data, misc = row
+        return SampleRecord(idNum, name, json.loads(data), json.loads(img), json.loads(misc))
+
+    def writeRows(self, conn: sqlite3.Connection, rows: list) -> None:
+        # Runs inside the caller's transaction. Of several rows for one id the last wins and
+        # takes the latest seq, as a rewritten row moves to the end of SampleStore's name order.
+        latest = {}
+        for r in rows:
+            latest.pop(r[0], None)
+            latest[r[0]] = r
+        rows = list(latest.values())
+        base = conn.execute("SELECT COALESCE(MAX(seq), 0) FROM samples").fetchone()[0]
+        conn.executemany("DELETE FROM sample_keys WHERE idNum = ?", [(r[0],) for r in rows])
+        conn.executemany(
+            "INSERT OR REPLACE INTO samples (idNum, name, img, data, misc, seq) VALUES (?, ?, ?, ?, ?, ?)",
+            [r + (base + i + 1,) for i, r in enumerate(rows)]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO sample_keys (idNum, kind, key, path) VALUES (?, ?, ?, ?)",
+            [keyRow for r in rows for keyRow in self.keyRows(r)]
+        )
+
+    def save(self, sample) -> None:
+        self.saveMany([sample])
+
+    def saveMany(self, samples) -> int:
+        """
+        Inserts or replaces samples, batchSize rows per transaction.
+        Args:
+            samples (iterable): Sample or SampleRecord objects; may be a generator.
+        Returns:
+            int: Number of samples written.
+        """
+        count = 0
+        batch = []
+        for sample in samples:
+            batch.append(self.toRow(sample.idNum, sample.name, sample.img, sample.data, sample.misc))
+            if len(batch) >= self.batchSize:
+                count += self.commit(batch)
+                batch = []
+        if batch:
+            count += self.commit(batch)
+        return count
+
+    def commit(self, rows: list, deletes: list = ()) -> int:
+        """Writes rows, then deletes ids, in one transaction."""
+        with self.lock, self.connect() as conn:
+            if rows:
+                self.writeRows(conn, rows)
+            if deletes:
+                conn.executemany("DELETE FROM sample_keys WHERE idNum = ?", [(d,) for d in deletes])
+                conn.executemany("DELETE FROM samples WHERE idNum = ?", [(d,) for d in deletes])
+        return len(rows)
+
+    def delete(self, idNum: int) -> None:
+        self.commit([], [int(idNum)])
+
+    def deleteByName(self, name: str) -> None:
+        with self.lock, self.connect() as conn:
+            ids = [(r[0],) for r in conn.execute("SELECT idNum FROM samples WHERE name = ?", (name,))]
+            conn.executemany("DELETE FROM sample_keys WHERE idNum = ?", ids)
+            conn.executemany("DELETE FROM samples WHERE idNum = ?", ids)
+
+    def get(self, idNum: int) -> SampleRecord:
+        """
+        Returns:
+            SampleRecord: The sample with that id.
+            None: If there is none.
+        """
+        with self.connect() as conn:
+            row = conn.execute("SELECT idNum, name, img, data, misc FROM samples WHERE idNum = ?", (int(idNum),)).fetchone()
+        return None if row is None else self.hydrate(row)
+
+    def getByName(self, name: str) -> SampleRecord:
+        with self.connect() as conn:
+            row = conn.execute(
+                "SELECT idNum, name, img, data, misc FROM samples WHERE name = ? ORDER BY seq LIMIT 1", (name,)
+            ).fetchone()
+        return None if row is None else self.hydrate(row)
+
+    def all(self):
+        """Yields every sample in id order without loading them all at once."""
+        conn = self.connect()
+        try:
+            for row in conn.execute("SELECT idNum, name, img, data, misc FROM samples ORDER BY idNum"):
+                yield self.hydrate(row)
+        finally:
+            conn.close()
+
+    def count(self) -> int:
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def nextId(self) -> int:
+        """Smallest unused non-negative id, as CsvHandler.getNextID."""
+        with self.connect() as conn:
+            row = conn.execute(
+                """SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM samples WHERE idNum = 0)
+                   UNION ALL
+                   SELECT s.idNum + 1 FROM samples s
+                   WHERE s.idNum >= 0 AND NOT EXISTS (SELECT 1 FROM samples t WHERE t.idNum = s.idNum + 1)
+                   ORDER BY 1 LIMIT 1"""
+            ).fetchone()
+        return row[0]
+
+    def keyQuery(self, kind: str, fragment: str, prefix: bool) -> tuple:
+        select = "SELECT DISTINCT s.idNum, s.name, s.img, s.data, s.misc FROM samples s JOIN "
+        if prefix:
+            # Range over the (kind, key) index; GLOB would need its wildcards escaped.
+            return (
+                select + "sample_keys k ON k.idNum = s.idNum WHERE k.kind = ? AND k.key >= ? AND k.key < ? ORDER BY s.idNum",
+                (kind, fragment, fragment + "\U0010ffff")
+            )
+        if self.trigram and len(fragment) >= 3:
+            phrase = '"' + fragment.replace('"', '""') + '"'
+            return (
+                select + "sample_keys_fts f ON f.idNum = s.idNum WHERE sample_keys_fts MATCH ? AND f.kind = ? ORDER BY s.idNum",
+                (f"key : {phrase}", kind)
+            )
+        # Too short for a trigram: scan the keys of that kind, which is still far less than every sample.
+        return (
+            select + "sample_keys k ON k.idNum = s.idNum WHERE k.kind = ? AND instr(k.key, ?) > 0 ORDER BY s.idNum",
+            (kind, fragment)
+        )
+
+    def searchByKey(self, kind: str, fragment: str, prefix: bool = False) -> list:
+        """
+        Samples with an img or data key containing (or starting with) fragment.
+        Args:
+            kind (str): "img" or "data".
+            fragment (str): Case sensitive, like Sample.SearchImgByKey.
+            prefix (bool): Match only keys starting with fragment.
+        Returns:
+            list: Matching samples in id order.
+        """
+        if kind not in KINDS:
+            raise ValueError(f"Unknown key kind: {kind}")
+        sql, params = self.keyQuery(kind, fragment, prefix)
+        with self.connect() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [self.hydrate(row) for row in rows]
+
+    def searchImgByKey(self, fragment: str, prefix: bool = False) -> list:
+        return self.searchByKey("img", fragment, prefix)
+
+    def searchDataByKey(self, fragment: str, prefix: bool = False) -> list:
+        return self.searchByKey("data", fragment, prefix)
+
+    def importCsv(self, fileName: str) -> int:
+        """
+        Streams a sample CSV, and any CsvHandler journal beside it, into the
+        repository in batchSize transactions. Memory stays at one batch
+        plus the set of ids seen in the CSV.
+        Rows already in the repository are replaced by the CSV's version.
+        Of duplicate ids in a legacy CSV the first row is kept, as SampleStore
+        does; journal entries always apply.
+        Returns:
+            int: Number of entries applied.
+        """
+        from jukbox.CsvHandler import decodeRow
+
+        count = 0
+        rows, deletes = [], []
+        seen = set()
+        for entry, fromJournal in iterEntries(fileName):
+            try:
+                idNum = int(entry[1])
+            except (ValueError, IndexError):
+                continue
+            if not fromJournal:
+                if idNum in seen:
+                    continue
+                seen.add(idNum)
+            if entry[0] == DELETE:
+                deletes.append(idNum)
+            elif entry[0] == UPSERT and len(entry) >= 6:
+                # Deletes run after the rows of their batch, so a pending one ends the batch before a row.
+                if deletes:
+                    self.commit(rows, deletes)
+                    rows, deletes = [], []
+                try:
+                    # Either row format; CSV columns are idNum, name, data, img, misc.
+                    idNum, name, data, img, misc = decodeRow(entry[1:])
+                except (ValueError, IndexError):
+                    continue
+                rows.append(self.toRow(idNum, name, img, data, misc))
+            else:
+                continue
+            count += 1
+            if len(rows) + len(deletes) >= self.batchSize:
+                self.commit(rows, deletes)
+                rows, deletes = [], []
+        self.commit(rows, deletes)
+        return count
+
+if __name__ == "__main__":
+    # python -m jukbox.SampleRepository samples.csv [more.csv ...]
+    repository = SampleRepository()
+    for csvName in sys.argv[1:]:
+        print(f"Imported {repository.importCsv(csvName)} entries from {csvName}")
@@ -0,0 +1,365 @@
+import os
+import csv
+import shutil
+import threading
+from contextlib import contextmanager, nullcontext
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory file locks (Windows): the store is then only safe in a single process.
+    fcntl = None
+
+
+from jukbox.KeyIndex import KeyIndex
+
+
+UPSERT = "U"
+DELETE = "D"
+
+
+class SampleStore:
+    """
+    Storage engine behind the CsvHandler functions for one sample CSV.
+
+    The rows are held in memory, keyed by idNum, with a second hash index
+    from name to the ids carrying it, so lookups never scan the file. Writes
+    are appended to a journal next to the CSV ("<file>.journal") instead of
+    rewriting it; once
+    the journal outgrows the table, a background thread writes a fresh CSV and
+    the journal starts over. Loading replays base CSV, then any journal left
+    by an interrupted compaction, then the live journal, so a crash at any
+    point loses nothing that was written.
+
+    The CSV alone is therefore not the current data: anything reading the
+    files must replay the journals too, through this class or iterEntries.
+    csvMigrate folds them into the CSV when a plain file is needed.
+
+    Several processes (e.g. Django workers) may share the files. Every write
+    holds an exclusive flock on "<file>.lock" while it catches up with the
+    journal, appends and, if due, sets the journal aside for compaction, so
+    no process appends between another's catch up and its rename. Only one
+    process compacts at a time, holding "<file>.compact.lock" until its CSV
+    is in place. Other processes' writes are picked up by reading the
+    journal from where this process last stopped. Without fcntl the store is
+    single process only.
+
+    Rows are kept as the raw CSV fields; the row format belongs to CsvHandler,
+    which can pass a migrate function to bring old rows up to date whenever
+    the CSV is rewritten, and a keysOf function to keep a KeyIndex over the
+    rows' img and data keys. The index is built on load and updated by every
+    entry applied, this process's writes and other processes' alike.
+    """
+
+    def __init__(self, fileName: str, minCompact: int = 1024, migrate=None, keysOf=None):
+        """
+        Args:
+            fileName (str): Path to the sample CSV.
+            minCompact (int): Journal entries always tolerated before compacting.
+            migrate (callable): Maps a stored row to the row written on compaction.
+            keysOf (callable): Maps a stored row to {"img": {key: path}, "data": {key: path}}
+                for the key index. No index is kept without it.
+        """
+        self.fileName = fileName
+        self.migrate = migrate
+        self.keysOf = keysOf
+        self.journalName = fileName + ".journal"
+        self.compactingName = fileName + ".journal.compacting"
+        self.lockName = fileName + ".lock"
+        self.compactLockName = fileName + ".compact.lock"
+        self.minCompact = minCompact
+        self.lock = threading.RLock()
+        self.lockFile = None
+        self.lockDepth = 0
+        self.compactor = None
+        with self.locked():
+            self.load()
+
+    @contextmanager
+    def locked(self):
+        """Holds the store lock and, where fcntl exists, the exclusive lock on "<file>.lock". Reentrant."""
+        with self.lock:
+            if self.lockDepth == 0 and fcntl is not None:
+                self.lockFile = open(self.lockName, 'a')
+                fcntl.flock(self.lockFile, fcntl.LOCK_EX)
+            self.lockDepth += 1
+            try:
+                yield
+            finally:
+                self.lockDepth -= 1
+                if self.lockDepth == 0 and self.lockFile is not None:
+                    # Closing the file releases the flock.
+                    self.lockFile.close()
+                    self.lockFile = None
+
+    def load(self) -> None:
+        # Called with locked() held, at construction and when another process rewrote the files.
+        self.rows = {}
+        self.names = {}
+        self.journalEntries = 0
+        self.nextFree = 0
+        self.index = None if self.keysOf is None else KeyIndex()
+        with nullcontext() if self.index is None else self.index.bulk():
+            for entry, fromJournal in iterEntries(self.fileName):
+                self.apply(entry, replace=fromJournal)
+                if fromJournal:
+                    self.journalEntries += 1
+        self.signature = self.stat()
+
+    def apply(self, entry: list, replace: bool = True) -> None:
+        """Applies one journal entry to the indexes. Malformed entries are skipped, as getNextID always has."""
+        try:
+            idNum = int(entry[1])
+        except (ValueError, IndexError):
+            return
+        if entry[0] == DELETE:
+            self.remove(idNum)
+        elif entry[0] == UPSERT and len(entry) > 2:
+            if idNum in self.rows and not replace:
+                # Duplicate ids in a legacy CSV: the first row is the one reads have always returned.
+                return
+            self.put(entry[1:])
+
+    def put(self, row: list) -> None:
+        idNum = int(row[0])
+        old = self.rows.get(idNum)
+        if old is not None:
+            self.unname(old[1], idNum)
+        self.rows[idNum] = row
+        # Ids per name are kept in insertion order; reads by name return the first, like a scan did.
+        self.names.setdefault(row[1], {})[idNum] = None
+        while self.nextFree in self.rows:
+            self.nextFree += 1
+        if self.index is not None:
+            self.index.setSample(idNum, self.keysOf(row))
+
+    def remove(self, idNum: int) -> None:
+        row = self.rows.pop(idNum, None)
+        if row is None:
+            return
+        self.unname(row[1], idNum)
+        if 0 <= idNum < self.nextFree:
+            self.nextFree = idNum
+        if self.index is not None:
+            self.index.removeSample(idNum)
+
+    def unname(self, name: str, idNum: int) -> None:
+        ids = self.names.get(name)
+        if ids is not None:
+            ids.pop(idNum, None)
+            if not ids:
+                del self.names[name]
+
+    def stat(self) -> tuple:
+        out = []
+        for path in (self.fileName, self.compactingName, self.journalName):
+            try:
+                st = os.stat(path)
+                out.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                out.append(None)
+        return tuple(out)
+
+    def refresh(self) -> None:
+        # Called with self.lock held. Picks up changes made to the files by anything but this store.
+        if self.stat() != self.signature:
+            with self.locked():
+                self.sync()
+
+    def sync(self) -> None:
+        # Called with locked() held.
+        signature = self.stat()
+        if signature == self.signature:
+            return
+        old = self.signature
+        if signature[:2] == old[:2] and old[2] is not None and signature[2] is not None \
+                and signature[2][0] == old[2][0] and signature[2][2] >= old[2][2]:
+            # Only the journal grew: replay what was appended since this store last read it.
+            with open(self.journalName, 'r', newline='') as journalFile:
+                journalFile.seek(old[2][2])
+                for entry in csv.reader(journalFile):
+                    self.apply(entry)
+                    self.journalEntries += 1
+            self.signature = signature
+        else:
+            self.load()
+
+    def exists(self) -> bool:
+        with self.lock:
+            return os.path.exists(self.fileName)
+
+    def byId(self, idNum: int) -> list:
+        with self.lock:
+            self.refresh()
+            return self.rows.get(idNum)
+
+    def byName(self, name: str) -> list:
+        with self.lock:
+            self.refresh()
+            ids = self.names.get(name)
+            return None if not ids else self.rows[next(iter(ids))]
+
+    def allRows(self) -> list:
+        with self.lock:
+            self.refresh()
+            return list(self.rows.values())
+
+    def nextId(self) -> int:
+        with self.lock:
+            self.refresh()
+            return self.nextFree
+
+    def searchKeys(self, kind: str, fragment: str, prefix: bool = False) -> dict:
+        """
+        KeyIndex.search over this store's rows.
+        Returns:
+            dict: {idNum: [paths of the matching keys]}.
+        Raises:
+            ValueError: If the store was opened without keysOf, or for an unknown kind.
+        """
+        with self.lock:
+            self.refresh()
+            if self.index is None:
+                raise ValueError(f"No key index for {self.fileName}")
+            return self.index.search(kind, fragment, prefix)
+
+    def insert(self, row: list) -> None:
+        """
+        Raises:
+            ValueError: If a row with the same id or name is already stored.
+        """
+        with self.locked():
+            self.sync()
+            if int(row[0]) in self.rows:
+                raise ValueError(f"Sample with id {row[0]} already exists.")
+            if row[1] in self.names:
+                raise ValueError(f"Sample with name {row[1]} already exists.")
+            self.write([UPSERT] + row)
+
+    def upsert(self, row: list) -> bool:
+        """Returns True if a row with that id was replaced, False if the row was added."""
+        with self.locked():
+            self.sync()
+            found = int(row[0]) in self.rows
+            self.write([UPSERT] + row)
+            return found
+
+    def deleteById(self, idNum: int) -> None:
+        with self.locked():
+            self.sync()
+            if idNum in self.rows:
+                self.write([DELETE, str(idNum)])
+
+    def deleteByName(self, name: str) -> None:
+        with self.locked():
+            self.sync()
+            # Deletes every row with the name, like the full rewrite it replaces.
+            for idNum in list(self.names.get(name, ())):
+                self.write([DELETE, str(idNum)])
+
+    def write(self, entry: list) -> None:
+        # Called with locked() held, after sync().
+        if not os.path.exists(self.fileName):
+            open(self.fileName, 'a').close()
+        with open(self.journalName, 'a', newline='') as journalFile:
+            csv.writer(journalFile).writerow(entry)
+        self.apply(entry)
+        self.journalEntries += 1
+        self.signature = self.stat()
+        if self.journalEntries > max(self.minCompact, len(self.rows)) and self.compactor is None:
+            self.startCompaction()
+
+    def compactNow(self) -> None:
+        """Rewrites the CSV from the current rows and waits for it to finish."""
+        self.flush()
+        with self.locked():
+            self.sync()
+            if self.compactor is None:
+                open(self.journalName, 'a').close()
+                self.startCompaction()
+        self.flush()
+
+    def startCompaction(self) -> bool:
+        # Called with locked() held, after sync(). The live journal is set aside and a new one
+        # started, so writes carry on while the snapshot is written out.
+        compactLock = open(self.compactLockName, 'a')
+        if fcntl is not None:
+            try:
+                fcntl.flock(compactLock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                # Another process is compacting; this one tries again on a later write.
+                compactLock.close()
+                return False
+        if os.path.exists(self.compactingName):
+            # Left by a compaction that failed; its entries are not in the CSV yet, so keep them.
+            with open(self.journalName, 'rb') as src, open(self.compactingName, 'ab') as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.journalName)
+        else:
+            os.replace(self.journalName, self.compactingName)
+        self.journalEntries = 0
+        self.signature = self.stat()
+        snapshot = list(self.rows.values())
+        self.compactor = threading.Thread(target=self.compact, args=(snapshot, compactLock), name=f"compact-{os.path.basename(self.fileName)}", daemon=True)
+        self.compactor.start()
+        return True
+
+    def compact(self, snapshot: list, compactLock) -> None:
+        tmpName = f"{self.fileName}.{os.getpid()}.tmp"
+        try:
+            with open(tmpName, 'w', newline='') as csvFile:
+                rows = snapshot if self.migrate is None else (self.migrate(row) for row in snapshot)
+                csv.writer(csvFile).writerows(rows)
+            with self.locked():
+                # Catch up first, so the new signature does not hide other processes' appends.
+                self.sync()
+                os.replace(tmpName, self.fileName)
+                os.remove(self.compactingName)
+                self.signature = self.stat()
+        except Exception as e:
+            # The set aside journal stays on disk and is replayed on the next load.
+            print(f"Error compacting {self.fileName}: {e}")
+        finally:
+            with self.lock:
+                self.compactor = None
+            compactLock.close()
+
+    def flush(self) -> None:
+        """Waits for a running compaction to finish."""
+        compactor = self.compactor
+        if compactor is not None:
+            compactor.join()
+
+
+def iterEntries(fileName: str):
+    """
+    Streams everything stored for a sample CSV in replay order: the CSV rows
+    as upserts, then the journal set aside by an unfinished compaction, then
+    the live journal.
+    Yields:
+        tuple: (entry as [op, fields...], True if it came from a journal)
+    """
+    if os.path.exists(fileName):
+        with open(fileName, 'r', newline='') as csvFile:
+            for row in csv.reader(csvFile):
+                yield [UPSERT] + row, False
+    for journal in (fileName + ".journal.compacting", fileName + ".journal"):
+        if os.path.exists(journal):
+            with open(journal, 'r', newline='') as journalFile:
+                for entry in csv.reader(journalFile):
+                    yield entry, True
+
+
+_stores = {}
+_storesLock = threading.Lock()
+
+
+def storeFor(fileName: str, migrate=None, keysOf=None) -> SampleStore:
+    """The process wide store for a CSV path, loaded on first use."""
+    key = os.path.abspath(fileName)
+    with _storesLock:
+        store = _stores.get(key)
+        if store is None:
+            store = SampleStore(fileName, migrate=migrate, keysOf=keysOf)
+            _stores[key] = store
+        return store
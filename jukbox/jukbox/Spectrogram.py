@@ -0,0 +1,311 @@
+import io
+import os
+import time
+
+import numpy as np
+import obspy
+from obspy.io.mseed.util import get_record_information
+
+from jukbox import Stft
+
+
+# Bytes read per record for its header; the fixed header and blockette 1000 sit well inside.
+HEADER_WINDOW = 512
+
+
+def iterRecordHeaders(f):
+    """
+    Yields (offset, header) for every miniSEED record in an open file, reading headers only.
+    Each header is parsed from a copy of the record's first bytes: handed the file itself,
+    obspy goes back to the first record whenever the bytes left after the offset are not
+    a multiple of 128, and every header would then describe record 0.
+    """
+    size = os.fstat(f.fileno()).st_size
+    offset = 0
+    # Fewer than 128 bytes cannot hold a record; trailing bytes like that are ignored, as obspy.read does.
+    while size - offset >= 128:
+        f.seek(offset)
+        head = f.read(HEADER_WINDOW)
+        if head[6:7] not in (b'D', b'R', b'Q', b'M'):
+            # Not a data record header, e.g. zero padding after the last record.
+            return
+        head += bytes(-len(head) % 128)
+        info = get_record_information(io.BytesIO(head))
+        yield offset, info
+        offset += info['record_length']
+
+
+def recordId(info) -> str:
+    return f"{info['network']}.{info['station']}.{info['location']}.{info['channel']}"
+
+
+def scanMseed(filePath, component='Z'):
+    """
+    Header only pass over a miniSEED file.
+    Returns:
+        tuple: (trace id, sampling rate, first start, last end) of the first trace on the component.
+        None: If no record is on that component.
+    """
+    traceId = samplingRate = start = end = None
+    with open(filePath, 'rb') as f:
+        for _, info in iterRecordHeaders(f):
+            if traceId is None:
+                if not info['channel'].endswith(component):
+                    continue
+                traceId, samplingRate = recordId(info), info['samp_rate']
+            elif recordId(info) != traceId:
+                continue
+            start = info['starttime'] if start is None else min(start, info['starttime'])
+            end = info['endtime'] if end is None else max(end, info['endtime'])
+    if traceId is None:
+        return None
+    return traceId, samplingRate, start, end
+
+
+def iterMseedBlocks(filePath, traceId, blockBytes=256 * 1024, progress=None):
+    """
+    Decodes the records of one trace a block at a time, so at most about
+    blockBytes of compressed data is in memory. Records of other channels
+    are skipped without being decoded.
+    Args:
+        progress (callable): Called with the fraction of the file read after each block.
+    Yields:
+        obspy.Trace: Contiguous pieces of the trace in file order.
+    """
+    size = os.path.getsize(filePath) or 1
+    with open(filePath, 'rb') as f:
+        block = bytearray()
+        for offset, info in iterRecordHeaders(f):
+            if recordId(info) != traceId:
+                continue
+            f.seek(offset)
+            block += f.read(info['record_length'])
+            if len(block) >= blockBytes:
+                yield from decodeBlock(block)
+                block = bytearray()
+                if progress is not None:
+                    progress((offset + info['record_length']) / size)
+        if block:
+            yield from decodeBlock(block)
+        if progress is not None:
+            progress(1.0)
+
+
+def decodeBlock(block):
+    st = obspy.read(io.BytesIO(bytes(block)), format='MSEED')
+    st.merge(method=1)
+    st.sort(keys=['starttime'])
+    # Gaps inside the block come back masked; split so each piece is contiguous.
+    yield from st.split()
+
+
+class ChunkedSpectrogram:
+    """
+    Builds a fixed width spectrogram strip of a long recording without holding
+    the recording in memory. Samples are fed in pieces; each complete STFT
+    frame is reduced into the pixel column its centre falls in, and only the
+    unconsumed tail of the last piece is carried over. Memory is bounded by
+    the piece size and the strip size, not by the length of the recording.
+    """
+
+    def __init__(self, samplingRate, starttime, endtime, nfft=1024, noverlap=512, fmin=1.0, fmax=40.0, width=2000):
+        """
+        Args:
+            samplingRate (float): Sampling rate of the trace in Hz.
+            starttime (UTCDateTime): Start of the strip.
+            endtime (UTCDateTime): End of the strip.
+            nfft (int): Samples per STFT frame.
+            noverlap (int): Overlap between consecutive frames in samples.
+            fmin (float): Lowest frequency kept, in Hz.
+            fmax (float): Highest frequency kept, in Hz. Clamped to Nyquist.
+            width (int): Number of time columns in the strip.
+        """
+        self.samplingRate = float(samplingRate)
+        self.starttime = starttime
+        self.duration = max(float(endtime - starttime), 1.0 / self.samplingRate)
+        self.nfft = nfft
+        self.hop = nfft - noverlap
+        self.width = width
+
+        self.bins, self.freqs = Stft.frequencyBins(nfft, self.samplingRate, fmin, fmax)
+
+        self.power = np.zeros((len(self.freqs), width))
+        self.counts = np.zeros(width, dtype=np.int64)
+        self.carry = np.empty(0)
+        self.carryStart = None
+
+    def feed(self, trace) -> None:
+        """Adds a contiguous piece of the trace. Pieces must arrive in time order."""
+        data = np.asarray(trace.data, dtype=np.float64)
+        expected = None if self.carryStart is None else self.carryStart + len(self.carry) / self.samplingRate
+        if expected is None or abs(trace.stats.starttime - expected) > 1.0 / self.samplingRate:
+            # Gap or overlap: frames never straddle it, the columns it covers simply stay empty.
+            self.carry = data
+            self.carryStart = trace.stats.starttime
+        else:
+            self.carry = np.concatenate([self.carry, data])
+        self.consume()
+
+    def consume(self) -> None:
+        rows = Stft.frames(self.carry, self.nfft, self.hop)
+        count = len(rows)
+        if count == 0:
+            return
+        power = Stft.framePower(rows, self.samplingRate, self.bins)
+
+        centres = float(self.carryStart - self.starttime) + (np.arange(count) * self.hop + self.nfft / 2) / self.samplingRate
+        columns = np.clip((centres / self.duration * self.width).astype(np.int64), 0, self.width - 1)
+        np.add.at(self.power.T, columns, power)
+        np.add.at(self.counts, columns, 1)
+
+        used = count * self.hop
+        self.carry = self.carry[used:].copy()
+        self.carryStart = self.carryStart + used / self.samplingRate
+
+    def decibels(self) -> np.ndarray:
+        """Mean power per column in dB, shaped (frequency, width). Columns without data are NaN."""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return Stft.toDecibels(self.power / self.counts)
+
+
+def chunkedSpectrogram(filePath, component='Z', blockBytes=256 * 1024, **kwargs):
+    """
+    Spectrogram strip of the first trace on a component, read block by block.
+    Returns:
+        ChunkedSpectrogram: The filled strip.
+        None: If the file has no trace on that component.
+    """
+    scan = scanMseed(filePath, component)
+    if scan is None:
+        return None
+    traceId, samplingRate, starttime, endtime = scan
+    strip = ChunkedSpectrogram(samplingRate, starttime, endtime, **kwargs)
+    for trace in iterMseedBlocks(filePath, traceId, blockBytes):
+        strip.feed(trace)
+    return strip
+
+
+class SampleFeed:
+    """Hands out the samples of one trace in arbitrary sized pulls, decoding blocks only as they are needed."""
+
+    def __init__(self, filePath, traceId, blockBytes=256 * 1024):
+        self.traces = iterMseedBlocks(filePath, traceId, blockBytes)
+        self.pending = np.empty(0)
+        self.exhausted = False
+
+    def take(self, count: int) -> np.ndarray:
+        """Returns up to `count` samples; fewer only once the file runs out."""
+        while len(self.pending) < count and not self.exhausted:
+            trace = next(self.traces, None)
+            if trace is None:
+                self.exhausted = True
+            else:
+                self.pending = np.concatenate([self.pending, np.asarray(trace.data, dtype=np.float64)])
+        out, self.pending = self.pending[:count], self.pending[count:]
+        return out
+
+    @property
+    def finished(self) -> bool:
+        return self.exhausted and len(self.pending) == 0
+
+
+class RollingSpectrogram:
+    """
+    Scrolling spectrogram of the most recent `span` seconds, kept as an RGB
+    image. Each feed computes only the STFT columns the new samples complete,
+    shifts the image left by that many columns and colours just those in.
+    The colour range follows the data like imshow's autoscaling, but only
+    widens, so the whole image is recoloured only when a louder or quieter
+    column than any before arrives.
+    """
+
+    def __init__(self, samplingRate, span=30.0, nfft=256, noverlap=128, fmin=1.0, fmax=40.0, lut=None):
+        self.samplingRate = float(samplingRate)
+        self.nfft = nfft
+        self.hop = nfft - noverlap
+        self.bins, self.freqs = Stft.frequencyBins(nfft, self.samplingRate, fmin, fmax)
+        self.width = max(1, int(round(span * self.samplingRate / self.hop)))
+        self.lut = Stft.colormapLut() if lut is None else lut
+
+        self.db = np.full((len(self.freqs), self.width), np.nan, dtype=np.float32)
+        self.image = np.zeros((len(self.freqs), self.width, 3), dtype=np.uint8)
+        self.image[:] = self.lut[0]
+        self.vmin = self.vmax = None
+        self.carry = np.empty(0)
+        self.columns = 0
+
+    def feed(self, samples: np.ndarray) -> int:
+        """
+        Adds the next samples of the stream.
+        Returns:
+            int: Number of new columns.
+        """
+        self.carry = np.concatenate([self.carry, samples]) if len(self.carry) else np.asarray(samples, dtype=np.float64)
+        rows = Stft.frames(self.carry, self.nfft, self.hop)
+        count = len(rows)
+        if count == 0:
+            return 0
+        db = Stft.toDecibels(Stft.framePower(rows, self.samplingRate, self.bins).T).astype(np.float32)
+        self.carry = self.carry[count * self.hop:].copy()
+        self.columns += count
+
+        if count >= self.width:
+            db = db[:, -self.width:]
+            count = self.width
+        self.scroll(self.db, count)
+        self.db[:, -count:] = db
+        if self.widenRange(db):
+            self.image = Stft.toRgb(self.db, self.vmin, self.vmax, self.lut)
+        else:
+            self.scroll(self.image, count)
+            self.image[:, -count:] = Stft.toRgb(db, self.vmin, self.vmax, self.lut)
+        return count
+
+    @staticmethod
+    def scroll(array: np.ndarray, count: int) -> None:
+        if count < array.shape[1]:
+            array[:, :-count] = array[:, count:]
+
+    def widenRange(self, db: np.ndarray) -> bool:
+        finite = db[np.isfinite(db)]
+        if not finite.size:
+            return False
+        low, high = float(finite.min()), float(finite.max())
+        if self.vmin is not None and low >= self.vmin and high <= self.vmax:
+            return False
+        self.vmin = low if self.vmin is None else min(self.vmin, low)
+        self.vmax = high if self.vmax is None else max(self.vmax, high)
+        return True
+
+    def encode(self, format='JPEG', size=None) -> bytes:
+        return Stft.encodeImage(self.image, format=format, size=size)
+
+
+def rollingFrames(filePath, component='Z', fps=10.0, span=30.0, size=None, clock=time.monotonic, sleep=time.sleep, **kwargs):
+    """
+    Replays a file as a live spectrogram. Samples are released at their real
+    rate: on each tick the samples whose time has come are fed in one go, so a
+    viewer that falls behind is caught up with a single frame instead of a
+    backlog. Ticks without a new column produce no frame.
+    Yields:
+        bytes: Encoded JPEG frames.
+    """
+    scan = scanMseed(filePath, component)
+    if scan is None:
+        return
+    traceId, samplingRate = scan[0], scan[1]
+    feed = SampleFeed(filePath, traceId)
+    rolling = RollingSpectrogram(samplingRate, span=span, **kwargs)
+
+    start = clock()
+    released = 0
+    while not feed.finished:
+        due = int((clock() - start) * samplingRate) - released
+        if due > 0:
+            samples = feed.take(due)
+            released += due
+            if rolling.feed(samples):
+                yield rolling.encode('JPEG', size)
+        # Sleep to the next tick boundary so pacing never drifts from sample time.
+        elapsed = clock() - start
+        sleep(max(0.0, (int(elapsed * fps) + 1) / fps - elapsed))
@@ -0,0 +1,205 @@
+import os
+import json
+import shutil
+import threading
+
+import numpy as np
+
+from jukbox import Stft
+from jukbox.DiskCache import CACHE_DIR
+from jukbox.Spectrogram import scanMseed, iterMseedBlocks
+
+
+PYRAMID_DIR = os.path.join(CACHE_DIR, "pyramids")
+TILE_WIDTH = 256
+# Columns processed at a time while building, which bounds the build's memory.
+BUILD_COLUMNS = 2048
+
+
+class SpectrogramPyramid:
+    """
+    Multi-resolution spectrogram of one recording, stored as one float16 .npy
+    file of dB values per level and opened memory-mapped.
+
+    Level 0 has one column per STFT frame, placed by its time so gaps stay
+    empty (NaN). Each level above averages pairs of columns of the one below
+    in the power domain, until a level fits in a single tile. A tile is a
+    TILE_WIDTH column slice of a level, so serving any zoom or pan is a slice
+    of a memory map.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as f:
+            self.meta = json.load(f)
+        self.levels = [
+            np.load(os.path.join(directory, f"level{n}.npy"), mmap_mode='r')
+            for n in range(len(self.meta['widths']))
+        ]
+
+    @classmethod
+    def build(cls, filePath: str, directory: str, component='Z', nfft=1024, noverlap=512, fmin=1.0, fmax=40.0, tileWidth=TILE_WIDTH, progress=None):
+        """
+        Builds the pyramid for a miniSEED file into `directory`, replacing any
+        previous one. The file is read block by block and every level is
+        written through a memory map, so memory does not grow with the recording.
+        Args:
+            progress (callable): Called with the fraction done, reading counting for 90%.
+        Returns:
+            SpectrogramPyramid: The new pyramid.
+            None: If the file has no trace on the component.
+        """
+        scan = scanMseed(filePath, component)
+        if scan is None:
+            return None
+        traceId, samplingRate, starttime, endtime = scan
+        hop = nfft - noverlap
+        bins, freqs = Stft.frequencyBins(nfft, samplingRate, fmin, fmax)
+        width = max(1, int((endtime - starttime) * samplingRate) // hop + 1)
+
+        tmpDir = f"{directory}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.rmtree(tmpDir, ignore_errors=True)
+        os.makedirs(tmpDir)
+        level0 = np.lib.format.open_memmap(os.path.join(tmpDir, "level0.npy"), mode='w+', dtype=np.float16, shape=(len(freqs), width))
+        level0[:] = np.nan
+
+        carry, carryStart = np.empty(0), None
+        readProgress = None if progress is None else (lambda fraction: progress(0.9 * fraction))
+        for trace in iterMseedBlocks(filePath, traceId, progress=readProgress):
+            data = np.asarray(trace.data, dtype=np.float64)
+            if carryStart is not None and abs(trace.stats.starttime - (carryStart + len(carry) / samplingRate)) <= 1.0 / samplingRate:
+                carry = np.concatenate([carry, data])
+            else:
+                carry, carryStart = data, trace.stats.starttime
+            rows = Stft.frames(carry, nfft, hop)
+            if len(rows) == 0:
+                continue
+            db = Stft.toDecibels(Stft.framePower(rows, samplingRate, bins).T)
+            first = int(round((carryStart - starttime) * samplingRate / hop))
+            last = min(first + len(rows), width)
+            if last > first:
+                level0[:, first:last] = db[:, :last - first]
+            used = len(rows) * hop
+            carry, carryStart = carry[used:].copy(), carryStart + used / samplingRate
+        level0.flush()
+
+        levels = [level0]
+        while levels[-1].shape[1] > tileWidth:
+            levels.append(halve(levels[-1], os.path.join(tmpDir, f"level{len(levels)}.npy")))
+            if progress is not None:
+                progress(min(0.99, 0.9 + 0.1 * (1 - levels[-1].shape[1] / width)))
+
+        top = np.asarray(levels[-1], dtype=np.float32)
+        finite = top[np.isfinite(top)]
+        vmin, vmax = (float(np.percentile(finite, 1)), float(np.percentile(finite, 99.9))) if finite.size else (0.0, 1.0)
+        meta = {
+            'source': os.path.basename(filePath),
+            'sourceMtime': os.path.getmtime(filePath),
+            'traceId': traceId,
+            'starttime': str(starttime),
+            'samplingRate': samplingRate,
+            'nfft': nfft,
+            'hop': hop,
+            'secondsPerColumn': hop / samplingRate,
+            'freqs': [float(freqs[0]), float(freqs[-1])],
+            'freqBins': len(freqs),
+            'tileWidth': tileWidth,
+            'widths': [level.shape[1] for level in levels],
+            'vmin': vmin,
+            'vmax': vmax,
+        }
+        del levels, level0
+        with open(os.path.join(tmpDir, "meta.json"), 'w') as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmpDir, directory)
+        return cls(directory)
+
+    def tileCount(self, level: int) -> int:
+        return -(-self.meta['widths'][level] // self.meta['tileWidth'])
+
+    def tile(self, level: int, index: int) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: float16 dB values shaped (frequency, up to tileWidth), low frequencies first.
+        Raises:
+            IndexError: If the level or tile does not exist.
+        """
+        if not 0 <= level < len(self.levels) or not 0 <= index < self.tileCount(level):
+            raise IndexError(f"No tile {index} at level {level}")
+        start = index * self.meta['tileWidth']
+        return self.levels[level][:, start:start + self.meta['tileWidth']]
+
+    def renderTile(self, level: int, index: int) -> bytes:
+        """PNG of a tile, coloured against the range of the whole recording so tiles line up."""
+        db = np.asarray(self.tile(level, index), dtype=np.float32)
+        return Stft.encodeImage(Stft.toRgb(db, self.meta['vmin'], self.meta['vmax']), format='PNG')
+
+    def strip(self, minWidth: int = 1000) -> np.ndarray:
+        """The coarsest level at least minWidth columns wide (or level 0), as float32 dB."""
+        for level in reversed(self.levels):
+            if level.shape[1] >= minWidth:
+                return np.asarray(level, dtype=np.float32)
+        return np.asarray(self.levels[0], dtype=np.float32)
+
+
+def halve(level: np.ndarray, path: str) -> np.ndarray:
+    """Next level up: pairs of columns averaged in power, NaN where both are empty."""
+    width = -(-level.shape[1] // 2)
+    out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float16, shape=(level.shape[0], width))
+    for start in range(0, level.shape[1], BUILD_COLUMNS):
+        db = np.asarray(level[:, start:start + BUILD_COLUMNS], dtype=np.float32)
+        if db.shape[1] % 2:
+            db = np.concatenate([db, np.full((db.shape[0], 1), np.nan, dtype=np.float32)], axis=1)
+        power = np.power(10.0, db / 10.0).reshape(db.shape[0], -1, 2)
+        valid = ~np.isnan(power)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, power, 0.0).sum(axis=2) / valid.sum(axis=2)
+        out[:, start // 2:start // 2 + mean.shape[1]] = Stft.toDecibels(mean)
+    out.flush()
+    return out
+
+
+_openPyramids = {}
+_openLock = threading.Lock()
+
+
+def pyramidDir(fileName: str) -> str:
+    return os.path.join(PYRAMID_DIR, os.path.basename(fileName))
+
+
+def buildPyramid(filePath: str, **kwargs) -> SpectrogramPyramid:
+    pyramid = SpectrogramPyramid.build(filePath, pyramidDir(filePath), **kwargs)
+    with _openLock:
+        _openPyramids.pop(os.path.basename(filePath), None)
+    return pyramid
+
+
+def loadPyramid(fileName: str) -> SpectrogramPyramid:
+    """
+    Returns the built pyramid for an upload, keeping it open between requests.
+    Returns:
+        SpectrogramPyramid: The pyramid.
+        None: If none has been built.
+    """
+    directory = pyramidDir(fileName)
+    metaPath = os.path.join(directory, "meta.json")
+    with _openLock:
+        cached = _openPyramids.get(os.path.basename(fileName))
+        try:
+            mtime = os.path.getmtime(metaPath)
+        except OSError:
+            _openPyramids.pop(os.path.basename(fileName), None)
+            return None
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        pyramid = SpectrogramPyramid(directory)
+        _openPyramids[os.path.basename(fileName)] = (mtime, pyramid)
+        return pyramid
+
+
+def removePyramid(fileName: str) -> None:
+    with _openLock:
+        _openPyramids.pop(os.path.basename(fileName), None)
+    shutil.rmtree(pyramidDir(fileName), ignore_errors=True)
@@ -0,0 +1,448 @@
+import math
+import heapq
+import itertools
+import threading
+
+import numpy as np
+import obspy
+from scipy.spatial import cKDTree
+
+
+CHANNEL_FIELDS = ('seedId', 'network', 'station', 'lat', 'lon', 'elev', 'depth', 'start', 'end')
+
+
+def channelArrays(inventory, approvedChannels, stationIds: dict = None, networkIds: dict = None) -> dict:
+    """
+    Flattens a channel level inventory into parallel arrays with one entry per
+    approved channel epoch, in inventory order. Open ended epochs get +/-inf and
+    missing coordinates NaN.
+    Args:
+        inventory (Inventory): Channel level obspy inventory.
+        approvedChannels (list): Channel codes to keep.
+        stationIds (dict): Optional "NET.STA" -> int map, shared so station numbers
+            stay stable across several inventories.
+        networkIds (dict): Optional "NET" -> int map, same idea for networks.
+    """
+    approved = set(approvedChannels)
+    if stationIds is None:
+        stationIds = {}
+    if networkIds is None:
+        networkIds = {}
+    seedIds = []
+    networks = []
+    stations = []
+    lats = []
+    lons = []
+    elevs = []
+    depths = []
+    starts = []
+    ends = []
+    for network in inventory:
+        networkNum = networkIds.setdefault(network.code, len(networkIds))
+        for station in network:
+            stationNum = stationIds.setdefault(f"{network.code}.{station.code}", len(stationIds))
+            for channel in station.channels:
+                if channel.code not in approved:
+                    continue
+                seedIds.append(f"{network.code}.{station.code}.{channel.location_code}.{channel.code}")
+                networks.append(networkNum)
+                stations.append(stationNum)
+                lats.append(channel.latitude if channel.latitude is not None else np.nan)
+                lons.append(channel.longitude if channel.longitude is not None else np.nan)
+                elevs.append(channel.elevation if channel.elevation is not None else np.nan)
+                depths.append(channel.depth if channel.depth is not None else np.nan)
+                starts.append(channel.start_date.timestamp if channel.start_date else -np.inf)
+                ends.append(channel.end_date.timestamp if channel.end_date else np.inf)
+    return {
+        'seedId': np.asarray(seedIds, dtype=object),
+        'network': np.asarray(networks, dtype=np.int64),
+        'station': np.asarray(stations, dtype=np.int64),
+        'lat': np.asarray(lats, dtype=np.float64),
+        'lon': np.asarray(lons, dtype=np.float64),
+        'elev': np.asarray(elevs, dtype=np.float64),
+        'depth': np.asarray(depths, dtype=np.float64),
+        'start': np.asarray(starts, dtype=np.float64),
+        'end': np.asarray(ends, dtype=np.float64),
+    }
+
+
+class kClosest():
+    def __init__(self, eventId, num):
+        self.eventId = eventId
+        self.num = num
+        self.arr = []
+        self.counter = itertools.count()
+
+    def __len__(self):
+        return len(self.arr)
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self.arr):
+            raise IndexError("Index out of range")
+        return self.arr[index][-1]
+
+    def __str__(self):
+        return str(self.arr)
+
+    def append(self, item):
+        # Max-heap on distance via negation; the root is the farthest kept item.
+        # The counter breaks distance ties so the item dicts are never compared.
+        distance = item.get('distance')
+        wrapper = (-1 * distance, next(self.counter), item)
+
+        if len(self.arr) < self.num:
+            heapq.heappush(self.arr, wrapper)
+        else:
+            if wrapper[0] > self.arr[0][0]:
+                heapq.heappushpop(self.arr, wrapper)
+
+
+def emptyChannels() -> dict:
+    return {field: np.asarray([], dtype=object if field == 'seedId' else np.int64 if field in ('network', 'station') else np.float64)
+            for field in CHANNEL_FIELDS}
+
+
+def subsetChannels(channels: dict, indices) -> dict:
+    return {field: channels[field][indices] for field in CHANNEL_FIELDS}
+
+
+def toUnitVectors(lats, lons) -> np.ndarray:
+    lat = np.radians(np.asarray(lats, dtype=np.float64))
+    lon = np.radians(np.asarray(lons, dtype=np.float64))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+def degreesToChord(degrees: float) -> float:
+    """Straight line distance between two points on the unit sphere that are `degrees` apart."""
+    return 2.0 * np.sin(np.radians(min(float(degrees), 180.0)) / 2.0)
+
+
+class EpochIndex:
+    """
+    Sorted epoch index over a set of channel rows. Rows are ordered by epoch
+    start, so the channels that began before a window ends form a prefix found by
+    binary search; only that prefix is checked against the window start.
+    """
+
+    def __init__(self, channels: dict, rows: np.ndarray):
+        order = np.argsort(channels['start'][rows], kind='stable')
+        self.rows = rows[order]
+        self.starts = channels['start'][self.rows]
+        self.ends = channels['end'][self.rows]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def active(self, starttime: float, endtime: float) -> np.ndarray:
+        """
+        Args:
+            starttime (float), endtime (float): Window as POSIX timestamps.
+        Returns:
+            np.ndarray: Rows whose epoch overlaps the window, in start order.
+        """
+        prefix = np.searchsorted(self.starts, endtime, side='right')
+        return self.rows[:prefix][self.ends[:prefix] >= starttime]
+
+
+class StationIndex:
+    """
+    In memory spatial index over the channel epochs of one or more StationXML
+    inventories. Channels are stored as unit sphere vectors in a KD-tree, so
+    radius and nearest neighbour lookups are tree queries rather than network
+    round trips.
+
+    The index also remembers which (circle, time window) regions it has been
+    filled for, so callers can tell a warm region from one that still needs an
+    FDSN request.
+    """
+
+    def __init__(self, approvedChannels: list, maxChannels: int = 500000, maxCoverage: int = 4096):
+        self.approvedChannels = approvedChannels
+        self.maxChannels = maxChannels
+        self.maxCoverage = maxCoverage
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.channels = emptyChannels()
+            self.stationIds = {}
+            self.networkIds = {}
+            self.epochKeys = set()
+            self.coverage = []
+            self.tree = None
+            self.treeRows = np.asarray([], dtype=np.int64)
+            self.partitions = []
+
+    @classmethod
+    def fromFile(cls, path: str, approvedChannels: list, cover: bool = True):
+        """
+        Builds an index from a StationXML file.
+        Args:
+            path (str): Path to the StationXML file.
+            approvedChannels (list): Channel codes to index.
+            cover (bool): Treat the file as complete for the whole globe and all time.
+        """
+        index = cls(approvedChannels)
+        index.add(obspy.read_inventory(path))
+        if cover:
+            index.markCovered(0.0, 0.0, 180.0, -np.inf, np.inf)
+        return index
+
+    def __len__(self):
+        return len(self.channels['seedId'])
+
+    def add(self, inventory) -> int:
+        """
+        Merges an inventory into the index, skipping channel epochs already present.
+        Returns:
+            int: Number of channel epochs added.
+        """
+        with self.lock:
+            incoming = channelArrays(inventory, self.approvedChannels, self.stationIds, self.networkIds)
+            keep = []
+            for i, (seedId, start) in enumerate(zip(incoming['seedId'], incoming['start'])):
+                key = (seedId, start)
+                if key in self.epochKeys:
+                    continue
+                self.epochKeys.add(key)
+                keep.append(i)
+            if not keep:
+                return 0
+            if len(self) and len(self) + len(keep) > self.maxChannels:
+                # Start over rather than grow without bound; coverage goes with it.
+                print("Station index full, resetting.")
+                self.reset()
+                return self.add(inventory)
+            incoming = subsetChannels(incoming, np.asarray(keep, dtype=np.int64))
+            self.channels = {field: np.concatenate((self.channels[field], incoming[field])) for field in CHANNEL_FIELDS}
+            self.rebuild()
+            return len(keep)
+
+    def rebuild(self) -> None:
+        self.partitions = [EpochIndex(self.channels, rows) for rows in partitionByNetwork(self.channels)]
+        valid = ~(np.isnan(self.channels['lat']) | np.isnan(self.channels['lon']))
+        self.treeRows = np.flatnonzero(valid)
+        if len(self.treeRows) == 0:
+            self.tree = None
+            return
+        self.tree = cKDTree(toUnitVectors(self.channels['lat'][self.treeRows], self.channels['lon'][self.treeRows]))
+
+    def markCovered(self, lat, lon, radius, starttime, endtime) -> None:
+        """Records that the index holds everything the provider has for this region and window."""
+        with self.lock:
+            self.coverage.append((float(lat), float(lon), float(radius), toTimestamp(starttime), toTimestamp(endtime)))
+            if len(self.coverage) > self.maxCoverage:
+                del self.coverage[0]
+
+    def covers(self, lat, lon, radius, starttime, endtime) -> bool:
+        starttime = toTimestamp(starttime)
+        endtime = toTimestamp(endtime)
+        with self.lock:
+            for cLat, cLon, cRadius, cStart, cEnd in self.coverage:
+                if cStart > starttime or cEnd < endtime:
+                    continue
+                if cRadius >= 180.0 or angularDistance(lat, lon, cLat, cLon) + radius <= cRadius:
+                    return True
+        return False
+
+    def withinRadius(self, lat, lon, radius) -> np.ndarray:
+        """
+        Returns:
+            np.ndarray: Sorted channel row indices within `radius` degrees of (lat, lon).
+        """
+        with self.lock:
+            if self.tree is None:
+                return np.asarray([], dtype=np.int64)
+            hits = self.tree.query_ball_point(toUnitVectors([lat], [lon])[0], degreesToChord(radius) + 1e-12)
+            return np.sort(self.treeRows[np.asarray(hits, dtype=np.int64)])
+
+    def active(self, indices: np.ndarray, starttime, endtime) -> np.ndarray:
+        starttime = toTimestamp(starttime)
+        endtime = toTimestamp(endtime)
+        mask = (self.channels['start'][indices] <= endtime) & (self.channels['end'][indices] >= starttime)
+        return indices[mask]
+
+    def nearest(self, lat, lon, k: int, starttime=None, endtime=None) -> np.ndarray:
+        """
+        Finds the k nearest stations, optionally only those with a channel active
+        during [starttime, endtime]. One channel row is returned per station.
+        Returns:
+            np.ndarray: Channel row indices ordered by distance.
+        """
+        with self.lock:
+            if self.tree is None:
+                return np.asarray([], dtype=np.int64)
+            total = len(self.treeRows)
+            point = toUnitVectors([lat], [lon])[0]
+            want = min(total, max(4 * k, 32))
+            while True:
+                _, hits = self.tree.query(point, k=want)
+                rows = self.treeRows[np.atleast_1d(hits)]
+                if starttime is not None and endtime is not None:
+                    rows = self.active(rows, starttime, endtime)
+                _, first = np.unique(self.channels['station'][rows], return_index=True)
+                if len(first) >= k or want >= total:
+                    return rows[np.sort(first)][:k]
+                want = min(total, want * 4)
+
+    def query(self, lat, lon, radius) -> dict:
+        """Channel arrays, in the same layout as channelArrays, for everything within the radius."""
+        with self.lock:
+            return subsetChannels(self.channels, self.withinRadius(lat, lon, radius))
+
+    def select(self, lat, lon, radius, windows: dict, k: int, executor=None) -> dict:
+        """
+        selectClosest restricted to channels within the radius, using the cached
+        per network epoch indexes instead of scanning every channel per event.
+        Returns:
+            dict: eventId -> kClosest
+        """
+        with self.lock:
+            channels = self.channels
+            partitions = self.partitions
+            rows = self.withinRadius(lat, lon, radius)
+        mask = np.zeros(len(channels['seedId']), dtype=bool)
+        mask[rows] = True
+        partitions = [p for p in partitions if mask[p.rows].any()]
+        return selectClosest(channels, windows, lat, lon, k, executor, partitions=partitions, mask=mask)
+
+
+def getStationDistances(lats, lons, lat, long) -> np.ndarray:
+    """
+    Vectorized getStationDistance: great circle distance in km from (lat, long)
+    to every station in the coordinate arrays. Missing coordinates give inf.
+    """
+    lat1 = np.radians(np.asarray(lats, dtype=np.float64))
+    lon1 = np.radians(np.asarray(lons, dtype=np.float64))
+    lat2 = math.radians(lat)
+    lon2 = math.radians(long)
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * math.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    c = 2 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    distances = c * 6371.0
+    distances[np.isnan(distances)] = np.inf
+    return distances
+
+
+def kNearestIndices(distances: np.ndarray, candidates: np.ndarray, k: int) -> np.ndarray:
+    """Returns the (unordered) k candidate indices with the smallest distance."""
+    if len(candidates) <= k:
+        return candidates
+    return candidates[np.argpartition(distances[candidates], k - 1)[:k]]
+
+
+def partitionByNetwork(channels: dict) -> list:
+    """
+    Splits channel rows into one array of row indices per network, keeping
+    inventory order inside each network.
+    """
+    networks = channels['network']
+    if len(networks) == 0:
+        return []
+    order = np.argsort(networks, kind='stable')
+    _, starts = np.unique(networks[order], return_index=True)
+    return np.split(order, starts[1:])
+
+
+def closestInPartition(channels: dict, epochs: EpochIndex, mask: np.ndarray, distances: np.ndarray, windows: dict, k: int) -> dict:
+    """
+    Partial result for one partition: the k closest candidate rows per event.
+    Pure function of its arguments, so partitions can run concurrently without a lock.
+    Returns:
+        dict: eventId -> np.ndarray of channel row indices
+    """
+    partial = {}
+    for eventId, (starttime, endtime) in windows.items():
+        active = epochs.active(starttime.timestamp, endtime.timestamp)
+        if mask is not None:
+            active = active[mask[active]]
+        if len(active) == 0:
+            partial[eventId] = active
+            continue
+        # Back to inventory order so each station keeps its first listed channel.
+        active = np.sort(active)
+        _, first = np.unique(channels['station'][active], return_index=True)
+        partial[eventId] = kNearestIndices(distances, active[first], k)
+    return partial
+
+
+def selectClosest(channels: dict, windows: dict, lat, lon, k, executor=None, minParallelRows: int = 20000, partitions: list = None, mask: np.ndarray = None) -> dict:
+    """
+    Picks the k closest stations for every event window from channelArrays output.
+    Each station contributes only its first channel active during the window, and
+    distance is measured from the search centre.
+
+    Rows are split per network into EpochIndex partitions. Large inputs hand the
+    partitions to the executor; each worker returns its own partial top k and the
+    results are reduced into kClosest heaps on the calling thread, so nothing is
+    shared between workers.
+    Args:
+        channels (dict): Output of channelArrays or StationIndex.query.
+        windows (dict): eventId -> (starttime, endtime) as UTCDateTime.
+        lat (float), lon (float): Search centre.
+        k (int): Stations to keep per event.
+        executor (Executor): Optional bounded pool for the per network step.
+        minParallelRows (int): Below this many rows everything runs inline.
+        partitions (list): Prebuilt EpochIndex per network, e.g. from StationIndex.
+        mask (np.ndarray): Optional boolean row filter applied inside the partitions.
+    Returns:
+        dict: eventId -> kClosest
+    """
+    rowCount = len(channels['seedId'])
+    if partitions is None:
+        partitions = [EpochIndex(channels, rows) for rows in partitionByNetwork(channels)]
+    distances = np.full(rowCount, np.inf)
+    wanted = np.flatnonzero(mask) if mask is not None else np.arange(rowCount)
+    distances[wanted] = getStationDistances(channels['lat'][wanted], channels['lon'][wanted], lat, lon)
+
+    work = lambda epochs: closestInPartition(channels, epochs, mask, distances, windows, k)
+    if executor is None or len(wanted) < minParallelRows:
+        partials = [work(epochs) for epochs in partitions]
+    else:
+        partials = list(executor.map(work, partitions))
+
+    results = {}
+    for eventId, (starttime, endtime) in windows.items():
+        closest = kClosest(eventId, k)
+        results[eventId] = closest
+        candidates = [p[eventId] for p in partials if len(p.get(eventId, ()))]
+        if not candidates:
+            continue
+        for i in kNearestIndices(distances, np.concatenate(candidates), k):
+            closest.append(stationRecord(channels, i, distances[i], starttime, endtime))
+    return results
+
+
+def stationRecord(channels: dict, i: int, distance: float, starttime, endtime) -> dict:
+    network, station, location, channel = channels['seedId'][i].split(".")
+    return {
+        'seedId': channels['seedId'][i],
+        'network': network,
+        'station': station,
+        'channel': channel,
+        'latLng': {'lat': float(channels['lat'][i]), 'lng': float(channels['lon'][i])},
+        'icon': f"/static/jukbox/img/station.jpg",
+        'lat': float(channels['lat'][i]),
+        'lon': float(channels['lon'][i]),
+        'distance': float(distance),
+        'elev': None if np.isnan(channels['elev'][i]) else float(channels['elev'][i]),
+        'depth': None if np.isnan(channels['depth'][i]) else float(channels['depth'][i]),
+        'starttime': starttime.isoformat(),
+        'endtime': endtime.isoformat()
+    }
+
+
+def toTimestamp(t) -> float:
+    if t is None:
+        return np.nan
+    if isinstance(t, (int, float)):
+        return float(t)
+    return obspy.UTCDateTime(t).timestamp
+
+
+def angularDistance(lat1, lon1, lat2, lon2) -> float:
+    """Great circle separation in degrees."""
+    a, b = toUnitVectors([lat1, lat2], [lon1, lon2])
+    # atan2 of sine and cosine stays exact near zero, where arccos of the dot product loses ~1e-6 degrees.
+    return float(np.degrees(np.arctan2(np.linalg.norm(np.cross(a, b)), np.dot(a, b))))
@@ -0,0 +1,129 @@
+import io
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+
+
+@lru_cache(maxsize=32)
+def window(n: int, name: str = 'hann') -> np.ndarray:
+    """
+    Read only analysis window, built once per (length, name).
+    'hann' is numpy's symmetric hanning window, the one matplotlib's specgram uses.
+    """
+    if name == 'hann':
+        w = np.hanning(n)
+    else:
+        from scipy.signal import get_window
+        w = get_window(name, n, fftbins=False)
+    w.setflags(write=False)
+    return w
+
+
+@lru_cache(maxsize=32)
+def psdScale(n: int, samplingRate: float, name: str = 'hann') -> float:
+    """One sided power spectral density scaling for a window."""
+    return 2.0 / (samplingRate * np.sum(window(n, name) ** 2))
+
+
+def frames(data: np.ndarray, nfft: int, hop: int) -> np.ndarray:
+    """
+    Every complete frame of `data` as rows of a strided view. No samples are copied.
+    Returns:
+        np.ndarray: Shape (count, nfft); count is 0 when data is shorter than one frame.
+    """
+    if len(data) < nfft:
+        return np.empty((0, nfft), dtype=np.float64)
+    return sliding_window_view(data, nfft)[::hop]
+
+
+def framePower(frameRows: np.ndarray, samplingRate: float, bins=slice(None), name: str = 'hann') -> np.ndarray:
+    """
+    Power spectral density of each frame, computed in one batched rfft.
+    Returns:
+        np.ndarray: Shape (count, frequency bins), restricted to `bins`.
+    """
+    nfft = frameRows.shape[1]
+    spectra = np.fft.rfft(frameRows * window(nfft, name), axis=1)[:, bins]
+    return (spectra.real ** 2 + spectra.imag ** 2) * psdScale(nfft, samplingRate, name)
+
+
+def frequencyBins(nfft: int, samplingRate: float, fmin: float = 0.0, fmax: float = None):
+    """
+    Returns:
+        tuple: (slice into the rfft bins between fmin and fmax, the frequencies of those bins)
+    """
+    freqs = np.fft.rfftfreq(nfft, 1.0 / samplingRate)
+    fmax = samplingRate / 2 if fmax is None else min(fmax, samplingRate / 2)
+    band = np.flatnonzero((freqs >= fmin) & (freqs <= fmax))
+    bins = slice(band[0], band[-1] + 1) if len(band) else slice(0, len(freqs))
+    return bins, freqs[bins]
+
+
+def stft(data, samplingRate: float, nfft: int = 256, noverlap: int = 128, fmin: float = 0.0, fmax: float = None, name: str = 'hann'):
+    """
+    Spectrogram of a whole array.
+    Returns:
+        tuple: (frequencies, frame centre times in seconds, power shaped (frequency, time))
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if 0 < len(data) < nfft:
+        # Like matplotlib, a segment shorter than one frame is zero padded rather than dropped.
+        data = np.pad(data, (0, nfft - len(data)))
+    hop = nfft - noverlap
+    bins, freqs = frequencyBins(nfft, samplingRate, fmin, fmax)
+    rows = frames(data, nfft, hop)
+    times = (np.arange(len(rows)) * hop + nfft / 2) / samplingRate
+    return freqs, times, framePower(rows, samplingRate, bins, name).T
+
+
+def toDecibels(power: np.ndarray) -> np.ndarray:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 10 * np.log10(power)
+
+
+@lru_cache(maxsize=8)
+def colormapLut(name: str = 'magma') -> np.ndarray:
+    """
+    256 entry RGB lookup table for a matplotlib colormap. Matplotlib is only
+    touched the first time a colormap is asked for, never per frame.
+    """
+    from matplotlib import colormaps
+    lut = (colormaps[name](np.linspace(0.0, 1.0, 256))[:, :3] * 255 + 0.5).astype(np.uint8)
+    lut.setflags(write=False)
+    return lut
+
+
+def toRgb(db: np.ndarray, vmin: float = None, vmax: float = None, lut: np.ndarray = None) -> np.ndarray:
+    """
+    Maps a (frequency, time) dB array to an RGB image with low frequencies at
+    the bottom. Limits default to the finite range of the data, like imshow's
+    autoscaling; NaN and -inf pixels take the lowest colour.
+    Returns:
+        np.ndarray: Shape (frequency, time, 3), dtype uint8.
+    """
+    lut = colormapLut() if lut is None else lut
+    finite = db[np.isfinite(db)]
+    if vmin is None:
+        vmin = float(finite.min()) if finite.size else 0.0
+    if vmax is None:
+        vmax = float(finite.max()) if finite.size else 1.0
+    span = vmax - vmin if vmax > vmin else 1.0
+    with np.errstate(invalid='ignore'):
+        index = np.nan_to_num((db - vmin) * ((len(lut) - 1) / span), nan=0.0, neginf=0.0, posinf=len(lut) - 1)
+    index = np.clip(index, 0, len(lut) - 1).astype(np.uint8)
+    return lut[index[::-1]]
+
+
+def encodeImage(rgb: np.ndarray, format: str = 'PNG', size: tuple = None, quality: int = 85) -> bytes:
+    """Encodes an RGB array, optionally scaled to (width, height) first."""
+    img = Image.fromarray(rgb, 'RGB')
+    if size is not None and img.size != tuple(size):
+        img = img.resize(size, Image.NEAREST)
+    buf = io.BytesIO()
+    if format.upper() in ('JPEG', 'JPG'):
+        img.save(buf, format='JPEG', quality=quality)
+    else:
+        img.save(buf, format=format)
+    return buf.getvalue()
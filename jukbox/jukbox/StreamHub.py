@@ -0,0 +1,191 @@
+import time
+import asyncio
+import threading
+from collections import deque
+
+
+class BroadcastChannel:
+    """
+    One producer, many viewers. The producer thread renders frames into a
+    small ring buffer; viewers are woken when a frame lands and always take
+    the newest one, so a slow viewer skips frames instead of queueing them and
+    memory stays at the ring size however many viewers there are.
+    """
+
+    def __init__(self, key, factory, ringSize: int = 4, idleTimeout: float = 10.0, onClose=None):
+        """
+        Viewers attach through StreamHub, which counts them in and out.
+        Args:
+            key: Identifies the stream in the hub.
+            factory (callable): Returns the frame iterator the producer drains.
+            ringSize (int): Frames kept for viewers that join or wake late.
+            idleTimeout (float): Seconds without viewers before the producer stops.
+            onClose (callable): Called with the channel once the producer stops.
+        """
+        self.key = key
+        self.factory = factory
+        self.ring = deque(maxlen=ringSize)
+        self.idleTimeout = idleTimeout
+        self.onClose = onClose
+        self.seq = 0
+        self.closed = False
+        self.viewers = 0
+        self.idleSince = time.monotonic()
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.waiters = set()
+        self.thread = threading.Thread(target=self.produce, name=f"stream-{key}", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def produce(self) -> None:
+        frames = self.factory()
+        try:
+            for frame in frames:
+                self.publish(frame)
+                with self.lock:
+                    # Closing under the same lock as the check, so no viewer can join a channel that is stopping.
+                    if self.viewers == 0 and time.monotonic() - self.idleSince > self.idleTimeout:
+                        self.closed = True
+                        self.notify()
+                        break
+        except Exception as e:
+            print(f"Stream {self.key} producer failed: {e}")
+        finally:
+            close = getattr(frames, 'close', None)
+            if close is not None:
+                close()
+            with self.lock:
+                self.closed = True
+                self.notify()
+            if self.onClose is not None:
+                self.onClose(self)
+
+    def publish(self, frame: bytes) -> None:
+        with self.lock:
+            self.seq += 1
+            self.ring.append((self.seq, frame))
+            self.notify()
+
+    def notify(self) -> None:
+        # Called with the lock held.
+        self.changed.notify_all()
+        for loop, event in list(self.waiters):
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The viewer's event loop has shut down; its finally block never ran.
+                self.waiters.discard((loop, event))
+
+    def latest(self, after: int):
+        """Returns (seq, frame) of the newest frame past `after`, or None."""
+        if self.ring and self.ring[-1][0] > after:
+            return self.ring[-1]
+        return None
+
+    def tryJoin(self) -> bool:
+        with self.lock:
+            if self.closed:
+                return False
+            self.viewers += 1
+            return True
+
+    def leave(self) -> None:
+        with self.lock:
+            self.viewers -= 1
+            if self.viewers == 0:
+                self.idleSince = time.monotonic()
+
+    def frames(self):
+        """Blocking iterator over the newest frames, for WSGI responses."""
+        seen = 0
+        while True:
+            with self.lock:
+                while not self.closed and self.latest(seen) is None:
+                    self.changed.wait()
+                item = self.latest(seen)
+                if item is None:
+                    return
+            seen, frame = item
+            yield frame
+
+    async def aframes(self):
+        """Async iterator over the newest frames. Waiting viewers hold no thread."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self.lock:
+            self.waiters.add(waiter)
+        try:
+            seen = 0
+            while True:
+                with self.lock:
+                    item = self.latest(seen)
+                    closed = self.closed
+                if item is None:
+                    if closed:
+                        return
+                    await event.wait()
+                    event.clear()
+                    continue
+                seen, frame = item
+                yield frame
+        finally:
+            with self.lock:
+                self.waiters.discard(waiter)
+
+
+class StreamHub:
+    """
+    Keeps at most one producer per stream key, started by the first viewer
+    and stopped once it has had no viewers for the channel's idle timeout.
+    """
+
+    def __init__(self, ringSize: int = 4, idleTimeout: float = 10.0):
+        self.ringSize = ringSize
+        self.idleTimeout = idleTimeout
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def join(self, key, factory) -> BroadcastChannel:
+        """Joins the live channel for `key`, starting a producer from `factory` if there is none."""
+        while True:
+            with self.lock:
+                channel = self.channels.get(key)
+                if channel is None or channel.closed:
+                    channel = BroadcastChannel(key, factory, self.ringSize, self.idleTimeout, onClose=self.closed)
+                    self.channels[key] = channel
+                    channel.start()
+            if channel.tryJoin():
+                return channel
+
+    def frames(self, key, factory):
+        """
+        Blocking iterator over the stream's frames. Joining happens on the first
+        iteration, so a response that is never sent never counts as a viewer.
+        """
+        channel = self.join(key, factory)
+        try:
+            yield from channel.frames()
+        finally:
+            channel.leave()
+
+    async def aframes(self, key, factory):
+        channel = self.join(key, factory)
+        try:
+            async for frame in channel.aframes():
+                yield frame
+        finally:
+            channel.leave()
+
+    def closed(self, channel: BroadcastChannel) -> None:
+        with self.lock:
+            if self.channels.get(channel.key) is channel:
+                del self.channels[channel.key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {str(key): {'viewers': c.viewers, 'frames': c.seq} for key, c in self.channels.items()}
+
+
+streamHub = StreamHub()
@@ -0,0 +1,134 @@
+import io
+import json
+import struct
+
+import numpy as np
+from obspy import Stream, UTCDateTime
+from obspy.clients.fdsn.header import FDSNNoDataException
+
+from jukbox.ClientPool import clientPool, providerName
+
+
+# Binary waveform payload:
+#   4 bytes   magic b"JWF1"
+#   uint32    header length in bytes, little-endian
+#   header    UTF-8 JSON, space padded so the arrays after it start 8-byte aligned
+#   arrays    one little-endian array per trace, each starting 8-byte aligned
+# The header lists, per trace: id, starttime, samplingRate, npts, kind
+# ('samples', or 'minmax' for interleaved min/max pairs), samplesPerPixel,
+# dtype ('int32' or 'float32'), and the byte offset of its array from the end
+# of the header and its value count.
+# Times are not sent; sample i is at starttime + i / samplingRate.
+MAGIC = b"JWF1"
+ALIGN = 8
+MAX_WIDTH = 10000
+# Dataselect services fetch_waves may be asked for.
+WAVEFORM_PROVIDERS = ["IRIS", "GEOFON", "ORFEUS", "RESIF", "INGV", "ETH", "NCEDC", "SCEDC"]
+
+
+def minMax(data: np.ndarray, samplesPerPixel: int) -> np.ndarray:
+    """
+    Min/max decimation: the minimum and maximum of every run of
+    samplesPerPixel samples, interleaved as [min0, max0, min1, max1, ...].
+    Unlike averaging, spikes survive however far the trace is zoomed out.
+    """
+    starts = np.arange(0, len(data), samplesPerPixel)
+    out = np.empty(2 * len(starts), dtype=data.dtype)
+    out[0::2] = np.minimum.reduceat(data, starts)
+    out[1::2] = np.maximum.reduceat(data, starts)
+    return out
+
+
+def wireArray(data: np.ndarray) -> np.ndarray:
+    """Integer samples stay int32 (what miniSEED decodes to); anything else is sent as float32."""
+    if np.issubdtype(data.dtype, np.integer) and data.dtype.itemsize <= 4:
+        return np.ascontiguousarray(data, dtype='<i4')
+    return np.ascontiguousarray(data, dtype='<f4')
+
+
+def encodeWaveforms(stream: Stream, width: int = None) -> bytes:
+    """
+    Packs a stream into the binary payload described above.
+    Args:
+        stream (Stream): Traces to send. Gappy traces are split into contiguous pieces.
+        width (int): Pixel width the whole stream will be drawn at. Traces with
+            more than two samples per pixel are min/max decimated to it. None
+            sends every sample.
+    Returns:
+        bytes: The payload.
+    """
+    stream = stream.split()
+    if len(stream):
+        # Each sample covers 1 / samplingRate, so the window ends one sample period after the last one.
+        first = min(tr.stats.starttime for tr in stream)
+        span = max(float(max(tr.stats.endtime + tr.stats.delta for tr in stream) - first), 0.0)
+    entries, arrays = [], []
+    for trace in stream:
+        stats = trace.stats
+        samplesPerPixel = 1
+        if width and span > 0:
+            # Pixels are shared across the window, so pieces of one channel line up when drawn.
+            pixels = min(width, max(1, int(np.ceil(width * (stats.npts / stats.sampling_rate) / span))))
+            samplesPerPixel = max(1, int(np.ceil(stats.npts / pixels)))
+        if samplesPerPixel > 2:
+            values, kind = wireArray(minMax(trace.data, samplesPerPixel)), 'minmax'
+        else:
+            values, kind, samplesPerPixel = wireArray(trace.data), 'samples', 1
+        entries.append({
+            'id': trace.id,
+            'starttime': stats.starttime.isoformat() + 'Z',
+            'samplingRate': stats.sampling_rate,
+            'npts': stats.npts,
+            'kind': kind,
+            'samplesPerPixel': samplesPerPixel,
+            'dtype': 'int32' if values.dtype.kind == 'i' else 'float32',
+            'length': len(values),
+        })
+        arrays.append(values)
+
+    position = 0
+    for entry, values in zip(entries, arrays):
+        entry['offset'] = position
+        position = padded(position + values.nbytes)
+    header = json.dumps({'traces': entries}, separators=(',', ':')).encode()
+    header = header.ljust(padded(len(MAGIC) + 4 + len(header)) - len(MAGIC) - 4, b' ')
+
+    out = bytearray(MAGIC + struct.pack('<I', len(header)) + header)
+    dataStart = len(out)
+    for entry, values in zip(entries, arrays):
+        out += b'\0' * (dataStart + entry['offset'] - len(out))
+        out += values.tobytes()
+    return bytes(out)
+
+
+def padded(length: int) -> int:
+    return -(-length // ALIGN) * ALIGN
+
+
+def encodeMseed(stream: Stream) -> bytes:
+    buf = io.BytesIO()
+    if len(stream):
+        stream.write(buf, format='MSEED')
+    return buf.getvalue()
+
+
+def fetchWaveforms(seedId: str, starttime: UTCDateTime, endtime: UTCDateTime, provider: str = "IRIS") -> Stream:
+    """
+    Waveforms for one NET.STA.LOC.CHA id from an FDSN dataselect service.
+    Empty location codes and missing parts match anything, as in map.js.
+    Returns:
+        Stream: The traces; empty when the provider has no data.
+    Raises:
+        ValueError: If seedId has no station or channel, or provider is not in WAVEFORM_PROVIDERS.
+        ConnectionError: If the provider is marked unhealthy.
+        TimeoutError: If no client frees up in time.
+    """
+    network, station, location, channel = (seedId.split('.') + ['', '', '', ''])[:4]
+    if not station or not channel:
+        raise ValueError(f"Invalid seedId: {seedId}")
+    provider = providerName(provider, WAVEFORM_PROVIDERS)
+    try:
+        with clientPool.client(provider) as client:
+            return client.get_waveforms(network or '*', station, location or '*', channel, starttime, endtime)
+    except FDSNNoDataException:
+        return Stream()
@@ -0,0 +1,192 @@
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import Future
+
+import obspy
+from obspy import Stream, UTCDateTime
+
+from jukbox.DiskCache import DiskLru, CACHE_DIR
+from jukbox.Waveform import fetchWaveforms, WAVEFORM_PROVIDERS
+from jukbox.ClientPool import providerName
+
+
+WAVEFORM_DIR = os.path.join(CACHE_DIR, "waveforms")
+
+
+class WaveformCache:
+    """
+    Caching dataselect proxy. Fetched miniSEED is kept in a size bounded
+    cache directory, one file per (provider, seedId, window), and any request
+    whose window lies inside a cached one is cut from that file. Windows are
+    widened to whole minutes before fetching, so viewers of the same event
+    share a file even if their times differ by a few seconds.
+
+    Concurrent requests for a window that is already being fetched wait for
+    that fetch instead of starting their own, so a popular event is
+    downloaded once however many browsers ask for it at the same moment.
+    """
+
+    def __init__(self, directory: str = WAVEFORM_DIR, maxBytes: int = 512 * 1024 * 1024, quantum: int = 60, timeout: float = 120, settle: int = 900,
+                 attempts: int = 3):
+        """
+        Args:
+            directory (str): Cache directory.
+            maxBytes (int): Size the directory is kept under, least recently used files going first.
+            quantum (int): Seconds fetched windows are widened to multiples of.
+            timeout (float): Seconds a coalesced request waits for the fetch it joined.
+            settle (int): Windows ending less than this many seconds ago may still be
+                filling in at the data centre; they are fetched every time, never served from disk.
+            attempts (int): Lookups per request when a file is evicted before it could be read.
+        """
+        self.store = DiskLru(directory, maxBytes)
+        self.quantum = quantum
+        self.timeout = timeout
+        self.settle = settle
+        self.attempts = attempts
+        self.lock = threading.Lock()
+        self.windows = {}
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        for path, _, _ in self.store.entries():
+            self.index(os.path.basename(path))
+
+    @staticmethod
+    def channelKey(provider: str, seedId: str) -> str:
+        return hashlib.sha1(f"{provider.upper()}|{seedId}".encode()).hexdigest()[:20]
+
+    def fileName(self, key: str, start: int, end: int) -> str:
+        return f"{key}_{start}_{end}.mseed"
+
+    def index(self, name: str) -> None:
+        # Called at startup and with the lock held after a fetch.
+        try:
+            key, start, end = name[:-len(".mseed")].split("_")
+            window = (int(start), int(end))
+        except ValueError:
+            return
+        if not self.settled(window[1]):
+            return
+        self.windows.setdefault(key, set()).add(window)
+
+    def settled(self, end: float) -> bool:
+        """Whether data ending at `end` is old enough not to change any more."""
+        return end <= time.time() - self.settle
+
+    def covering(self, key: str, start: float, end: float) -> str:
+        """
+        Path of the smallest cached window covering [start, end], or None.
+        Entries whose file has been evicted are dropped on the way.
+        """
+        with self.lock:
+            candidates = sorted(
+                (w for w in self.windows.get(key, ()) if w[0] <= start and w[1] >= end),
+                key=lambda w: w[1] - w[0]
+            )
+            for window in candidates:
+                path = self.store.path(self.fileName(key, *window))
+                if self.store.touch(path):
+                    return path
+                self.windows[key].discard(window)
+        return None
+
+    def get(self, seedId: str, starttime: UTCDateTime, endtime: UTCDateTime, provider: str = "IRIS") -> Stream:
+        """
+        Waveforms for one channel and window, from the cache when possible.
+        Another request can evict the file between finding it and reading it;
+        the window is then looked up again, which fetches it anew.
+        Returns:
+            Stream: Traces trimmed to the window; empty when the provider has no data.
+        Raises:
+            ValueError: If provider is not in WAVEFORM_PROVIDERS; it names cache files, so it is checked first.
+            ValueError, ConnectionError, TimeoutError: As fetchWaveforms, when a fetch is needed and fails.
+            FileNotFoundError: If the file was evicted before it could be read on every attempt.
+        """
+        provider = providerName(provider, WAVEFORM_PROVIDERS)
+        start, end = UTCDateTime(starttime).timestamp, UTCDateTime(endtime).timestamp
+        if end <= start:
+            raise ValueError("Waveform window must end after it starts")
+        key = self.channelKey(provider, seedId)
+        for attempt in range(self.attempts):
+            path = self.locate(seedId, provider, key, start, end)
+            try:
+                return self.read(path, starttime, endtime)
+            except FileNotFoundError:
+                if attempt == self.attempts - 1:
+                    raise
+                print(f"Waveform cache file {path} was evicted before it was read, looking it up again.")
+
+    def locate(self, seedId: str, provider: str, key: str, start: float, end: float) -> str:
+        """Path of a file holding [start, end]: a cached one, the one a concurrent fetch is writing, or a new fetch."""
+        path = self.covering(key, start, end)
+        if path is not None:
+            with self.lock:
+                self.hits += 1
+            return path
+
+        window = (int(start // self.quantum * self.quantum), int(-(-end // self.quantum) * self.quantum))
+        owner = False
+        with self.lock:
+            pending = self.inflight.setdefault(key, {})
+            future = next((f for w, f in pending.items() if w[0] <= start and w[1] >= end), None)
+            if future is None:
+                future = Future()
+                pending[window] = future
+                owner = True
+                self.misses += 1
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result(timeout=self.timeout)
+
+        try:
+            path = self.fetch(seedId, provider, key, window)
+            future.set_result(path)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                pending = self.inflight.get(key, {})
+                pending.pop(window, None)
+                if not pending:
+                    self.inflight.pop(key, None)
+        return path
+
+    def fetch(self, seedId: str, provider: str, key: str, window: tuple) -> str:
+        stream = fetchWaveforms(seedId, UTCDateTime(window[0]), UTCDateTime(window[1]), provider)
+        path = self.store.path(self.fileName(key, *window))
+        tmpPath = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        # An empty file records that the provider has nothing, so the miss is not repeated.
+        if len(stream):
+            stream.write(tmpPath, format='MSEED')
+        else:
+            open(tmpPath, 'wb').close()
+        os.replace(tmpPath, path)
+        with self.lock:
+            self.index(os.path.basename(path))
+        self.store.added(path)
+        return path
+
+    @staticmethod
+    def read(path: str, starttime: UTCDateTime, endtime: UTCDateTime) -> Stream:
+        if os.path.getsize(path) == 0:
+            return Stream()
+        stream = obspy.read(path, format='MSEED')
+        stream.trim(UTCDateTime(starttime), UTCDateTime(endtime))
+        return Stream([tr for tr in stream if tr.stats.npts])
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'bytes': self.store.totalBytes,
+            }
+
+
+waveformCache = WaveformCache()
@@ -0,0 +1,31 @@
+import os
+import sys
+
+from django.apps import AppConfig
+
+
+# Providers whose FDSN clients are created before the first search needs them.
+WARM_PROVIDERS = ["IRIS", "USGS"]
+
+
+def serving() -> bool:
+    """
+    Whether this process serves requests, as opposed to running migrate,
+    collectstatic, shell or another management command. asgi.py and wsgi.py
+    set JUKBOX_SERVING; runserver is recognised from its arguments, in the
+    reloader's child process only.
+    """
+    if os.environ.get("JUKBOX_SERVING") == "1":
+        return True
+    if len(sys.argv) > 1 and sys.argv[1] == "runserver":
+        return os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
+    return False
+
+
+class JukboxConfig(AppConfig):
+    name = "jukbox"
+
+    def ready(self):
+        if serving():
+            from jukbox.ClientPool import clientPool
+            clientPool.warmAsync(WARM_PROVIDERS)
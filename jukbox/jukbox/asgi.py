@@ -8,6 +8,8 @@ from django.core.asgi import get_asgi_application
 
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE','jukbox.settings')
+# Tells JukboxConfig.ready that this process serves requests, so FDSN clients are warmed.
+os.environ.setdefault('JUKBOX_SERVING', '1')
 django.setup()
 
 
@@ -1,7 +1,9 @@
 import json
+import asyncio
 from random import randint
 from time import sleep
-from channels.generic.websocket import WebsocketConsumer
+from channels.generic.websocket import WebsocketConsumer, AsyncWebsocketConsumer
+from jukbox.JobQueue import jobQueue, groupName, DONE, FAILED
 
 
 class GraphConsumer(WebsocketConsumer):
@@ -18,3 +20,30 @@ class GraphConsumer(WebsocketConsumer):
     def receive(self, text_data = None, bytes_data = None):
         text_data_json = json.loads(text_data)
         expression = text_data_json['expression']
+
+
+class JobConsumer(AsyncWebsocketConsumer):
+    """Pushes progress of one background job to the page that queued it."""
+
+    async def connect(self):
+        self.jobId = self.scope['url_route']['kwargs']['job_id']
+        job = jobQueue.get(self.jobId)
+        if job is None:
+            await self.close()
+            return
+        jobQueue.attachLoop(asyncio.get_running_loop())
+        await self.channel_layer.group_add(groupName(self.jobId), self.channel_name)
+        await self.accept()
+        # Sent after joining the group, so an update between the two is never lost, only repeated.
+        state = jobQueue.snapshot(job)
+        await self.send(json.dumps(state))
+        if state['status'] in (DONE, FAILED):
+            await self.close()
+
+    async def disconnect(self, code):
+        await self.channel_layer.group_discard(groupName(self.jobId), self.channel_name)
+
+    async def job_update(self, event):
+        await self.send(json.dumps(event['job']))
+        if event['job']['status'] in (DONE, FAILED):
+            await self.close()
@@ -1,43 +1,21 @@
-import matplotlib.pyplot as plt
-import obspy
+from jukbox import Stft
+from jukbox.SpectrogramPyramid import buildPyramid
 
-def generate_spectrogram(filePath):
-    st = obspy.read(filePath)
+def generate_spectrogram(filePath, progress=None):
+    # One chunked pass builds the zoomable tile pyramid; the overview PNG is cut from one of its levels.
+    pyramid = buildPyramid(filePath, component='Z', nfft=1024, noverlap=512, fmin=1, fmax=40, progress=progress)
 
-    if not st:
-        print("No data loaded!")
-        return
-
-    print(f"Data loaded, number of traces: {len(st)}")
-
-    # st.filter(type='highpass', freq=3.0)
-    # st.filter(type='bandpass', freqmin=15.0, freqmax=40.0)
-    # st.filter(type='lowpass', freq=3.0)
-
-    st = st.select(component='Z')
-
-    if not st:
+    if pyramid is None:
         print("No data after filtering or selecting the Z component!")
         return
 
-    print(f"Data after filtering and selecting 'Z' component, number of traces: {len(st)}")
-
-    trace = st[0]
-
-    print(f"Time range: {trace.stats.starttime} to {trace.stats.endtime}")
-    print(f"Number of data points: {len(trace)}")
-
-    plt.figure(figsize=(10, 6))
-    plt.specgram(trace.data, Fs=trace.stats.sampling_rate, NFFT=1024, noverlap=512, scale='dB', sides='default', cmap='magma')
-    plt.title(filePath.split('/')[-1])
-    plt.xlabel("Time (s)")
-    plt.ylabel("Frequency (Hz)")
+    print(f"Pyramid levels: {pyramid.meta['widths']}")
 
-    plt.xlim(1, 1000)
-    plt.ylim(1, 40)
-    filePath.split('/')
-    plt.savefig(f"media/images/{filePath.split('/')[-1]}.png", format='png')
-    plt.close()
+    rgb = Stft.toRgb(pyramid.strip(1000), pyramid.meta['vmin'], pyramid.meta['vmax'])
+    imageName = f"{filePath.split('/')[-1]}.png"
+    with open(f"media/images/{imageName}", 'wb') as f:
+        f.write(Stft.encodeImage(rgb, format='PNG', size=(1000, 600)))
+    return imageName
 
 if __name__ == "__main__":
     print("Don't run this directly. or edit the path")
@@ -1,5 +1,6 @@
 from django.urls import path
-from .consumers import GraphConsumer
+from .consumers import GraphConsumer, JobConsumer
 ws_urlpatterns = [
-   path('ws/graph/',GraphConsumer.as_asgi()) 
+   path('ws/graph/',GraphConsumer.as_asgi()),
+   path('ws/jobs/<str:job_id>/', JobConsumer.as_asgi()),
 ]
\ No newline at end of file
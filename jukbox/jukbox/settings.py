@@ -79,6 +79,14 @@ TEMPLATES = [
 WSGI_APPLICATION = 'jukbox.wsgi.application'
 ASGI_APPLICATION = "jukbox.asgi.application"
 
+# Background jobs report progress to websocket subscribers through this layer.
+# The in-memory layer only works within one server process, like the job queue itself.
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'channels.layers.InMemoryChannelLayer',
+    },
+}
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -3,6 +3,7 @@ indexedDB.deleteDatabase("MapDatabase");
 
 console.log("map.js loaded");
 let stationMarkers = [];
+let eventMarkers = {};
 
 
 
@@ -62,6 +63,80 @@ const beachball = async function (userInput) {
   }
 
 
+// Reads the newline delimited JSON from /search_quakes/stream/ and handles each
+// message as it arrives instead of waiting for the whole search.
+const streamQuakes = async function (userInput) {
+  const searchData = {
+    latLng: userInput.latLng,
+    maxRad: userInput.maxRad,
+    startDate: userInput.startDate,
+    endDate: userInput.endDate,
+    minMag: userInput.minMag,
+    dataProvider: userInput.dataProvider
+  };
+
+  const response = await fetch('/search_quakes/stream/', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRFToken': getCookie('csrftoken')
+    },
+    body: JSON.stringify(searchData)
+  });
+  if (!response.ok) {
+    alert('map.html An error occurred while searching!');
+    return;
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let newline;
+    while ((newline = buffer.indexOf("\n")) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) await handleStreamMessage(JSON.parse(line));
+    }
+  }
+};
+
+const handleStreamMessage = async function (message) {
+  switch (message.type) {
+    case "event": {
+      const event = message.event;
+      // Show a plain marker until the beachball has rendered.
+      const marker = Object.assign({}, event, { icon: message.iconReady ? event.icon : "/static/jukbox/img/center.png" });
+      plotPoints([marker]);
+      await saveDictToStoreIndexedDB("eventStore", { [message.eventId]: event });
+      break;
+    }
+    case "icon":
+      if (eventMarkers[message.eventId]) {
+        eventMarkers[message.eventId].setIcon(L.icon({
+          iconUrl: message.icon,
+          iconSize: [30, 30],
+          iconAnchor: [15, 15],
+          popupAnchor: [0, -15]
+        }));
+      }
+      break;
+    case "stations":
+      await saveDictToStoreIndexedDB("stationStore", { [message.eventId]: message.stations });
+      break;
+    case "error":
+      console.error("Search stream error:", message.message);
+      break;
+    case "done":
+      console.log(`Search stream finished with ${message.count} events.`);
+      break;
+  }
+};
+
+
 const fetchQuakes = async function () {
   try{
   const userInput = {
@@ -78,17 +153,18 @@ const fetchQuakes = async function () {
   let events = [];
   console.log("provider:", userInput.dataProvider)
   if (userInput.dataProvider == 'earthquake.usgs.gov'){
-    events = await beachball(userInput);
+    // Markers, icons and stations are plotted and stored as they stream in.
+    await streamQuakes(userInput);
   } else {
     events = await fetchEvents(userInput,limit);
+    await saveDictToStoreIndexedDB("eventStore", events);
+    getAllEvents().then(events => {
+        console.log("Events from IndexedDB:", events);
+        plotPoints(events);
+    });
+    let stations = await quakesToStations(events, userInput,5);
+    await saveDictToStoreIndexedDB("stationStore", stations);
   }
-  await saveDictToStoreIndexedDB("eventStore", events);
-  getAllEvents().then(events => {
-      console.log("Events from IndexedDB:", events);
-      plotPoints(events);
-  });
-  let stations = await quakesToStations(events, userInput,5);
-  await saveDictToStoreIndexedDB("stationStore", stations);
   } catch (error) {
           console.log(error)
       }
@@ -327,55 +403,71 @@ async function fetchClosestStations(quake, userInput, limit = 10000, baseUrl = "
 
 
 
-async function fetchWaveformsBulk(stations, quake, baseUrl = "https://service.iris.edu") {
-  if (!window.sp) {
-    console.error("seisplotjs (window.sp) is not loaded.");
-    return [];
+// Decodes a fetch_waves payload: "JWF1", a uint32 header length, a JSON header, then one
+// little-endian typed array per trace. Arrays are 8-byte aligned, so they are views, not copies.
+function decodeWaveforms(buffer) {
+  const view = new DataView(buffer);
+  const magic = new TextDecoder().decode(new Uint8Array(buffer, 0, 4));
+  if (magic !== "JWF1") {
+    throw new Error(`Not a waveform payload: ${magic}`);
   }
+  const headerLength = view.getUint32(4, true);
+  const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 8, headerLength)));
+  const dataStart = 8 + headerLength;
+  return header.traces.map(trace => {
+    const ArrayType = trace.dtype === "int32" ? Int32Array : Float32Array;
+    trace.values = new ArrayType(buffer, dataStart + trace.offset, trace.length);
+    return trace;
+  });
+}
 
-  const allSeismograms = [];
-
-  for (const station of stations) {
-    const [network, stationCode, location, channel] = station.seedId.split(".");
-    if (!network || !stationCode || !channel) {
-      console.warn(`Invalid seedId: ${station.seedId}`);
-      continue;
-    }
-    const locCode = location === "" ? "--" : location;
-    //let start = station.startTime
-    //let timeWindow = sp.util.startDuration(start, 600);
-    const query = new window.sp.fdsndataselect.DataSelectQuery();
+async function fetchWaveformPayload(seedId, startTime, endTime, width) {
+  const params = new URLSearchParams({ seedId: seedId, start: startTime, end: endTime });
+  if (width) {
+    params.set("width", Math.round(width));
+  }
+  const response = await fetch(`/fetch_waves/?${params}`);
+  if (!response.ok) {
+    throw new Error(`fetch_waves failed for ${seedId}: ${response.status}`);
+  }
+  return decodeWaveforms(await response.arrayBuffer());
+}
 
-    query.baseUrl = baseUrl + "/fdsnws/dataselect/1";
 
-    const DateTime = window.sp.luxon.DateTime;
+// Waveforms come through the server's fetch_waves proxy, which caches each channel and window
+// and coalesces identical requests, so a popular event is downloaded from the data centre once.
+async function fetchWaveformsBulk(stations, quake, width) {
+  const DateTime = window.sp.luxon.DateTime;
+  let startTime = quake.startTime;
+  if (typeof startTime === 'string') {
+    startTime = DateTime.fromISO(startTime);
+  }
+  startTime = DateTime.fromMillis(startTime.ts, { zone: "utc" });
+  const endTime = startTime.plus({ minutes: 20 });
 
-    let startTime = quake.startTime;
-    if (typeof startTime === 'string') {
-      startTime = DateTime.fromISO(startTime);
+  return stations.map(station => {
+    const [network, stationCode, location, channel] = station.seedId.split(".");
+    if (!stationCode || !channel) {
+      console.warn(`Invalid seedId: ${station.seedId}`);
+      return null;
     }
-    startTime = window.sp.luxon.DateTime.fromMillis(startTime.ts);
-    let endTime = startTime.plus({ minutes: 20 });
-      query
-        //.networkCode(network)
-        .networkCode(network ? network : "*")
-        .stationCode(stationCode)
-        //.timeRange(timeWindow)
-        .startTime(startTime.toISO())
-        .channelCode(channel)
-        //.locationCode(location)
-        .locationCode(location ? location : "*")
-        .endTime(endTime.toISO());
-
-      try {
-        allSeismograms.push(query);
-      } catch (err) {
-        console.error(`Failed to fetch waveforms for ${station.seedId}:`, err);
-      }
-  }
+    return {
+      station: station,
+      traces: fetchWaveformPayload(station.seedId, startTime.toISO(), endTime.toISO(), width)
+    };
+  }).filter(request => request !== null);
+}
 
-  console.log("Fetched all waveforms:", allSeismograms);
-  return allSeismograms;
+// A min/max trace is drawn as a zigzag through its pairs, at two values per pixel.
+function tracesToDisplayData(traces) {
+  const DateTime = window.sp.luxon.DateTime;
+  return traces
+    .filter(trace => trace.values.length > 0)
+    .map(trace => {
+      const rate = trace.kind === "minmax" ? 2 * trace.samplingRate / trace.samplesPerPixel : trace.samplingRate;
+      const start = DateTime.fromISO(trace.starttime, { zone: "utc" });
+      return sp.seismogram.SeismogramDisplayData.fromContiguousData(trace.values, rate, start);
+    });
 }
 
 
@@ -513,6 +605,7 @@ function plotPoints(points) {
       const marker = L.marker([point.latLng.lat, point.latLng.lng], { icon: customIcon })
         .addTo(map)
         .bindPopup(`Lat: ${point.latLng.lat}<br>Lng: ${point.latLng.lng}<br>starttime: ${point.startTime || 'N/A'}<br>endtime: ${point.endTime || 'N/A'} <br>magnitude: ${point.mag}<br>depth: ${point.depth}`, { autoPan: false });
+      if (point.eventId !== undefined) eventMarkers[point.eventId] = marker;
 
       marker.on('click', function () {
         document.body.style.cursor = 'default';
@@ -571,54 +664,33 @@ function plotStations(points, quake) {
   stationMarkers.forEach(marker => map.removeLayer(marker));
   stationMarkers = [];
 
-  const waveForms = fetchWaveformsBulk(points, quake);
-  document.querySelector("#myseismograph").innerHTML = "";
-
-  let graphCount = 0; 
-  waveForms.then(waveforms => {
-    waveforms.forEach(waveform => {
-waveform.querySeismograms(true)
-  .then((seisArray) => {
-    if (graphCount > maxGraphCount){
-      return;
-    }
-    const div = document.querySelector("div#myseismograph");
-    let seisData = [];
-    for (let s of seisArray) {
-      if (s.isContiguous() && s.y && s.y.length > 0){
-        seisData.push(sp.seismogram.SeismogramDisplayData.fromSeismogram(s));
-      } else {
-        for (let segment of s.segments) {
-          if (segment.y && segment.y.length > 0) {
-            seisData.push(sp.seismogram.SeismogramDisplayData.fromSeismogramSegment(segment));
+  const div = document.querySelector("div#myseismograph");
+  div.innerHTML = "";
+  const waveForms = fetchWaveformsBulk(points, quake, div.clientWidth || 1000);
+
+  let graphCount = 0;
+  waveForms.then(requests => {
+    requests.forEach(request => {
+      request.traces
+        .then((traces) => {
+          if (graphCount > maxGraphCount) {
+            return;
+          }
+          const seisData = tracesToDisplayData(traces);
+          if (seisData.length === 0) {
+            return;
           }
-        }
-      }
-
-    }
-
-    if (seisData.length === 0) {
-      //console.warn("No seismogram data found: ",seisArray);
-      return;
-    }
-
-    let seisConfig = new sp.seismographconfig.SeismographConfig();
-    let graph = new sp.seismograph.Seismograph(seisData, seisConfig);
-    div.appendChild(graph);
-    for (let point of points){
-      if (point.station === waveform._stationCode) {
-        mapStation(point);
-        graphCount += 1;
-        break;
-      }
-    }
-  })
-  .catch(function (error) {
-    const div = document.querySelector("div#myseismograph");
-    div.innerHTML = `<p>Error loading data. ${error}</p>`;
-    console.assert(false, error);
-  });
 
+          let seisConfig = new sp.seismographconfig.SeismographConfig();
+          let graph = new sp.seismograph.Seismograph(seisData, seisConfig);
+          div.appendChild(graph);
+          mapStation(request.station);
+          graphCount += 1;
+        })
+        .catch(function (error) {
+          div.innerHTML = `<p>Error loading data. ${error}</p>`;
+          console.assert(false, error);
+        });
     });
   });
 }
@@ -0,0 +1,586 @@
+import io
+import os
+import csv
+import shutil
+import contextlib
+import json
+import struct
+import time
+import asyncio
+import threading
+import tempfile
+import unittest
+import multiprocessing
+from unittest import mock
+
+import numpy as np
+import obspy
+
+from jukbox.SampleStore import SampleStore, UPSERT, DELETE
+from jukbox.CsvHandler import rowKeys, sampleToRow, decodeRow, migrateRow, toCsvLine, strToSample, dictToString, ROW_VERSION
+from jukbox.Sample import Sample
+from jukbox.SampleRepository import SampleRepository
+from jukbox.StationIndex import kClosest
+from jukbox.Spectrogram import iterRecordHeaders, scanMseed, iterMseedBlocks
+from jukbox.Waveform import encodeWaveforms, MAGIC, ALIGN
+from jukbox.WaveformCache import WaveformCache
+from jukbox.EventCache import EventCache
+from jukbox.FederatedSearch import FederatedSearch, FASTEST, MERGE
+from jukbox.Map import Map, MapQuery
+
+
+def writeLines(path: str, rows: list) -> None:
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerows(rows)
+
+
+def upsertMany(fileName: str, ids: range, rounds: int) -> None:
+    # Runs in a child process. Few rows and a small minCompact make the processes
+    # compact every few dozen writes while the others keep writing.
+    store = SampleStore(fileName, minCompact=8)
+    for version in range(rounds):
+        for idNum in ids:
+            store.upsert([str(idNum), f"s{idNum}v{version}", "{}", "{}", "{}"])
+    store.flush()
+
+
+class SampleStoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.dir, "samples.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def row(self, idNum: int, name: str) -> list:
+        return [str(idNum), name, "{}", "{}", "{}"]
+
+    def test_replay_order(self):
+        # CSV, then the set aside journal, then the live journal; later entries win.
+        writeLines(self.fileName, [self.row(0, "csv"), self.row(1, "one"), self.row(2, "two")])
+        writeLines(self.fileName + ".journal.compacting", [[UPSERT] + self.row(0, "compacting"), [DELETE, "1"]])
+        writeLines(self.fileName + ".journal", [[UPSERT] + self.row(0, "live"), [UPSERT] + self.row(1, "back")])
+        store = SampleStore(self.fileName)
+        self.assertEqual(store.byId(0)[1], "live")
+        self.assertEqual(store.byId(1)[1], "back")
+        self.assertEqual(store.byName("two")[0], "2")
+        self.assertIsNone(store.byName("csv"))
+
+    def test_interrupted_compaction_is_recovered(self):
+        writeLines(self.fileName, [self.row(0, "a")])
+        # A compaction that died after setting the journal aside, with more writes after it.
+        writeLines(self.fileName + ".journal.compacting", [[UPSERT] + self.row(1, "b")])
+        writeLines(self.fileName + ".journal", [[UPSERT] + self.row(2, "c"), [DELETE, "0"]])
+        store = SampleStore(self.fileName)
+        self.assertEqual(sorted(int(r[0]) for r in store.allRows()), [1, 2])
+        store.compactNow()
+        self.assertFalse(os.path.exists(self.fileName + ".journal.compacting"))
+        with open(self.fileName, newline='') as f:
+            self.assertEqual(sorted(int(r[0]) for r in csv.reader(f)), [1, 2])
+        self.assertEqual(sorted(int(r[0]) for r in SampleStore(self.fileName).allRows()), [1, 2])
+
+    def test_duplicate_legacy_ids_keep_first_row(self):
+        writeLines(self.fileName, [self.row(5, "first"), self.row(5, "second")])
+        store = SampleStore(self.fileName)
+        self.assertEqual(store.byId(5)[1], "first")
+        self.assertIsNone(store.byName("second"))
+        # A journal entry for the id still replaces it.
+        store.upsert(self.row(5, "third"))
+        self.assertEqual(SampleStore(self.fileName).byId(5)[1], "third")
+
+    def test_next_id_after_deletes(self):
+        store = SampleStore(self.fileName)
+        for idNum in range(3):
+            store.insert(self.row(idNum, f"s{idNum}"))
+        self.assertEqual(store.nextId(), 3)
+        store.deleteById(1)
+        self.assertEqual(store.nextId(), 1)
+        store.deleteByName("s0")
+        self.assertEqual(store.nextId(), 0)
+        store.insert(self.row(0, "again"))
+        self.assertEqual(store.nextId(), 1)
+        self.assertEqual(SampleStore(self.fileName).nextId(), 1)
+
+    def test_sees_writes_of_another_store(self):
+        first = SampleStore(self.fileName)
+        second = SampleStore(self.fileName)
+        first.insert(self.row(0, "a"))
+        second.insert(self.row(1, "b"))
+        self.assertEqual(first.byId(1)[1], "b")
+        with self.assertRaises(ValueError):
+            first.insert(self.row(2, "b"))
+        second.deleteById(0)
+        self.assertIsNone(first.byId(0))
+
+    def test_concurrent_processes_lose_no_writes(self):
+        rounds = 60
+        workers = [
+            multiprocessing.Process(target=upsertMany, args=(self.fileName, range(start, start + 10), rounds))
+            for start in range(0, 40, 10)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        rows = SampleStore(self.fileName).allRows()
+        self.assertEqual(sorted(r[1] for r in rows), sorted(f"s{i}v{rounds - 1}" for i in range(40)))
+
+
+class KeyIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.dir, "samples.csv")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def store(self, fileName: str = None) -> SampleStore:
+        return SampleStore(fileName or self.fileName, keysOf=rowKeys)
+
+    def sample(self, idNum: int, name: str, img: dict, data: dict = None) -> list:
+        return sampleToRow(Sample(name, idNum=idNum, img=img, data=data or {}))
+
+    def test_built_on_load(self):
+        # Legacy rows (data before img, Python literals) are indexed like current ones.
+        writeLines(self.fileName, [["0", "old", "{'trace_HHZ': 'd0'}", "{'spectro_HHZ': 'i0'}", "{}"]])
+        self.store().insert(self.sample(1, "new", {"spectro_BHZ": "i1"}))
+        store = self.store()
+        self.assertEqual(store.searchKeys("img", "spectro_"), {0: ["i0"], 1: ["i1"]})
+        self.assertEqual(store.searchKeys("data", "trace", prefix=True), {0: ["d0"]})
+        store.compactNow()
+        self.assertEqual(self.store().searchKeys("img", "HZ"), {0: ["i0"], 1: ["i1"]})
+
+    def test_follows_writes_of_every_store(self):
+        first = self.store()
+        second = self.store()
+        first.insert(self.sample(0, "a", {"wave_one": "p0"}))
+        self.assertEqual(second.searchKeys("img", "one"), {0: ["p0"]})
+        second.upsert(self.sample(0, "a", {"wave_two": "p1"}))
+        self.assertEqual(first.searchKeys("img", "one"), {})
+        self.assertEqual(first.searchKeys("img", "wave", prefix=True), {0: ["p1"]})
+        second.deleteById(0)
+        self.assertEqual(first.searchKeys("img", "wave", prefix=True), {})
+        self.assertEqual(first.index.sortedKeys["img"], [])
+
+    def test_catalogues_are_separate(self):
+        other = os.path.join(self.dir, "other.csv")
+        self.store().insert(self.sample(0, "a", {"first_key": "p"}))
+        self.store(other).insert(self.sample(0, "b", {"second_key": "q"}))
+        self.assertEqual(self.store().searchKeys("img", "_key"), {0: ["p"]})
+        self.assertEqual(self.store(other).searchKeys("img", "_key"), {0: ["q"]})
+
+    def test_matches_a_scan(self):
+        store = self.store()
+        keys = ["spectrogram", "spec", "inspect", "trace", "tracespec", "a", "ab", "ba"]
+        for idNum in range(len(keys)):
+            store.insert(self.sample(idNum, f"s{idNum}", {keys[idNum]: str(idNum), keys[idNum - 1] + "x": "x"}))
+        for fragment in ["spec", "sp", "c", "ecx", "tra", "zzz", ""]:
+            for prefix in (False, True):
+                expected = {}
+                for row in sorted(store.allRows(), key=lambda r: int(r[0])):
+                    img = rowKeys(row)["img"]
+                    paths = [img[k] for k in sorted(img) if (k.startswith(fragment) if prefix else fragment in k)]
+                    if paths:
+                        expected[int(row[0])] = paths
+                found = {i: sorted(p) for i, p in store.searchKeys("img", fragment, prefix).items()}
+                self.assertEqual(found, {i: sorted(p) for i, p in expected.items()}, (fragment, prefix))
+
+
+def legacyRow(idNum: int, name: str, data: dict, img: dict, misc: dict) -> list:
+    # A line as the old toCsvLine wrote it, read back through csv like the store does.
+    line = f"{idNum},{name},{dictToString(data)},{dictToString(img)},{dictToString(misc)}"
+    return next(csv.reader([line]))
+
+
+class RowFormatTests(unittest.TestCase):
+
+    def test_current_rows_round_trip(self):
+        sample = Sample('quake, "big"', idNum=7, data={'trace,"HHZ"': "d/a,b.mseed"},
+                        img={"it's": 'i/"q".png'}, misc={"note": "a, \"b\"", "n": 2})
+        row = sampleToRow(sample)
+        self.assertEqual(row[5], ROW_VERSION)
+        expected = (7, 'quake, "big"', sample.data, sample.img, sample.misc)
+        self.assertEqual(decodeRow(row), expected)
+        self.assertEqual(migrateRow(row), row)
+        record = strToSample(toCsvLine(sample))
+        self.assertEqual((record.idNum, record.name, record.data, record.img, record.misc), expected)
+
+    def test_legacy_rows_decode_and_migrate(self):
+        row = legacyRow(3, "old", {"trace,HHZ": "d0"}, {"spectro_HHZ": "i0"}, {})
+        self.assertEqual(decodeRow(row), (3, "old", {"trace,HHZ": "d0"}, {"spectro_HHZ": "i0"}, {}))
+        migrated = migrateRow(row)
+        self.assertEqual(migrated[5], ROW_VERSION)
+        self.assertEqual(decodeRow(migrated), decodeRow(row))
+        self.assertEqual(migrateRow(migrated), migrated)
+
+    def test_unreadable_legacy_row_is_reported_and_kept(self):
+        # Legacy rows never escaped quotes, so this misc is not a literal any more.
+        row = legacyRow(4, "odd", {}, {}, {"note": "it's"})
+        self.assertIsInstance(decodeRow(row)[4], str)
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(migrateRow(row), row)
+        self.assertIn("misc", out.getvalue())
+
+
+class SampleRepositoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.dir, "samples.csv")
+        self.repo = SampleRepository(os.path.join(self.dir, "samples.sqlite3"), batchSize=3)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def names(self) -> dict:
+        return {record.idNum: record.name for record in self.repo.all()}
+
+    def test_import_matches_the_store(self):
+        # Legacy rows, a set aside journal and the live journal, replayed like SampleStore does.
+        writeLines(self.fileName, [
+            legacyRow(0, "zero", {}, {"spectro_HHZ": "i0"}, {}),
+            legacyRow(1, "one", {}, {}, {}),
+            legacyRow(2, "two", {}, {}, {}),
+        ])
+        writeLines(self.fileName + ".journal.compacting", [[UPSERT] + sampleToRow(Sample("three", idNum=3))])
+        writeLines(self.fileName + ".journal", [[DELETE, "1"], [UPSERT] + sampleToRow(Sample("zero b", idNum=0))])
+        self.assertEqual(self.repo.importCsv(self.fileName), 6)
+        expected = {int(r[0]): decodeRow(r)[1] for r in SampleStore(self.fileName).allRows()}
+        self.assertEqual(self.names(), expected)
+        self.assertEqual(self.names(), {0: "zero b", 2: "two", 3: "three"})
+        self.assertEqual(self.repo.searchImgByKey("spectro"), [])
+
+    def test_import_keeps_first_legacy_row(self):
+        writeLines(self.fileName, [legacyRow(5, "first", {}, {}, {}), legacyRow(5, "second", {}, {}, {})])
+        writeLines(self.fileName + ".journal", [[UPSERT] + sampleToRow(Sample("third", idNum=6))])
+        self.repo.importCsv(self.fileName)
+        self.assertEqual(self.repo.get(5).name, "first")
+        self.assertIsNone(self.repo.getByName("second"))
+        self.assertEqual(self.repo.get(6).name, "third")
+
+    def test_import_orders_deletes_within_a_batch(self):
+        self.repo.batchSize = 1000
+        writeLines(self.fileName + ".journal", [
+            [UPSERT] + sampleToRow(Sample("a", idNum=1)),
+            [DELETE, "1"],
+            [UPSERT] + sampleToRow(Sample("b", idNum=1)),
+            [UPSERT] + sampleToRow(Sample("c", idNum=2)),
+            [DELETE, "2"],
+        ])
+        self.repo.importCsv(self.fileName)
+        self.assertEqual(self.names(), {1: "b"})
+
+    def test_search_by_key_matches_a_scan(self):
+        keys = ["spectrogram", "spectro", "inspect", "trace", 'tr"ace', "a", "ab", "ba", "SPEC"]
+        self.repo.saveMany(
+            Sample(f"s{i}", idNum=i, img={keys[i]: f"i{i}", keys[i - 1] + "x": "x"}, data={keys[-i]: f"d{i}"})
+            for i in range(len(keys))
+        )
+        self.assertTrue(self.repo.trigram)
+        for kind in ("img", "data"):
+            for fragment in ["spec", "spectro", "sp", "c", "ecx", 'r"a', "tra", "zzz", ""]:
+                for prefix in (False, True):
+                    expected = [
+                        record.idNum for record in self.repo.all()
+                        if any(k.startswith(fragment) if prefix else fragment in k for k in getattr(record, kind))
+                    ]
+                    found = [record.idNum for record in self.repo.searchByKey(kind, fragment, prefix)]
+                    self.assertEqual(found, expected, (kind, fragment, prefix))
+
+
+class KClosestTests(unittest.TestCase):
+
+    def closest(self, distances: list, k: int) -> list:
+        heap = kClosest(0, k)
+        for i, distance in enumerate(distances):
+            heap.append({'station': f"S{i}", 'distance': distance})
+        return sorted(heap[i]['distance'] for i in range(len(heap)))
+
+    def test_keeps_the_nearest_once_full(self):
+        distances = [5.0, 1.0, 9.0, 3.0, 3.0, 7.0, 0.5, 3.0, 8.0, 2.0]
+        self.assertEqual(self.closest(distances, 4), [0.5, 1.0, 2.0, 3.0])
+        self.assertEqual(self.closest(list(reversed(distances)), 4), [0.5, 1.0, 2.0, 3.0])
+
+    def test_ties_do_not_compare_items(self):
+        self.assertEqual(self.closest([2.0, 2.0, 2.0, 1.0, 2.0, 2.0], 3), [1.0, 2.0, 2.0])
+        self.assertEqual(self.closest([4.0, 4.0], 5), [4.0, 4.0])
+
+
+def mseedRecords(trace, reclen: int) -> list:
+    out = io.BytesIO()
+    trace.write(out, format="MSEED", reclen=reclen, encoding="STEIM2")
+    data = out.getvalue()
+    return [data[i:i + reclen] for i in range(0, len(data), reclen)]
+
+
+class MseedScanTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fileName = os.path.join(self.dir, "upload.mseed")
+        rng = np.random.default_rng(1)
+        start = obspy.UTCDateTime(2024, 1, 1)
+        header = dict(network="XX", station="TST", sampling_rate=20.0)
+        # Two HHZ pieces with a gap, interleaved record by record with an HHN trace and
+        # followed by zero padding, as recorders and concatenated downloads leave them.
+        z = mseedRecords(obspy.Trace(rng.integers(-5000, 5000, 3000, dtype=np.int32), dict(header, channel="HHZ", starttime=start)), 512)
+        z += mseedRecords(obspy.Trace(rng.integers(-5000, 5000, 1000, dtype=np.int32), dict(header, channel="HHZ", starttime=start + 300)), 512)
+        n = mseedRecords(obspy.Trace(rng.integers(-5000, 5000, 4000, dtype=np.int32), dict(header, channel="HHN", starttime=start)), 512)
+        records = [r for pair in zip(z, n) for r in pair] + z[len(n):] + n[len(z):]
+        with open(self.fileName, "wb") as f:
+            f.write(b"".join(records) + bytes(300))
+        self.records = records
+        self.expected = obspy.read(io.BytesIO(b"".join(records))).select(channel="HHZ")
+        self.expected.sort(keys=["starttime"])
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_record_headers(self):
+        with open(self.fileName, "rb") as f:
+            headers = list(iterRecordHeaders(f))
+        self.assertEqual([offset for offset, _ in headers], [512 * i for i in range(len(self.records))])
+        for (_, info), record in zip(headers, self.records):
+            stats = obspy.read(io.BytesIO(record))[0].stats
+            self.assertEqual((info['channel'], info['starttime'], info['record_length']), (stats.channel, stats.starttime, 512))
+
+    def test_scan(self):
+        traceId, rate, start, end = scanMseed(self.fileName, 'Z')
+        self.assertEqual((traceId, rate), ("XX.TST..HHZ", 20.0))
+        self.assertEqual(start, self.expected[0].stats.starttime)
+        self.assertEqual(end, self.expected[-1].stats.endtime)
+        self.assertIsNone(scanMseed(self.fileName, 'E'))
+
+    def test_blocks_match_obspy_read(self):
+        fractions = []
+        pieces = list(iterMseedBlocks(self.fileName, "XX.TST..HHZ", blockBytes=1024, progress=fractions.append))
+        self.assertEqual(fractions[-1], 1.0)
+        self.assertEqual(fractions, sorted(fractions))
+        # Blocks end at arbitrary records, so pieces join up again except at the real gap.
+        stream = obspy.Stream(pieces).merge(method=1).split()
+        stream.sort(keys=["starttime"])
+        self.assertEqual(len(stream), len(self.expected))
+        for got, want in zip(stream, self.expected):
+            self.assertEqual(got.id, want.id)
+            self.assertEqual(got.stats.starttime, want.stats.starttime)
+            np.testing.assert_array_equal(got.data, want.data)
+
+
+def decodeWaveforms(payload: bytes) -> list:
+    """Reads a JWF1 payload the way map.js does. Returns [(header entry, array)]."""
+    assert payload[:4] == MAGIC
+    headerLength = struct.unpack('<I', payload[4:8])[0]
+    dataStart = 8 + headerLength
+    assert dataStart % ALIGN == 0
+    out = []
+    for entry in json.loads(payload[8:dataStart])['traces']:
+        assert (dataStart + entry['offset']) % ALIGN == 0
+        dtype = {'int32': '<i4', 'float32': '<f4'}[entry['dtype']]
+        out.append((entry, np.frombuffer(payload, dtype=dtype, count=entry['length'], offset=dataStart + entry['offset'])))
+    return out
+
+
+class WaveformFormatTests(unittest.TestCase):
+
+    def trace(self, data, channel="HHZ", offset=0.0, rate=20.0):
+        start = obspy.UTCDateTime(2024, 1, 1) + offset
+        return obspy.Trace(data, header=dict(network="XX", station="TST", channel=channel, sampling_rate=rate, starttime=start))
+
+    def test_samples_round_trip(self):
+        ints = np.arange(-7, 6, dtype=np.int32)
+        floats = np.linspace(-1, 1, 9)
+        decoded = decodeWaveforms(encodeWaveforms(obspy.Stream([self.trace(ints), self.trace(floats, "HHN")])))
+        (intEntry, intValues), (floatEntry, floatValues) = decoded
+        self.assertEqual((intEntry['dtype'], intEntry['kind'], intEntry['npts']), ('int32', 'samples', 13))
+        np.testing.assert_array_equal(intValues, ints)
+        self.assertEqual((floatEntry['id'], floatEntry['dtype']), ("XX.TST..HHN", 'float32'))
+        np.testing.assert_array_equal(floatValues, floats.astype(np.float32))
+
+    def test_gappy_traces_are_split(self):
+        stream = obspy.Stream([self.trace(np.arange(5, dtype=np.int32)), self.trace(np.arange(3, dtype=np.int32), offset=10.0)])
+        decoded = decodeWaveforms(encodeWaveforms(stream.merge(method=1)))
+        self.assertEqual([e['npts'] for e, _ in decoded], [5, 3])
+        self.assertEqual([obspy.UTCDateTime(e['starttime']) for e, _ in decoded],
+                         [stream[0].stats.starttime, stream[0].stats.starttime + 10.0])
+        np.testing.assert_array_equal(decoded[1][1], [0, 1, 2])
+
+    def test_min_max(self):
+        data = np.random.default_rng(1).integers(-100, 100, 1000).astype(np.int32)
+        data[537] = 10000
+        (entry, values), = decodeWaveforms(encodeWaveforms(obspy.Stream([self.trace(data)]), width=10))
+        self.assertEqual((entry['kind'], entry['samplesPerPixel'], entry['length']), ('minmax', 100, 20))
+        runs = data.reshape(10, 100)
+        np.testing.assert_array_equal(values[0::2], runs.min(axis=1))
+        np.testing.assert_array_equal(values[1::2], runs.max(axis=1))
+        self.assertEqual(values.max(), 10000)
+
+    def test_pixels_never_exceed_width(self):
+        for npts in (999, 1000, 1001, 4321):
+            for width in (1, 7, 10, 333):
+                stream = obspy.Stream([self.trace(np.zeros(npts, dtype=np.int32))])
+                (entry, values), = decodeWaveforms(encodeWaveforms(stream, width=width))
+                if entry['kind'] == 'minmax':
+                    self.assertLessEqual(entry['length'] // 2, width, (npts, width))
+
+
+class StubDataselect:
+    """Stands in for fetchWaveforms: 20 Hz counts over the asked window, optionally held until released."""
+
+    def __init__(self, hold: bool = False):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def __call__(self, seedId, starttime, endtime, provider="IRIS"):
+        self.calls.append((seedId, starttime, endtime, provider))
+        self.started.set()
+        self.release.wait(10)
+        network, station, location, channel = seedId.split('.')
+        npts = int(round((endtime - starttime) * 20))
+        return obspy.Stream([obspy.Trace(np.arange(npts, dtype=np.int32), header=dict(
+            network=network, station=station, location=location, channel=channel, sampling_rate=20.0, starttime=starttime))])
+
+
+class WaveformCacheTests(unittest.TestCase):
+
+    seedId = "XX.TST..HHZ"
+    t0 = obspy.UTCDateTime(2020, 1, 1, 0, 1)
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cache = WaveformCache(directory=self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def stub(self, hold: bool = False):
+        stub = StubDataselect(hold)
+        patcher = mock.patch("jukbox.WaveformCache.fetchWaveforms", stub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return stub
+
+    def test_covering_window_is_served_from_disk(self):
+        fetch = self.stub()
+        first = self.cache.get(self.seedId, self.t0 + 10, self.t0 + 50)
+        # Fetched windows are widened to whole minutes.
+        self.assertEqual([(c[1], c[2]) for c in fetch.calls], [(self.t0, self.t0 + 60)])
+        self.assertEqual(first[0].stats.starttime, self.t0 + 10)
+        second = self.cache.get(self.seedId, self.t0 + 20, self.t0 + 40)
+        self.assertEqual(len(fetch.calls), 1)
+        self.assertEqual((second[0].stats.starttime, second[0].stats.endtime), (self.t0 + 20, self.t0 + 40))
+        self.assertEqual(second[0].data[0], 400)
+        self.cache.get(self.seedId, self.t0 + 20, self.t0 + 70)
+        self.assertEqual(len(fetch.calls), 2)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_concurrent_requests_share_one_fetch(self):
+        fetch = self.stub(hold=True)
+        results = {}
+
+        def get(name, start, end):
+            results[name] = self.cache.get(self.seedId, start, end)
+
+        owner = threading.Thread(target=get, args=("owner", self.t0 + 5, self.t0 + 55))
+        owner.start()
+        self.assertTrue(fetch.started.wait(10))
+        waiters = [threading.Thread(target=get, args=(f"w{i}", self.t0 + i, self.t0 + 30 + i)) for i in range(1, 4)]
+        for waiter in waiters:
+            waiter.start()
+        deadline = time.monotonic() + 10
+        while self.cache.stats()['coalesced'] < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        fetch.release.set()
+        for thread in [owner] + waiters:
+            thread.join(10)
+        self.assertEqual(len(fetch.calls), 1)
+        self.assertEqual(self.cache.stats()['coalesced'], 3)
+        self.assertEqual(results["w2"][0].stats.starttime, self.t0 + 2)
+        self.assertEqual(results["w2"][0].stats.npts, 601)
+
+    def test_unsettled_windows_are_fetched_every_time(self):
+        fetch = self.stub()
+        now = obspy.UTCDateTime()
+        self.assertFalse(self.cache.settled(now.timestamp))
+        self.assertTrue(self.cache.settled(self.t0.timestamp))
+        for _ in range(2):
+            self.cache.get(self.seedId, now - 120, now - 60)
+        self.assertEqual(len(fetch.calls), 2)
+
+    def test_file_evicted_before_read_is_fetched_again(self):
+        fetch = self.stub()
+        self.cache.get(self.seedId, self.t0 + 10, self.t0 + 50)
+        touch = self.cache.store.touch
+
+        def evictAfterTouch(path):
+            # Another request's eviction lands between covering() and the read.
+            self.cache.store.touch = touch
+            found = touch(path)
+            os.remove(path)
+            return found
+
+        self.cache.store.touch = evictAfterTouch
+        stream = self.cache.get(self.seedId, self.t0 + 20, self.t0 + 40)
+        self.assertEqual(stream[0].stats.npts, 401)
+        self.assertEqual(len(fetch.calls), 2)
+
+
+class EventCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_created_on_first_use(self):
+        path = os.path.join(self.dir, "cache", "events.sqlite3")
+        cache = EventCache(path)
+        self.assertFalse(os.path.exists(os.path.dirname(path)))
+        query = ("USGS", 40.0, 40.0, 180, "2012-04-04", "2012-04-05", None, 10)
+        self.assertIsNone(cache.get(*query))
+        self.assertTrue(os.path.exists(path))
+        cache.put(*query, obspy.read_events())
+        self.assertEqual(len(cache.get(*query)), 3)
+
+
+class CatalogFdsn:
+    """Stands in for AsyncFdsnClient, answering every provider with the same catalog."""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    async def getEvents(self, provider, *args):
+        return self.catalog.copy()
+
+
+class FederatedSearchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.map = Map.instance()
+
+    def parsed(self, mode: str) -> dict:
+        # The example catalog has no focal mechanisms, like most EMSC, GEOFON and ISC answers.
+        search = FederatedSearch(fdsn=CatalogFdsn(obspy.read_events()))
+        catalog = asyncio.run(search.search(mode, 40.0, 40.0, 180, None, None, providers=["EMSC", "GEOFON"]))
+        query = MapQuery(selectedClient="USGS", federation=mode)
+        self.map.parseEvents(query, catalog)
+        return query.eventsById
+
+    def test_merge_keeps_events_without_tensors(self):
+        events = self.parsed(MERGE)
+        self.assertEqual(sorted(e["mag"] for e in events.values()), [3.0, 4.3, 4.4])
+        self.assertTrue(all(e["icon"].endswith("center.png") for e in events.values()))
+
+    def test_fastest_keeps_events_without_tensors(self):
+        self.assertEqual(len(self.parsed(FASTEST)), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,13 +22,20 @@ from django.urls import path
 from django.conf import settings
 from django.conf.urls.static import static 
 from django.contrib import admin    
-from django.urls import path, include
+from django.urls import path, re_path, include
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('record/', views.record_view, name='record-view'),
     path('stream-inline', views.stream_spectrogram_inline, name='stream-inline'),
+    path('spectrogram/<str:file_name>/pyramid/', views.spectrogram_pyramid, name='spectrogram_pyramid'),
+    path('spectrogram/<str:file_name>/tile/<int:level>/<int:index>.png', views.spectrogram_tile, name='spectrogram_tile'),
+    path('jobs/<str:job_id>/', views.job_status, name='job_status'),
     path('search_quakes/', views.search_quakes, name='search_quakes'),
+    path('search_quakes/stream/', views.search_quakes_stream, name='search_quakes_stream'),
+    path('fdsn_health/', views.fdsn_health, name='fdsn_health'),
+    path('fetch_waves/', views.fetch_waves, name='fetch_waves'),
+    re_path(r'^beachball/(?P<key>[0-9a-f]{40})\.png$', views.beachball_icon, name='beachball_icon'),
     path('map/', views.mapView, name='mapView'),
     path('graph/', views.graph, name="graph")
 
@@ -1,20 +1,29 @@
 import json
 import os
+import asyncio
 import io
 import time
-from jukbox.Map import Map
+from jukbox.Map import Map, MapQuery
+from jukbox.FederatedSearch import requestedProviders
+from jukbox.ClientPool import clientPool, providerName
+from jukbox.BeachballCache import beachballCache
 from datetime import datetime
 from django.conf import settings
 from django.shortcuts import render, redirect
 import folium
 from .forms import FileUploadForm
 from .process import generate_spectrogram
-from django.http import JsonResponse, StreamingHttpResponse
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
-from PIL import Image
+from django.http import JsonResponse, StreamingHttpResponse, FileResponse, HttpResponse, Http404
 import obspy
+from jukbox.Spectrogram import rollingFrames
+from jukbox.StreamHub import streamHub
+from jukbox.SpectrogramPyramid import loadPyramid, removePyramid
+from jukbox.JobQueue import jobQueue
+from jukbox.Waveform import encodeWaveforms, encodeMseed, MAX_WIDTH, WAVEFORM_PROVIDERS
+from jukbox.WaveformCache import waveformCache
+from obspy import UTCDateTime
+from django.core.handlers.asgi import ASGIRequest
+from asgiref.sync import sync_to_async
 from django.shortcuts import render
 from django.views.decorators.csrf import csrf_exempt
 
@@ -23,6 +32,9 @@ from django.views.decorators.csrf import csrf_exempt
 def graph(request):
     return render(request,'base.html',context={'text':'hello world'})
 
+def spectrogramExists(job) -> bool:
+    return bool(job.result) and os.path.exists(os.path.join(settings.MEDIA_ROOT, 'images', job.result))
+
 def image_list(request):
     if request.method == 'POST':
         if 'delete' in request.POST:
@@ -34,13 +46,21 @@ def image_list(request):
 
             if os.path.exists(file_path):
                 os.remove(file_path)
+            removePyramid(file_name)
+            jobQueue.forget(file_name)
             return redirect('image_list')
 
         elif 'process' in request.POST:
+            # Processing runs on the job queue; the page follows it over ws/jobs/<id>/ or by polling.
             file_name = request.POST['process']
             file_path = os.path.join(settings.MEDIA_ROOT, 'uploads', file_name)
+            job = None
             if os.path.exists(file_path):
-                generate_spectrogram(file_path)
+                job = jobQueue.submit('spectrogram', file_path, generate_spectrogram, outputExists=spectrogramExists)
+            if request.headers.get('x-requested-with') == 'fetch':
+                if job is None:
+                    return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
+                return JsonResponse({'status': 'success', 'job': jobQueue.snapshot(job)}, status=202)
             return redirect('image_list')
 
         else:
@@ -80,6 +100,35 @@ def image_list(request):
     return render(request, 'jukbox/image_list.html', context)
 
 
+def job_status(request, job_id):
+    job = jobQueue.get(job_id)
+    if job is None:
+        return JsonResponse({'status': 'error', 'message': 'Unknown job'}, status=404)
+    return JsonResponse({'status': 'success', 'job': jobQueue.snapshot(job)})
+
+
+def spectrogram_pyramid(request, file_name):
+    pyramid = loadPyramid(file_name)
+    if pyramid is None:
+        return JsonResponse({'status': 'error', 'message': 'Spectrogram not processed yet'}, status=404)
+    return JsonResponse({'status': 'success', 'pyramid': pyramid.meta})
+
+
+def spectrogram_tile(request, file_name, level, index):
+    pyramid = loadPyramid(file_name)
+    if pyramid is None:
+        raise Http404("Spectrogram not processed yet")
+    try:
+        png = pyramid.renderTile(level, index)
+    except IndexError:
+        raise Http404("No such tile")
+    response = HttpResponse(png, content_type='image/png')
+    # Tiles only change when the upload is processed again, which changes the ETag.
+    response['ETag'] = f'"{pyramid.meta["sourceMtime"]}-{level}-{index}"'
+    response['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+
 def record_view(request):
     if request.method == 'POST':
         file_name = request.POST.get('fileName')
@@ -100,44 +149,16 @@ def record_view(request):
     return JsonResponse({'status': 'error', 'message': 'Invalid request.'})
 
 
-def spectrogram_stream(filePath):
-    st = obspy.read(filePath)
-    st = st.select(component='Z')
-    if not st:
-        return
-
-    trace = st[0]
-    sr = trace.stats.sampling_rate
-    chunk_size = int(sr * 2)
-    total_samples = len(trace.data)
-
-    fig, ax = plt.subplots(figsize=(10, 6))
-
-    for i in range(0, total_samples, chunk_size):
-        segment = trace.data[i:i+chunk_size]
-
-        ax.clear()
-        ax.specgram(segment, Fs=sr, NFFT=256, noverlap=128,
-                    scale='dB', sides='default', cmap='magma')
-        ax.set_title("Live Spectrogram")
-        ax.set_xlabel("Time (s)")
-        ax.set_ylabel("Frequency (Hz)")
-        ax.set_xlim(0, 2)
-        ax.set_ylim(1, 40)
-
-        buf = io.BytesIO()
-        fig.canvas.draw()
-        img = Image.frombytes('RGB', fig.canvas.get_width_height(), fig.canvas.tostring_rgb())
-        img.save(buf, format='JPEG')
-        frame = buf.getvalue()
+STREAM_SPAN = 30
+STREAM_FPS = 10
 
+
+def spectrogram_stream(filePath):
+    # Scrolls the last 30 s at the file's own sample rate; only the new columns are computed each tick.
+    for frame in rollingFrames(filePath, component='Z', fps=STREAM_FPS, span=STREAM_SPAN, size=(1000, 600)):
         yield (b'--frame\r\n'
                b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
 
-        time.sleep(0.5)
-
-    plt.close(fig)
-
 
 def stream_spectrogram_inline(request):
     filename = request.GET.get('filename')
@@ -148,7 +169,14 @@ def stream_spectrogram_inline(request):
     if not os.path.exists(file_path):
         return JsonResponse({'status': 'error', 'message': 'File not found'}, status=404)
 
-    return StreamingHttpResponse(spectrogram_stream(file_path), content_type='multipart/x-mixed-replace; boundary=frame')
+    # Every viewer of the same file shares one producer; each gets the newest frame when it is ready for one.
+    key = (file_path, os.path.getmtime(file_path), STREAM_SPAN, STREAM_FPS)
+    factory = lambda: spectrogram_stream(file_path)
+    if isinstance(request, ASGIRequest):
+        frames = streamHub.aframes(key, factory)
+    else:
+        frames = streamHub.frames(key, factory)
+    return StreamingHttpResponse(frames, content_type='multipart/x-mixed-replace; boundary=frame')
 
 
 
@@ -168,12 +196,26 @@ def mapView(request):
 
     return render(request, 'map.html', {'mapHtml': mapHtml, 'lat': lat, 'lng': lng})
 
+def queryFromSearchData(search_data):
+    # Extract the search parameters
+    return MapQuery(
+        lat=search_data.get('latLng').get('lat'),
+        lon=search_data.get('latLng').get('lng'),
+        currentRadius=int(search_data.get('maxRad')),
+        dateRange=(datetime.strptime(search_data.get('startDate'), '%Y-%m-%d'), datetime.strptime(search_data.get('endDate'), '%Y-%m-%d')),
+        minMag=search_data.get('minMag'),
+        selectedClient='USGS',
+        # Optional federated search: {'federation': 'fastest' | 'merge', 'providers': ['USGS', 'EMSC', ...]}
+        federation=search_data.get('federation'),
+        providers=requestedProviders(search_data.get('providers'))
+    )
+
+
 @csrf_exempt
-def search_quakes(request):
+async def search_quakes(request):
     if request.method == 'POST':
         print("Received POST request for earthquake search")
         try:
-            map = Map()
             # Get the data from the POST request (JSON format)
             search_data = json.loads(request.body)
 
@@ -181,32 +223,118 @@ def search_quakes(request):
 
 
             print(f"Search data received: {search_data}")
-            # Extract the search parameters
-            map.lat = search_data.get('latLng').get('lat')
-            map.lon = search_data.get('latLng').get('lng')
-            map.currentRadius = int(search_data.get('maxRad'))
-            map.dateRange = datetime.strptime(search_data.get('startDate'), '%Y-%m-%d'),datetime.strptime(search_data.get('endDate'), '%Y-%m-%d')
-            map.minMag = search_data.get('minMag')
-            map.selectedClient = 'USGS'
-
-            searchResults = map.eventSearch()
+            query = queryFromSearchData(search_data)
+
+            searchResults = await Map.instance().eventSearchAsync(query)
             
             response_data = {
                 'status': 'success',
-                'message': f'Search completed for magnitude {map.minMag}.',
+                'message': f'Search completed for magnitude {query.minMag}.',
                 'events': searchResults.get('events', {}),  # Include the events in the response
+                'stations': searchResults.get('stations', {}),
             }
 
 
             return JsonResponse(response_data, status=200)
 
+        except asyncio.CancelledError:
+            # Django cancels the view when the browser disconnects; the FDSN requests go with it.
+            print("Earthquake search cancelled by client disconnect")
+            raise
         except Exception as e:
             # If something goes wrong, return an error message (without displaying it)
             return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
 
             
             
+def beachball_icon(request, key):
+    # Icons are content addressed, so a rendered one never changes.
+    path = beachballCache.wait(key)
+    if path is None:
+        raise Http404("Beachball not found")
+    response = FileResponse(open(path, 'rb'), content_type='image/png')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+async def iterateInThread(iterator):
+    """
+    Async iterator over a blocking one, advanced one item at a time in a worker
+    thread. Under ASGI Django buffers a sync iterator completely before sending it.
+    """
+    done = object()
+    while True:
+        item = await sync_to_async(next, thread_sensitive=False)(iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+@csrf_exempt
+def search_quakes_stream(request):
+    """
+    Streaming variant of search_quakes. Answers with newline delimited JSON:
+    one message per event as soon as it is parsed, then beachball icons as
+    they finish rendering, then the closest stations per event, then 'done'.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request.'}, status=405)
+    try:
+        query = queryFromSearchData(json.loads(request.body))
+    except Exception as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+    def stream():
+        try:
+            for message in Map.instance().iterEventSearch(query, waitForIcons=True, includeStations=True):
+                yield json.dumps(message) + "\n"
+            yield json.dumps({'type': 'done', 'count': len(query.eventsById)}) + "\n"
+        except Exception as e:
+            print(f"Event search stream error: {e}")
+            yield json.dumps({'type': 'error', 'message': str(e)}) + "\n"
+
+    content = stream()
+    if isinstance(request, ASGIRequest):
+        content = iterateInThread(content)
+    response = StreamingHttpResponse(content, content_type='application/x-ndjson')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def fdsn_health(request):
+    return JsonResponse({'status': 'success', 'providers': clientPool.health(), 'waveforms': waveformCache.stats()})
+
+
 def fetch_waves(request):
-    if request.method == 'POST':
-        print("Received POST request for fetching waves")
+    """
+    Caching dataselect proxy. Waveforms for one station channel as a binary
+    payload (see Waveform.py), min/max decimated to `width` pixels when given,
+    or as miniSEED with format=mseed.
+    Parameters: seedId (NET.STA.LOC.CHA), start (ISO time), end or duration
+    (seconds, default 1200), width, format, provider (one of WAVEFORM_PROVIDERS).
+    """
+    params = request.POST if request.method == 'POST' else request.GET
+    try:
+        # Checked before anything else: the name picks the host fetched from and names cache files.
+        provider = providerName(params.get('provider', 'IRIS'), WAVEFORM_PROVIDERS)
+        start = UTCDateTime(params['start'])
+        end = UTCDateTime(params['end']) if params.get('end') else start + float(params.get('duration', 1200))
+        width = min(int(params['width']), MAX_WIDTH) if params.get('width') else None
+        stream = waveformCache.get(params['seedId'], start, end, provider)
+    except (KeyError, ValueError, TypeError) as e:
+        return JsonResponse({'status': 'error', 'message': f'Invalid waveform request: {e}'}, status=400)
+    except (ConnectionError, TimeoutError) as e:
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=503)
+    except Exception as e:
+        print(f"Error fetching waveforms: {e}")
+        return JsonResponse({'status': 'error', 'message': str(e)}, status=502)
+
+    if params.get('format') == 'mseed':
+        response = HttpResponse(encodeMseed(stream), content_type='application/vnd.fdsn.mseed')
+    else:
+        response = HttpResponse(encodeWaveforms(stream, width), content_type='application/octet-stream')
+    # Windows still inside the settle period are refetched by the cache, so browsers must not keep them either.
+    response['Cache-Control'] = 'public, max-age=3600' if waveformCache.settled(end.timestamp) else 'no-cache'
+    return response
 
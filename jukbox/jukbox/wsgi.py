@@ -12,5 +12,7 @@ import os
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'jukbox.settings')
+# Tells JukboxConfig.ready that this process serves requests, so FDSN clients are warmed.
+os.environ.setdefault('JUKBOX_SERVING', '1')
 
 application = get_wsgi_application()